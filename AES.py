@@ -1,19 +1,24 @@
 from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
 import base64
+import binascii
 import hashlib
 
 
 class AESCipher:
+    KEY_STR = 'NT106.ANTN2019-NHOM-1'
+
+    # sha256 to return 256 key, set AES256. Derived once, not for every message
+    KEY = hashlib.sha256(KEY_STR.encode()).digest()
+
     def __init__(self):
         """
         initiale AES encryption with hard code key and initial vector
         """
 
         self.block_size = AES.block_size
-        self.key_str = 'NT106.ANTN2019-NHOM-1'
-
-        # sha256 to return 256 key, set AES256
-        self.key = hashlib.sha256(self.key_str.encode()).digest()
+        self.key_str = AESCipher.KEY_STR
+        self.key = AESCipher.KEY
 
         # initial vector 16 bytes length
         self.iv = b'ANTN2019ANTN2019'
@@ -30,11 +35,13 @@ class AESCipher:
     def decrypt(self, cipher):
         """
         AES 256 decrypt return turn a recovered string
+        cipher can be any bytes-like object, such as a memoryview over a receive buffer.
+        Raise ValueError if it is not a whole number of blocks or its padding is invalid
         """
 
-        cipher = base64.b64decode(cipher)
         decryption = AES.new(self.key, AES.MODE_CBC, self.iv)
-        return self.unpadding(decryption.decrypt(cipher)).decode('utf-8')
+        plain = decryption.decrypt(binascii.a2b_base64(cipher))
+        return unpad(plain, self.block_size).decode('utf-8')
 
     def padding(self, msg):
         """
@@ -0,0 +1,43 @@
+import threading
+
+
+class BufferPool:
+    def __init__(self, size: int, count: int):
+        """
+        Init a pool of preallocated receive buffers, for recvfrom_into() to write datagrams
+        into instead of allocating a new bytes object for every one of them.
+
+        A buffer is taken before receiving and given back once the datagram it holds has
+        been answered. When every buffer is in use, a new one is allocated and counted.
+
+        Parameters:
+        size            -> Size in bytes of every buffer
+        count           -> Number of buffers allocated up front
+        """
+        self._size = size
+        self._free = [bytearray(size) for _ in range(count)]
+        self._lock = threading.Lock()
+        self._stats = dict(taken=0, allocated=0)
+
+    def take(self) -> bytearray:
+        """Return a free buffer, allocating one if there is none."""
+        with self._lock:
+            self._stats["taken"] += 1
+            if self._free:
+                return self._free.pop()
+            self._stats["allocated"] += 1
+        return bytearray(self._size)
+
+    def give(self, buffer: bytearray):
+        """Give back a buffer taken from the pool."""
+        with self._lock:
+            self._free.append(buffer)
+
+    def get_stats(self):
+        """Return how many buffers were taken, how many had to be allocated, and how many are free."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["free"] = len(self._free)
+        return stats
+
+    stats = property(get_stats)
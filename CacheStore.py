@@ -0,0 +1,522 @@
+import heapq
+import os
+import struct
+import sys
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from itertools import groupby, islice
+from ResourceRecord import ResourceRecord
+from MemoryCache import MemoryCache
+from configurator import Configurator
+from time import time, perf_counter
+
+
+class CacheStore(ABC):
+    """
+    An abstract base class for the stores that cache ResourceRecords.
+
+    The public methods (add_to_database, add_many, add_negative, query_rrset, query_negative,
+    query_from_database, sweep, snapshots and statistics) are implemented here once, on top of
+    a small set of storage primitives that every backend implements:
+
+    _store_record       -> upsert one record of an RRset
+    _store_rrsets       -> replace whole RRsets
+    _store_negative     -> store a negative answer
+    _fetch_rrset        -> read a live RRset
+    _fetch_negative     -> read a live negative answer
+    _expire             -> delete a bounded batch of expired entries
+    _earliest_ttd       -> return the earliest time-to-die stored
+    _dump / _load       -> export and bulk-import entries for snapshots
+    _close              -> release the resources of the backend
+
+    A key is a tuple of (name, type, class). An RRset is stored as a list of (ttl, rdata) rows
+    sharing one time-to-die.
+    """
+
+    # Snapshot files are columnar and little-endian: a header of (magic, number of entries,
+    # length of the names blob, length of the data blob), one packed array per numeric column,
+    # then the names and the data, each as a single NUL-separated UTF-8 blob.
+    # Numeric columns: kind (0 record, 1 negative answer), type, class,
+    # ttl (rcode for negative answers) and ttd.
+    SNAPSHOT_MAGIC = b"DNSSNAP2"
+    SNAPSHOT_HEADER = struct.Struct("<8sIII")
+    SNAPSHOT_COLUMNS = ("B", "H", "H", "I", "q")
+
+    def __init__(self, name: str, memory_cache: MemoryCache = None):
+        """
+        Init the parts shared by every store.
+
+        If a MemoryCache is given, it is used as a tier in front of the store:
+        lookups are answered from memory when possible, and every write goes
+        to both the memory tier and the store.
+        """
+        self._name = name
+        self._memory_cache = memory_cache
+
+        # Min-heap of distinct times-to-die, so that a sweep knows whether
+        # anything has expired without scanning the store
+        self._expiry_heap = []
+        self._expiry_set = set()
+        self._expiry_lock = threading.Lock()
+
+        # Background tasks by name, each a tuple of (thread, stop event)
+        self._tasks = {}
+
+        self._sweep_lock = threading.Lock()
+        self._sweep_stats = dict(sweeps=0, purged=0, last_purged=0, last_seconds=0.0)
+
+        # Seconds expired RRsets are kept for query_stale_rrset before a sweep deletes them
+        self._stale_grace = 0
+
+        self._stats_lock = threading.Lock()
+        self._stats = dict(lookups=0, hits=0, negative_hits=0, time_to_first_hit=None)
+        self._opened_at = perf_counter()
+
+    @abstractmethod
+    def _store_record(self, key: tuple, ttl: int, rdata: str, ttd: int):
+        """Insert one record into the RRset of key, or renew it if it is already stored."""
+
+    @abstractmethod
+    def _store_rrsets(self, rrsets: list):
+        """
+        Replace the RRsets of a list of (key, rows, ttd) tuples, where rows is a list of
+        (ttl, rdata), and drop the negative answers of those keys. The replacement is atomic.
+        """
+
+    @abstractmethod
+    def _store_negative(self, key: tuple, rcode: int, ttd: int):
+        """Store a negative answer for key and drop its RRset."""
+
+    @abstractmethod
+    def _fetch_rrset(self, key: tuple, now: int):
+        """Return a tuple of (rows, ttd) for the live RRset of key, or None."""
+
+    @abstractmethod
+    def _fetch_negative(self, key: tuple, now: int):
+        """Return a tuple of (rcode, ttd) for the live negative answer of key, or None."""
+
+    @abstractmethod
+    def _expire(self, now: int, batch_size: int) -> int:
+        """Delete at most batch_size entries that expired before now. Return how many were deleted."""
+
+    @abstractmethod
+    def _earliest_ttd(self):
+        """Return the earliest time-to-die of the stored entries, or None if the store is empty."""
+
+    @abstractmethod
+    def _dump(self, now: int) -> list:
+        """
+        Return the live entries as (kind, type, class, ttl, ttd, name, data) tuples,
+        ordered by kind and key. kind is 0 for records and 1 for negative answers,
+        whose ttl is their rcode and data is empty.
+        """
+
+    @abstractmethod
+    def _load(self, records: list, negatives: list):
+        """
+        Bulk-insert (name, type, class, ttl, data, ttd) records and
+        (name, type, class, rcode, ttd) negative answers.
+        """
+
+    def _compact(self):
+        """Give space freed by a sweep back to the system. Nothing to do by default."""
+
+    def _close(self):
+        """Release the resources of the backend. Nothing to do by default."""
+
+    def close(self):
+        """Stop the background tasks and release the resources of the store."""
+        for task_name in list(self._tasks):
+            self._stop_periodic(task_name)
+        self._close()
+
+    def get_name(self):
+        """Return the name of the store."""
+        return self._name
+
+    name = property(get_name)
+
+    def _schedule_expiry(self, ttd: int):
+        """Remember that an entry expires at ttd."""
+        with self._expiry_lock:
+            if ttd not in self._expiry_set:
+                self._expiry_set.add(ttd)
+                heapq.heappush(self._expiry_heap, ttd)
+
+    def _schedule_earliest(self):
+        """Schedule the earliest time-to-die stored."""
+        earliest = self._earliest_ttd()
+        if earliest is not None:
+            self._schedule_expiry(earliest)
+
+    def _pop_expired(self, now: int) -> bool:
+        """Pop every time-to-die before now. Return True if there was any."""
+        expired = False
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0] < now:
+                self._expiry_set.discard(heapq.heappop(self._expiry_heap))
+                expired = True
+        return expired
+
+    def sweep(self, batch_size: int = 500) -> tuple:
+        """
+        Delete the expired entries in batches of at most batch_size,
+        so that writers are never blocked for long.
+        Return a tuple of (number of entries purged, seconds spent).
+        """
+        now = int(time()) - self._stale_grace
+        if not self._pop_expired(now):
+            return 0, 0.0
+
+        with self._sweep_lock:
+            start = perf_counter()
+            purged = 0
+            while True:
+                deleted = self._expire(now, batch_size)
+                purged += deleted
+                if deleted < batch_size:
+                    break
+            seconds = perf_counter() - start
+
+            # Entries loaded from disk were never pushed to the heap individually,
+            # so reschedule the earliest one that is still stored
+            self._schedule_earliest()
+            self._compact()
+
+            self._sweep_stats["sweeps"] += 1
+            self._sweep_stats["purged"] += purged
+            self._sweep_stats["last_purged"] = purged
+            self._sweep_stats["last_seconds"] = seconds
+
+        return purged, seconds
+
+    def _start_periodic(self, task_name: str, interval: float, task):
+        """Run task on a daemon thread every interval seconds until the task is stopped."""
+        if task_name in self._tasks:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    task()
+                except Exception as e:
+                    print(f"[ERROR] Exception while running {task_name} on {self._name}: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        self._tasks[task_name] = (thread, stop)
+        thread.start()
+
+    def _stop_periodic(self, task_name: str):
+        """Stop a task started by _start_periodic and wait for its thread."""
+        thread, stop = self._tasks.pop(task_name, (None, None))
+        if thread is not None:
+            stop.set()
+            thread.join()
+
+    def start_sweeper(self, interval: float = 30, batch_size: int = 500):
+        """
+        Start a background thread that deletes expired entries every interval seconds,
+        so that expiry is kept off the request path.
+        """
+        def sweep_and_report():
+            purged, seconds = self.sweep(batch_size)
+            if purged:
+                print(f"[DATABASE] Purged {purged} expired records from {self._name} "
+                      f"in {seconds * 1000:.1f} ms")
+
+        self._start_periodic("sweeper", interval, sweep_and_report)
+
+    def stop_sweeper(self):
+        """Stop the background sweeper thread."""
+        self._stop_periodic("sweeper")
+
+    def get_sweep_stats(self):
+        """Return a copy of the sweep counters and the duration of the last sweep."""
+        with self._sweep_lock:
+            return dict(self._sweep_stats)
+
+    sweep_stats = property(get_sweep_stats)
+
+    def _count(self, counter: str):
+        """Increment a lookup counter."""
+        with self._stats_lock:
+            self._stats[counter] += 1
+            if counter == "hits" and self._stats["time_to_first_hit"] is None:
+                self._stats["time_to_first_hit"] = perf_counter() - self._opened_at
+
+    def get_stats(self):
+        """
+        Return a copy of the lookup counters.
+        Positive hits and negative hits are counted separately, and time_to_first_hit
+        is the number of seconds between opening the store and its first hit.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    stats = property(get_stats)
+
+    def save_snapshot(self, path: str) -> int:
+        """
+        Dump the live records and negative answers to a compact columnar snapshot file.
+        The file is replaced atomically. Return the number of entries written.
+        """
+        rows = self._dump(int(time()))
+
+        columns = list(zip(*rows)) if rows else [()] * 7
+        names = "\0".join(columns[5]).encode()
+        data = "\0".join(columns[6]).encode()
+
+        chunks = [self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, len(rows), len(names), len(data))]
+        for typecode, values in zip(self.SNAPSHOT_COLUMNS, columns):
+            column = array(typecode, values)
+            if sys.byteorder == "big":
+                column.byteswap()
+            chunks.append(column.tobytes())
+        chunks.append(names)
+        chunks.append(data)
+
+        with open(path + ".tmp", "wb") as snapshot:
+            snapshot.write(b"".join(chunks))
+        os.replace(path + ".tmp", path)
+        return len(rows)
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Bulk-load the entries of a snapshot file that have not expired yet,
+        into the store and into the memory tier.
+        Return the number of entries loaded.
+        """
+        now = int(time())
+        with open(path, "rb") as snapshot:
+            buffer = snapshot.read()
+
+        magic, count, names_length, data_length = self.SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != self.SNAPSHOT_MAGIC:
+            raise Exception(f"{path} is not a cache snapshot.")
+
+        columns = []
+        offset = self.SNAPSHOT_HEADER.size
+        for typecode in self.SNAPSHOT_COLUMNS:
+            column = array(typecode)
+            column.frombytes(buffer[offset:offset + column.itemsize * count])
+            if sys.byteorder == "big":
+                column.byteswap()
+            offset += column.itemsize * count
+            columns.append(column)
+        names = buffer[offset:offset + names_length].decode().split("\0")
+        offset += names_length
+        data = buffer[offset:offset + data_length].decode().split("\0")
+
+        kinds, types, classes, ttls, ttds = columns
+        records = []
+        negatives = []
+        for kind, domain, rr_type, rr_class, ttl, rdata, ttd in zip(kinds, names, types, classes,
+                                                                     ttls, data, ttds):
+            if ttd < now:
+                continue
+            if kind == 0:
+                records.append((domain, rr_type, rr_class, ttl, rdata, ttd))
+            else:
+                negatives.append((domain, rr_type, rr_class, ttl, ttd))
+
+        self._load(records, negatives)
+        self._schedule_earliest()
+
+        if self._memory_cache is not None:
+            # Snapshots are ordered by key, so the records of an RRset are adjacent.
+            # Only materialize as many RRsets as the memory tier can hold.
+            rrsets = groupby(records, key=lambda record: record[:3])
+            for key, rows in islice(rrsets, self._memory_cache.max_entries):
+                rows = list(rows)
+                self._memory_cache.put(*key, [ResourceRecord(*row[:5]) for row in rows],
+                                       min(row[5] for row in rows))
+            for domain, rr_type, rr_class, rcode, ttd in negatives:
+                self._memory_cache.put(domain, rr_type, rr_class, rcode, ttd)
+
+        return len(records) + len(negatives)
+
+    def start_snapshots(self, path: str, interval: float = 300):
+        """Start a background thread that saves a snapshot to path every interval seconds."""
+        self._start_periodic("snapshots", interval, lambda: self.save_snapshot(path))
+
+    def stop_snapshots(self):
+        """Stop the background snapshot thread."""
+        self._stop_periodic("snapshots")
+
+    def refresh(self):
+        """
+        Refresh the store to remove out-dated caches.
+        Lookups already ignore expired entries, so this is only needed to reclaim space
+        immediately; the background sweeper does it periodically otherwise.
+        """
+        self.sweep()
+
+    def add_to_database(self, rr: ResourceRecord):
+        """
+        Add an RR to the store.
+        If the same record is already cached, its TTL is renewed instead of
+        adding a duplicate; other records of its RRset are kept.
+        """
+        if rr.ttl > 0:
+            ttd = int(time()) + rr.ttl
+            self._store_record((rr.name, rr.rr_type, rr.rr_class), rr.ttl, rr.rdata, ttd)
+            self._schedule_expiry(ttd)
+
+            if self._memory_cache is not None:
+                self._memory_cache.invalidate(rr.name, rr.rr_type, rr.rr_class)
+
+    def add_many(self, records: list):
+        """
+        Add a list of RRs to the store, grouped by RRset (name, type, class).
+        Each RRset replaces the one cached under the same key, and all of them
+        are written at once. An RRset expires when its record with the smallest TTL does.
+        """
+        rrsets = {}
+        for rr in records:
+            if rr.ttl > 0:
+                rrsets.setdefault((rr.name, rr.rr_type, rr.rr_class), []).append(rr)
+        if not rrsets:
+            return
+
+        now = int(time())
+        entries = [(key, [(rr.ttl, rr.rdata) for rr in rrset], now + min(rr.ttl for rr in rrset))
+                   for key, rrset in rrsets.items()]
+        self._store_rrsets(entries)
+
+        for key, _, ttd in entries:
+            self._schedule_expiry(ttd)
+            if self._memory_cache is not None:
+                self._memory_cache.put(*key, rrsets[key], ttd)
+
+    def add_negative(self, name: str, rr_type: int, rr_class: int, rcode: int, ttl: int):
+        """
+        Cache a negative answer for (name, type, class).
+        rcode is 3 (NXDOMAIN) if the name does not exist, or 0 (NODATA) if it
+        has no record of the requested type. Any cached RRset for the key is dropped.
+        """
+        if ttl > 0:
+            key = (name, rr_type, rr_class)
+            ttd = int(time()) + ttl
+            self._store_negative(key, rcode, ttd)
+            self._schedule_expiry(ttd)
+
+            if self._memory_cache is not None:
+                self._memory_cache.put(*key, rcode, ttd)
+
+    def query_negative(self, name: str, rr_type: int = 1, rr_class: int = 1):
+        """
+        Query a tuple of (name, type, class) for a live negative answer.
+        Return a tuple of (rcode, remaining TTL), or None if none is cached.
+        """
+        now = int(time())
+        answer = None
+        cached = None
+        if self._memory_cache is not None:
+            cached = self._memory_cache.get(name, rr_type, rr_class, now)
+
+        if cached is not None:
+            if not isinstance(cached[0], list):
+                answer = (cached[0], cached[1] - now)
+        else:
+            stored = self._fetch_negative((name, rr_type, rr_class), now)
+            if stored is not None:
+                answer = (stored[0], stored[1] - now)
+                if self._memory_cache is not None:
+                    self._memory_cache.put(name, rr_type, rr_class, stored[0], stored[1])
+
+        if answer is not None:
+            self._count("negative_hits")
+        return answer
+
+    def query_rrset(self, name: str, rr_type: int = 1, rr_class: int = 1) -> list:
+        """
+        Query a tuple of (name, type, class) for the live RRset.
+        Every record is returned with its TTL rewritten to the number of seconds
+        left until the RRset expires. An empty list means there is no match.
+        The lookup is answered from the memory tier if possible.
+        """
+        return self.query_rrset_with_ttl(name, rr_type, rr_class)[0]
+
+    def query_rrset_with_ttl(self, name: str, rr_type: int = 1, rr_class: int = 1) -> tuple:
+        """
+        Query a tuple of (name, type, class) like query_rrset, and also return the TTL the
+        RRset was cached with, to tell how much of it is left. Return ([], 0) if there is no match.
+        """
+        now = int(time())
+        self._count("lookups")
+        if self._memory_cache is not None:
+            cached = self._memory_cache.get(name, rr_type, rr_class, now)
+            if cached is not None:
+                rrset, ttd = cached
+                if not isinstance(rrset, list):
+                    # a negative answer is cached for this key
+                    return [], 0
+                self._count("hits")
+                return [rr.with_ttl(ttd - now) for rr in rrset], min(rr.ttl for rr in rrset)
+
+        stored = self._fetch_rrset((name, rr_type, rr_class), now)
+        if stored is None:
+            return [], 0
+
+        rows, ttd = stored
+        rrset = [ResourceRecord(name, rr_type, rr_class, ttl, rdata) for ttl, rdata in rows]
+        if self._memory_cache is not None:
+            self._memory_cache.put(name, rr_type, rr_class, rrset, ttd)
+        self._count("hits")
+        return [rr.with_ttl(ttd - now) for rr in rrset], min(ttl for ttl, _ in rows)
+
+    def keep_stale(self, grace: int):
+        """
+        Keep expired entries for grace seconds before sweeps delete them,
+        so that query_stale_rrset can still answer with them.
+        """
+        self._stale_grace = max(0, grace)
+
+    def query_stale_rrset(self, name: str, rr_type: int = 1, rr_class: int = 1) -> list:
+        """
+        Query a tuple of (name, type, class) for an RRset that expired less than the grace
+        of keep_stale() ago, or is still live. The records keep the TTL they were cached
+        with. An empty list means there is no match.
+        """
+        if self._stale_grace <= 0:
+            return []
+        key = (name, rr_type, rr_class)
+        stored = self._fetch_rrset(key, int(time()) - self._stale_grace)
+        if stored is None:
+            return []
+        return [ResourceRecord(name, rr_type, rr_class, ttl, rdata) for ttl, rdata in stored[0]]
+
+    def query_from_database(self, name: str, rr_type: int = 1,
+                            rr_class: int = 1) -> ResourceRecord:
+        """
+        Query a tuple of (name, type, class) for a live match.
+        Return the first record of the RRset with its remaining TTL, or None.
+        """
+        rrset = self.query_rrset(name, rr_type, rr_class)
+        return rrset[0] if rrset else None
+
+
+def create_store(name: str, backend: str = "sqlite", memory_cache: MemoryCache = None) -> CacheStore:
+    """
+    Create the cache store selected by backend for the given base name.
+
+    backend:
+    sqlite  -> Database, persisted in <name>.db
+    memory  -> DictStore, kept in process memory only
+    mmap    -> MmapStore, a hash table of Configurator.MMAP_SLOTS slots in <name>.mmap,
+               shared by every process that opens it. The memory tier is not used, since
+               it would keep serving the RRsets that another process replaced.
+    """
+    if backend == "sqlite":
+        from Database import Database
+        return Database(name + ".db", memory_cache=memory_cache)
+    elif backend == "memory":
+        from DictStore import DictStore
+        return DictStore(name, memory_cache=memory_cache)
+    elif backend == "mmap":
+        from MmapStore import MmapStore
+        return MmapStore(name + ".mmap", slots=Configurator.MMAP_SLOTS,
+                         slot_size=Configurator.MMAP_SLOT_SIZE, stripes=Configurator.MMAP_STRIPES)
+    raise Exception(f"Unknown cache backend: {backend}")
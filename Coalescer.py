@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        """An in-flight call of a Coalescer, and its outcome once it is done."""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    def __init__(self):
+        """
+        Init a table of in-flight calls, so that concurrent calls with the same key run once.
+
+        The first call of a key runs the function, and the calls made with that key while it
+        runs wait for it and get its result, or its exception.
+        """
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stats = dict(leaders=0, coalesced=0)
+
+    def call(self, key, function):
+        """Call function(), or wait for the in-flight call of key and return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if leader:
+            self._run(key, call, function)
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def start(self, key, function, submit):
+        """
+        Start function() on another thread unless a call of key is in flight, and return the
+        call: its done event is set once its result, or its error, is known. submit is called
+        with a callable to run, and returns False if it cannot run it; None is then returned.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                return call
+            call = self._calls[key] = _Call()
+            self._stats["leaders"] += 1
+
+        if not submit(lambda: self._run(key, call, function)):
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            return None
+        return call
+
+    def _run(self, key, call, function):
+        """Run the call of key, then remove it from the in-flight calls and wake up the callers waiting for it."""
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def call_async(self, key, function):
+        """
+        Await function(), or the in-flight call of key, and return its result.
+        The call runs in its own task, so that it completes for the other
+        callers if the one that started it is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None or task.get_loop() is not loop:
+                task = self._tasks[key] = loop.create_task(function())
+                task.add_done_callback(lambda done: self._forget(key, done))
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        """Remove the task of key once it is done."""
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def get_stats(self):
+        """
+        Return how many calls ran (leaders), how many waited for another
+        call of the same key (coalesced), and how many are in flight.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._tasks)
+        return stats
+
+    stats = property(get_stats)
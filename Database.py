@@ -1,139 +1,243 @@
 import sqlite3
-from ResourceRecord import ResourceRecord
-from time import time
-
-
-class Database:
-    def __init__(self, name: str):
-        """Init a aatabase to cache ResourceRecord."""
-        # Connect databae
-        self._name = name
-        conn = sqlite3.connect(self._name)
-        # Create a cursor
-        c = conn.cursor()
-
-        # Create table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Cache(
+import threading
+from CacheStore import CacheStore
+from MemoryCache import MemoryCache
+
+
+class Database(CacheStore):
+    # Pragmas applied to every connection opened by a Database object.
+    # WAL lets the UDP and TCP listener threads read while another thread writes,
+    # and synchronous=NORMAL only fsyncs at checkpoints instead of on every commit.
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-8000",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    # Schema migrations, applied in order to bring an existing database file up to date.
+    # The number of applied migrations is stored in the file's user_version.
+    MIGRATIONS = (
+        # 1: index the lookup key and the expiry time
+        (
+            "CREATE INDEX IF NOT EXISTS CacheKey ON Cache(domain, type, class)",
+            "CREATE INDEX IF NOT EXISTS CacheExpiry ON Cache(ttd)",
+        ),
+        # 2: drop duplicated records and make every record of an RRset unique
+        (
+            """
+            DELETE FROM Cache WHERE rowid NOT IN (
+                SELECT MAX(rowid) FROM Cache GROUP BY domain, type, class, data
+            )
+            """,
+            "DROP INDEX IF EXISTS CacheKey",
+            "CREATE UNIQUE INDEX IF NOT EXISTS CacheRecord ON Cache(domain, type, class, data)",
+        ),
+        # 3: cache negative answers (NXDOMAIN and NODATA) with their response code
+        (
+            """
+            CREATE TABLE IF NOT EXISTS NegativeCache(
                 domain text,
                 type integer,
                 class integer,
-                ttl integer,
-                data text,
+                rcode integer,
                 ttd integer
             )
-        """)
-
-        # Commit connect
-        conn.commit()
-        # Close connect
-        conn.close()
-
-    def refresh(self):
-        """ 
-        Refresh the database to remove out-dated caches. 
-        """
-        # Connect database
-        conn = sqlite3.connect(self._name)
-        # Create cursor
-        c = conn.cursor()
-
-        c.execute("SELECT strftime('%s','now')")
-        timestamp = (int(c.fetchone()[0]))
-        time = (timestamp,)
-
-        # sqlite3 doesn't support literal value comparision;
-        # therefore an temporary _Variables table is necessary.
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS _Variables(timestamp INTEGER)
-        """)
-        c.execute("INSERT INTO _Variables VALUES (?)", time)
-
-        c.execute("""
-            DELETE FROM Cache
-            WHERE ttd < (SELECT timestamp FROM _Variables)
-        """)
-
-        c.execute("DROP TABLE _Variables")
-        # Commit connect
-        conn.commit()
-        # Close connect
-        conn.close()
-
-    def add_to_database(self, rr: ResourceRecord):
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS NegativeKey ON NegativeCache(domain, type, class)",
+            "CREATE INDEX IF NOT EXISTS NegativeExpiry ON NegativeCache(ttd)",
+        ),
+        # 4: let sweeps hand free pages back to the file system. Switching an existing
+        # file to incremental auto-vacuum only takes effect after a full VACUUM.
+        (
+            "PRAGMA auto_vacuum=INCREMENTAL",
+            "VACUUM",
+        ),
+    )
+
+    # Tables holding records that expire, purged by sweep()
+    EXPIRING_TABLES = ("Cache", "NegativeCache")
+
+    # Seconds a connection waits for a lock held by another thread before failing
+    BUSY_TIMEOUT = 5.0
+
+    def __init__(self, name: str, memory_cache: MemoryCache = None):
         """
-        Add an RR to database.
-        """
-        if rr.ttl > 0:
-            # Connect database
-            conn = sqlite3.connect(self._name)
-            # Create cursor
-            c = conn.cursor()
+        Init a SQLite database to cache ResourceRecord.
 
-            ttd = int(time()) + rr.ttl
+        Each thread that uses this object gets its own long-lived connection,
+        which is opened on first use and reused until close() is called.
 
-            data = (rr.name, rr.rr_type, rr.rr_class,
-                    rr.ttl, rr.rdata, ttd)
+        If a MemoryCache is given, it is used as a tier in front of SQLite:
+        lookups are answered from memory when possible, and every write goes
+        to both the memory tier and SQLite so the cache survives restarts.
+        """
+        super().__init__(name, memory_cache)
 
-            c.execute("INSERT INTO Cache VALUES (?,?,?,?,?,?)", data)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
 
-            # Commit connect
-            conn.commit()
-            # Close connect
-            conn.close()
+        conn = self._connection()
 
-    def query_from_database(self, name: str, rr_type: int = 1,
-                            rr_class: int = 1) -> ResourceRecord:
+        # Create table
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS Cache(
+                    domain text,
+                    type integer,
+                    class integer,
+                    ttl integer,
+                    data text,
+                    ttd integer
+                )
+            """)
+        self._migrate(conn)
+
+        # Seed the expiry heap with the earliest time-to-die already stored
+        self._schedule_earliest()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of the calling thread, opening it if necessary."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread is disabled only so that close() can release
+            # connections opened by other threads; each connection is still
+            # used exclusively by the thread that opened it.
+            conn = sqlite3.connect(self._name, timeout=self.BUSY_TIMEOUT,
+                                   check_same_thread=False)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Apply the migrations that have not been applied to this database file yet."""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            with conn:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version={number}")
+
+    def _store_record(self, key: tuple, ttl: int, rdata: str, ttd: int):
+        """Insert one record, replacing the same record through the CacheRecord index."""
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO Cache VALUES (?,?,?,?,?,?)", key + (ttl, rdata, ttd))
+
+    def _store_rrsets(self, rrsets: list):
+        """Replace the RRsets and drop their negative answers in a single transaction."""
+        conn = self._connection()
+        with conn:
+            for key, rows, ttd in rrsets:
+                conn.execute("DELETE FROM Cache WHERE domain = ? AND type = ? AND class = ?", key)
+                conn.execute("DELETE FROM NegativeCache WHERE domain = ? AND type = ? AND class = ?", key)
+                conn.executemany("INSERT OR REPLACE INTO Cache VALUES (?,?,?,?,?,?)",
+                                 [key + (ttl, rdata, ttd) for ttl, rdata in rows])
+
+    def _store_negative(self, key: tuple, rcode: int, ttd: int):
+        """Store a negative answer and drop the RRset of key in a single transaction."""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM Cache WHERE domain = ? AND type = ? AND class = ?", key)
+            conn.execute("INSERT OR REPLACE INTO NegativeCache VALUES (?,?,?,?,?)", key + (rcode, ttd))
+
+    def _fetch_rrset(self, key: tuple, now: int):
+        """Read the live RRset of key from the CacheRecord index without writing anything."""
+        rows = self._connection().execute("""
+            SELECT ttl, data, ttd FROM Cache
+            WHERE domain = ? AND type = ? AND class = ? AND ttd >= ?
+            ORDER BY rowid
+        """, key + (now,)).fetchall()
+        if not rows:
+            return None
+        return [(row[0], row[1]) for row in rows], min(row[2] for row in rows)
+
+    def _fetch_negative(self, key: tuple, now: int):
+        """Read the live negative answer of key."""
+        return self._connection().execute("""
+            SELECT rcode, ttd FROM NegativeCache
+            WHERE domain = ? AND type = ? AND class = ? AND ttd >= ?
+        """, key + (now,)).fetchone()
+
+    def _expire(self, now: int, batch_size: int) -> int:
         """
-        Query a tuple of (name, typr, class) from database for a match.
+        Delete at most batch_size expired rows from the expiring tables,
+        committing the batch so that writers are never blocked for long.
         """
-        # Connect database
-        conn = sqlite3.connect(self._name)
-
-        # Create cursor
-        c = conn.cursor()
-
-        data = (name, rr_type, rr_class)
-
-        # Create a temporary table for querying purposes
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS _Variables(Name TEXT PRIMARY KEY, Class INTEGER, Type INTEGER)
-        """)
-        c.execute("INSERT INTO _Variables VALUES (?,?,?)", data)
-
-        c.execute("""
-        SELECT C.domain, C.type, C.class, C.ttl, C.data FROM Cache C
-        WHERE C.domain = (SELECT Name FROM _Variables)
-            AND C.type = (SELECT Type FROM _Variables)
-            AND C.class = (SELECT Class FROM _Variables)
-        """)
-
-        ans = c.fetchone()
-        c.execute("DROP TABLE _Variables")
-
-        # Commit connect
-        conn.commit()
-        # Close connect
-        conn.close()
-
-        if ans is None:
-            return ans
-        else:
-            return ResourceRecord(ans[0], ans[1], ans[2], ans[3], ans[4])
-
-    """format use database sqlite3"""
-    # def default():
-    #     # Connect database
-    #     conn = sqlite3.connect('CacheSystem.db')
-    #     # Create cursor
-    #     c = conn.cursor()
-
-    """ code here """
-
-    #     # Commit connect
-    #     conn.commit()
-    #     # Close connect
-    #     conn.close()
+        deleted = 0
+        conn = self._connection()
+        with conn:
+            for table in self.EXPIRING_TABLES:
+                deleted += conn.execute(f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT rowid FROM {table} WHERE ttd < ? LIMIT ?
+                    )
+                """, (now, batch_size - deleted)).rowcount
+                if deleted >= batch_size:
+                    break
+        return deleted
+
+    def _earliest_ttd(self):
+        """Return the earliest time-to-die stored in any expiring table."""
+        earliest = None
+        conn = self._connection()
+        for table in self.EXPIRING_TABLES:
+            ttd = conn.execute(f"SELECT MIN(ttd) FROM {table}").fetchone()[0]
+            if ttd is not None and (earliest is None or ttd < earliest):
+                earliest = ttd
+        return earliest
+
+    def _compact(self):
+        """
+        Compact the file so that its size follows the number of live records.
+        executescript steps the pragma until every free page is released.
+        """
+        self._connection().executescript("PRAGMA incremental_vacuum")
+
+    def _dump(self, now: int) -> list:
+        """Return the live records and negative answers ordered by kind and key."""
+        return self._connection().execute("""
+            SELECT 0, type, class, ttl, ttd, domain, data FROM Cache WHERE ttd >= ?
+            UNION ALL
+            SELECT 1, type, class, rcode, ttd, domain, '' FROM NegativeCache WHERE ttd >= ?
+            ORDER BY 1, 6, 2, 3
+        """, (now, now)).fetchall()
+
+    def _load(self, records: list, negatives: list):
+        """Bulk-insert records and negative answers in a single transaction."""
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            indexes = []
+            if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM Cache)").fetchone()[0]:
+                # Loading into an empty table: building the indexes once afterwards
+                # is much cheaper than maintaining them row by row
+                indexes = conn.execute("""
+                    SELECT name, sql FROM sqlite_master
+                    WHERE type = 'index' AND tbl_name = 'Cache' AND sql IS NOT NULL
+                """).fetchall()
+                for index_name, _ in indexes:
+                    conn.execute(f"DROP INDEX {index_name}")
+            conn.executemany("INSERT OR REPLACE INTO Cache VALUES (?,?,?,?,?,?)", records)
+            conn.executemany("INSERT OR REPLACE INTO NegativeCache VALUES (?,?,?,?,?)", negatives)
+            for _, index_sql in indexes:
+                conn.execute(index_sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _close(self):
+        """Close the connections of every thread that used this database."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+import heapq
+import threading
+from CacheStore import CacheStore
+from MemoryCache import MemoryCache
+
+
+class DictStore(CacheStore):
+    def __init__(self, name: str, memory_cache: MemoryCache = None):
+        """
+        Init a store that keeps ResourceRecords in process memory only.
+
+        RRsets and negative answers live in two dictionaries keyed on (name, type, class),
+        and a heap of (ttd, key) lets expired entries be found without scanning them.
+        Nothing survives a restart unless a snapshot is saved.
+        """
+        super().__init__(name, memory_cache)
+        self._rrsets = {}
+        self._negatives = {}
+        self._expiry_queue = []
+        self._lock = threading.Lock()
+
+    def _store_record(self, key: tuple, ttl: int, rdata: str, ttd: int):
+        """Insert one record, replacing the same record of the RRset."""
+        with self._lock:
+            rows = self._rrsets.setdefault(key, {})
+            rows[rdata] = (ttl, ttd)
+            heapq.heappush(self._expiry_queue, (ttd, key))
+
+    def _store_rrsets(self, rrsets: list):
+        """Replace the RRsets and drop their negative answers under a single lock."""
+        with self._lock:
+            for key, rows, ttd in rrsets:
+                self._negatives.pop(key, None)
+                self._rrsets[key] = {rdata: (ttl, ttd) for ttl, rdata in rows}
+                heapq.heappush(self._expiry_queue, (ttd, key))
+
+    def _store_negative(self, key: tuple, rcode: int, ttd: int):
+        """Store a negative answer and drop the RRset of key."""
+        with self._lock:
+            self._rrsets.pop(key, None)
+            self._negatives[key] = (rcode, ttd)
+            heapq.heappush(self._expiry_queue, (ttd, key))
+
+    def _fetch_rrset(self, key: tuple, now: int):
+        """Return the live records of key and their earliest time-to-die."""
+        with self._lock:
+            rows = self._rrsets.get(key)
+            if not rows:
+                return None
+            live = [(ttl, rdata) for rdata, (ttl, ttd) in rows.items() if ttd >= now]
+            if not live:
+                return None
+            return live, min(ttd for ttl, ttd in rows.values() if ttd >= now)
+
+    def _fetch_negative(self, key: tuple, now: int):
+        """Return the live negative answer of key."""
+        with self._lock:
+            answer = self._negatives.get(key)
+        if answer is None or answer[1] < now:
+            return None
+        return answer
+
+    def _expire(self, now: int, batch_size: int) -> int:
+        """
+        Pop at most batch_size expired entries off the expiry queue.
+        Queue entries made stale by a later write are discarded without counting.
+        """
+        deleted = 0
+        with self._lock:
+            while self._expiry_queue and self._expiry_queue[0][0] < now and deleted < batch_size:
+                ttd, key = heapq.heappop(self._expiry_queue)
+                rows = self._rrsets.get(key)
+                if rows:
+                    for rdata in [rdata for rdata, row in rows.items() if row[1] == ttd]:
+                        del rows[rdata]
+                        deleted += 1
+                    if not rows:
+                        del self._rrsets[key]
+                answer = self._negatives.get(key)
+                if answer is not None and answer[1] == ttd:
+                    del self._negatives[key]
+                    deleted += 1
+        return deleted
+
+    def _earliest_ttd(self):
+        """Return the earliest time-to-die in the expiry queue."""
+        with self._lock:
+            return self._expiry_queue[0][0] if self._expiry_queue else None
+
+    def _dump(self, now: int) -> list:
+        """Return the live records and negative answers ordered by kind and key."""
+        with self._lock:
+            records = [(0, key[1], key[2], ttl, ttd, key[0], rdata)
+                       for key, rows in self._rrsets.items()
+                       for rdata, (ttl, ttd) in rows.items() if ttd >= now]
+            negatives = [(1, key[1], key[2], rcode, ttd, key[0], "")
+                         for key, (rcode, ttd) in self._negatives.items() if ttd >= now]
+        records.sort(key=lambda row: (row[5], row[1], row[2]))
+        negatives.sort(key=lambda row: (row[5], row[1], row[2]))
+        return records + negatives
+
+    def _load(self, records: list, negatives: list):
+        """Insert records and negative answers, replacing those stored under the same key."""
+        with self._lock:
+            for domain, rr_type, rr_class, ttl, rdata, ttd in records:
+                key = (domain, rr_type, rr_class)
+                self._rrsets.setdefault(key, {})[rdata] = (ttl, ttd)
+                self._expiry_queue.append((ttd, key))
+            for domain, rr_type, rr_class, rcode, ttd in negatives:
+                key = (domain, rr_type, rr_class)
+                self._negatives[key] = (rcode, ttd)
+                self._expiry_queue.append((ttd, key))
+            heapq.heapify(self._expiry_queue)
+
+    def __len__(self):
+        return len(self._rrsets) + len(self._negatives)
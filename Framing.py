@@ -0,0 +1,63 @@
+"""
+Length-prefixed framing of messages over TCP.
+
+Every message is sent as a 2-byte big-endian length followed by that many bytes, as DNS does
+over TCP (RFC 1035 4.2.2), so that many messages can share one connection and a message is
+never cut off by the size of a single recv().
+"""
+
+import asyncio
+import socket
+import struct
+
+LENGTH = struct.Struct("!H")
+MAX_MESSAGE_SIZE = 0xFFFF
+
+
+def frame(data: bytes) -> bytes:
+    """Return data prefixed with its length."""
+    if len(data) > MAX_MESSAGE_SIZE:
+        raise Exception(f"Message of {len(data)} bytes is too long to be framed.")
+    return LENGTH.pack(len(data)) + data
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    """
+    Read exactly size bytes from a socket, over as many recv() calls as needed, into one
+    bytearray that is returned as is. Return fewer bytes only if the peer closed the connection.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            break
+        received += count
+    return buffer if received == size else buffer[:received]
+
+
+def recv_frame(sock: socket.socket):
+    """Read one framed message from a socket. Return None if the connection was closed."""
+    header = recv_exactly(sock, LENGTH.size)
+    if len(header) < LENGTH.size:
+        return None
+    size = LENGTH.unpack(header)[0]
+    data = recv_exactly(sock, size)
+    if len(data) < size:
+        return None
+    return data
+
+
+def send_frame(sock: socket.socket, data: bytes):
+    """Send one framed message on a socket."""
+    sock.sendall(frame(data))
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Read one framed message from a stream. Return None if the connection was closed."""
+    try:
+        size = LENGTH.unpack(await reader.readexactly(LENGTH.size))[0]
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
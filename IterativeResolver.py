@@ -0,0 +1,191 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+from UpstreamPool import UpstreamPool
+
+# Referrals followed for one name, and names resolved on the way for one query
+# (CNAME targets and addresses of name servers without glue)
+MAX_REFERRALS = 16
+MAX_DEPTH = 6
+
+
+class IterativeResolver:
+    def __init__(self, root_hints: list, port: int = 53, timeout: float = 2.0, max_failures: int = 3,
+                 eject_seconds: float = 30.0, max_delegations: int = 10000):
+        """
+        Init a resolver that walks the DNS tree itself, from the root servers down to the
+        authoritative servers of a name, instead of forwarding to a recursive resolver.
+
+        The name servers found at every zone cut are cached for the TTL of their NS records,
+        so a lookup under a known zone starts at the servers of the closest cached zone.
+        The servers of a zone are an UpstreamPool, so they are picked by smoothed RTT and
+        ejected when they fail, and their sockets are reused.
+
+        Parameters:
+        root_hints      -> List of dict(ip=..., port=...) of the root servers
+        port            -> Port of the name servers found in referrals
+        timeout         -> Seconds to wait for one name server
+        max_failures    -> Failures in a row after which a name server is ejected
+        eject_seconds   -> Seconds an ejected name server is left out
+        max_delegations -> Maximum number of zones whose name servers are cached
+        """
+        self._port = port
+        self._timeout = timeout
+        self._max_failures = max_failures
+        self._eject_seconds = eject_seconds
+        self._max_delegations = max_delegations
+        self._root = self._pool(root_hints)
+        # zone name -> (expiry, UpstreamPool of its name servers)
+        self._delegations = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict(queries=0, referrals=0, delegation_hits=0, glueless=0)
+
+    def _pool(self, servers: list) -> UpstreamPool:
+        """Return a pool of the name servers of a zone."""
+        return UpstreamPool(servers, timeout=self._timeout, max_failures=self._max_failures,
+                            eject_seconds=self._eject_seconds)
+
+    def _count(self, counter: str):
+        """Increment a counter."""
+        with self._lock:
+            self._stats[counter] += 1
+
+    def closest_delegation(self, qname: dns.name.Name):
+        """Return the closest enclosing zone of qname whose name servers are known, and their pool."""
+        now = monotonic()
+        name = qname
+        with self._lock:
+            while name != dns.name.root:
+                entry = self._delegations.get(name)
+                if entry is not None:
+                    if entry[0] > now:
+                        self._delegations.move_to_end(name)
+                        self._stats["delegation_hits"] += 1
+                        return name, entry[1]
+                    del self._delegations[name]
+                name = name.parent()
+        return dns.name.root, self._root
+
+    def _cache_delegation(self, zone: dns.name.Name, ttl: int, pool: UpstreamPool):
+        """Cache the name servers of a zone for ttl seconds."""
+        with self._lock:
+            self._delegations[zone] = (monotonic() + ttl, pool)
+            self._delegations.move_to_end(zone)
+            while len(self._delegations) > self._max_delegations:
+                self._delegations.popitem(last=False)
+
+    @staticmethod
+    def _referral(response: dns.message.Message, zone: dns.name.Name, qname: dns.name.Name):
+        """Return the NS rrset of a referral to a zone below zone on the way to qname, or None."""
+        if response.rcode() != dns.rcode.NOERROR or response.answer:
+            return None
+        for rrset in response.authority:
+            if (rrset.rdtype == dns.rdatatype.NS and rrset.name != zone
+                    and rrset.name.is_subdomain(zone) and qname.is_subdomain(rrset.name)):
+                return rrset
+        return None
+
+    def _resolve(self, qname: dns.name.Name, rdtype: int, depth: int = 0):
+        """
+        Resolve qname iteratively. This is a generator, so that the same walk serves
+        query() and query_async(): it yields (pool, request) for every query to send,
+        is sent the response back, and returns the final response.
+        """
+        if depth > MAX_DEPTH:
+            raise dns.exception.DNSException(f"Resolution of {qname} is too deep")
+        zone, pool = self.closest_delegation(qname)
+
+        for _ in range(MAX_REFERRALS):
+            request = dns.message.make_query(qname, rdtype)
+            request.flags &= ~dns.flags.RD
+            self._count("queries")
+            response = yield pool, request
+
+            referral = self._referral(response, zone, qname)
+            if referral is None:
+                break
+            self._count("referrals")
+            targets = {rdata.target for rdata in referral}
+            addresses = [rdata.address for rrset in response.additional if rrset.name in targets
+                         and rrset.rdtype == dns.rdatatype.A for rdata in rrset]
+            if not addresses:
+                # No glue: the names of the servers are resolved from the root of their own zone
+                self._count("glueless")
+                for target in sorted(targets):
+                    answer = yield from self._resolve(target, dns.rdatatype.A, depth + 1)
+                    addresses = [rdata.address for rrset in answer.answer
+                                 if rrset.rdtype == dns.rdatatype.A for rdata in rrset]
+                    if addresses:
+                        break
+            if not addresses:
+                raise dns.exception.DNSException(f"No address for the name servers of {referral.name}")
+            zone, pool = referral.name, self._pool([dict(ip=address, port=self._port) for address in addresses])
+            self._cache_delegation(zone, referral.ttl, pool)
+        else:
+            raise dns.exception.DNSException(f"Too many referrals for {qname}")
+
+        # Follow a CNAME to a name whose records the authoritative server did not give
+        if rdtype != dns.rdatatype.CNAME and not response.get_rrset(response.answer, qname, dns.rdataclass.IN, rdtype):
+            cname = response.get_rrset(response.answer, qname, dns.rdataclass.IN, dns.rdatatype.CNAME)
+            if cname is not None:
+                target = cname[0].target
+                if not response.get_rrset(response.answer, target, dns.rdataclass.IN, rdtype):
+                    chased = yield from self._resolve(target, rdtype, depth + 1)
+                    response.answer.extend(chased.answer)
+                    response.authority = chased.authority
+                    response.set_rcode(chased.rcode())
+        return response
+
+    @staticmethod
+    def _reply(request: dns.message.Message, response: dns.message.Message) -> dns.message.Message:
+        """Return the final response of the walk as a recursive answer to request."""
+        reply = dns.message.make_response(request)
+        reply.flags |= dns.flags.RA
+        reply.set_rcode(response.rcode())
+        reply.answer = response.answer
+        reply.authority = response.authority
+        reply.additional = response.additional
+        return reply
+
+    def query(self, request: dns.message.Message) -> dns.message.Message:
+        """Resolve the question of a query iteratively. Raise an error if it cannot be resolved."""
+        question = request.question[0]
+        walk = self._resolve(question.name, question.rdtype)
+        response = None
+        try:
+            while True:
+                pool, step = walk.send(response)
+                response = pool.query(step)
+        except StopIteration as done:
+            return self._reply(request, done.value)
+
+    async def query_async(self, request: dns.message.Message) -> dns.message.Message:
+        """Resolve the question of a query iteratively without blocking the event loop."""
+        question = request.question[0]
+        walk = self._resolve(question.name, question.rdtype)
+        response = None
+        try:
+            while True:
+                pool, step = walk.send(response)
+                response = await pool.query_async(step)
+        except StopIteration as done:
+            return self._reply(request, done.value)
+
+    def get_stats(self):
+        """
+        Return how many queries and referrals the walks took, how many started
+        from a cached zone, and how many zones are cached.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["delegations"] = len(self._delegations)
+        return stats
+
+    stats = property(get_stats)
@@ -0,0 +1,316 @@
+import threading
+import zlib
+from collections import OrderedDict
+from time import time
+
+
+class LRUPolicy:
+    """Evict the least recently used key."""
+
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def insert(self, key: tuple):
+        self._order[key] = None
+
+    def touch(self, key: tuple):
+        self._order.move_to_end(key)
+
+    def remove(self, key: tuple):
+        self._order.pop(key, None)
+
+    def victim(self) -> tuple:
+        return next(iter(self._order))
+
+    def evict(self, key: tuple):
+        self.remove(key)
+
+
+class LFUPolicy:
+    """Evict the least frequently used key, the least recently used one among ties."""
+
+    def __init__(self):
+        self._counts = {}
+        # Keys by number of uses, each bucket ordered from least to most recently used
+        self._buckets = {}
+        self._min_count = 0
+
+    def insert(self, key: tuple):
+        self._counts[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_count = 1
+
+    def touch(self, key: tuple):
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def remove(self, key: tuple):
+        count = self._counts.pop(key, None)
+        if count is None:
+            return
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = min(self._buckets, default=0)
+
+    def victim(self) -> tuple:
+        return next(iter(self._buckets[self._min_count]))
+
+    def evict(self, key: tuple):
+        self.remove(key)
+
+
+class ARCPolicy:
+    """
+    Adaptive Replacement Cache.
+    Keys seen once live in t1 and keys seen again in t2. The ghost lists b1 and b2 remember
+    the keys recently evicted from each, and a hit on a ghost moves the target size of t1
+    towards the list that would have kept it.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._target = 0
+        self._t1, self._t2 = OrderedDict(), OrderedDict()
+        self._b1, self._b2 = OrderedDict(), OrderedDict()
+
+    def insert(self, key: tuple):
+        if key in self._b1:
+            self._target = min(self._capacity, self._target + max(len(self._b2) // len(self._b1), 1))
+            del self._b1[key]
+            self._t2[key] = None
+        elif key in self._b2:
+            self._target = max(0, self._target - max(len(self._b1) // len(self._b2), 1))
+            del self._b2[key]
+            self._t2[key] = None
+        else:
+            self._t1[key] = None
+
+    def touch(self, key: tuple):
+        if key in self._t1:
+            del self._t1[key]
+            self._t2[key] = None
+        else:
+            self._t2.move_to_end(key)
+
+    def remove(self, key: tuple):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+
+    def victim(self) -> tuple:
+        if self._t1 and (len(self._t1) > self._target or not self._t2):
+            return next(iter(self._t1))
+        return next(iter(self._t2))
+
+    def evict(self, key: tuple):
+        if key in self._t1:
+            del self._t1[key]
+            ghost = self._b1
+        else:
+            del self._t2[key]
+            ghost = self._b2
+        ghost[key] = None
+        if len(ghost) > self._capacity:
+            ghost.popitem(last=False)
+
+
+class FrequencySketch:
+    """
+    A count-min sketch of how often keys were requested recently.
+    All the counters are halved once sample_size requests have been recorded,
+    so that old popularity fades away.
+    """
+
+    DEPTH = 4
+    MAX_COUNT = 15
+    # Odd 64-bit multipliers, one per row, spreading a key over independent columns
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+
+    def __init__(self, capacity: int):
+        # A power of two of at least 8 counters per cached key
+        self._bits = max(10, (8 * capacity - 1).bit_length())
+        self._table = [bytearray(1 << self._bits) for _ in range(self.DEPTH)]
+        self._sample_size = 10 << self._bits
+        self._additions = 0
+
+    def _indexes(self, key: tuple):
+        digest = zlib.crc32(f"{key[0]}\0{key[1]}\0{key[2]}".encode()) + 1
+        for seed in self.SEEDS:
+            yield ((digest * seed) & 0xFFFFFFFFFFFFFFFF) >> (64 - self._bits)
+
+    def add(self, key: tuple):
+        for row, index in zip(self._table, self._indexes(key)):
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            for row in self._table:
+                row[:] = bytes(count >> 1 for count in row)
+            self._additions //= 2
+
+    def estimate(self, key: tuple) -> int:
+        return min(row[index] for row, index in zip(self._table, self._indexes(key)))
+
+
+class MemoryCache:
+    # Rough per-entry overhead (key tuple, entry tuple, dict slot) in bytes,
+    # added to the size of the strings when accounting the byte budget.
+    ENTRY_OVERHEAD = 200
+
+    POLICIES = dict(lru=LRUPolicy, lfu=LFUPolicy, arc=ARCPolicy)
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 16 * 1024 * 1024,
+                 policy: str = "lru", admission: bool = False):
+        """
+        Initialize a bounded in-memory cache tier.
+
+        Entries are keyed on (name, type, class) and hold a value together with its
+        time-to-die. Expired entries are never returned, and entries chosen by the
+        eviction policy are evicted when either the entry or the byte budget is exceeded.
+
+        With admission enabled, a FrequencySketch counts every request, and a new key is
+        only cached at the expense of the entry the policy would evict if it was requested
+        more often recently. A flood of one-hit names then cannot push out the popular ones.
+
+        Parameters:
+        max_entries     -> Maximum number of cached keys
+        max_bytes       -> Approximate maximum size of the cached data in bytes
+        policy          -> Eviction policy: "lru", "lfu" or "arc"
+        admission       -> Whether new keys go through the admission filter
+        """
+        if policy not in self.POLICIES:
+            raise Exception(f"Unknown eviction policy: {policy}")
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._policy_name = policy
+        # Only ARC sizes its lists from the number of entries
+        self._policy = ARCPolicy(max_entries) if policy == "arc" else self.POLICIES[policy]()
+        self._sketch = FrequencySketch(max_entries) if admission else None
+        self._entries = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, evictions=0, admitted=0, rejected=0)
+
+    @classmethod
+    def _size_of(cls, key: tuple, value) -> int:
+        """Estimate the memory used by an entry whose value is an RRset or a scalar."""
+        size = cls.ENTRY_OVERHEAD + len(key[0])
+        if isinstance(value, list):
+            for record in value:
+                size += len(record.name) + len(record.rdata)
+        return size
+
+    def get(self, name: str, rr_type: int, rr_class: int, now: float = None):
+        """
+        Return the value cached for (name, type, class) and its time-to-die,
+        or None if there is no live entry.
+        """
+        key = (name, rr_type, rr_class)
+        now = time() if now is None else now
+
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.add(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._policy.touch(key)
+                    self._stats["hits"] += 1
+                    return entry[0], entry[1]
+                self._remove(key)
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, name: str, rr_type: int, rr_class: int, value, ttd: int):
+        """
+        Cache a value for (name, type, class) until its time-to-die.
+        A new key may be rejected by the admission filter when the cache is full.
+        """
+        key = (name, rr_type, rr_class)
+        size = self._size_of(key, value)
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries[key][2]
+                self._entries[key] = (value, ttd, size)
+                self._bytes += size
+                self._policy.touch(key)
+                self._evict(0, 0)
+                return
+
+            if self._sketch is not None and self._entries and self._over_budget(1, size):
+                if self._sketch.estimate(key) <= self._sketch.estimate(self._policy.victim()):
+                    self._stats["rejected"] += 1
+                    return
+                self._stats["admitted"] += 1
+
+            # Make room first, so that the new key is never its own victim
+            self._evict(1, size)
+            self._entries[key] = (value, ttd, size)
+            self._bytes += size
+            self._policy.insert(key)
+
+    def _over_budget(self, entries: int, size: int) -> bool:
+        """
+        Return True if adding entries keys of size bytes would exceed a budget.
+        The caller must hold the lock.
+        """
+        return len(self._entries) + entries > self._max_entries or self._bytes + size > self._max_bytes
+
+    def _evict(self, entries: int, size: int):
+        """Evict entries until entries keys of size bytes fit in the budgets. The caller must hold the lock."""
+        while self._entries and self._over_budget(entries, size):
+            victim = self._policy.victim()
+            self._bytes -= self._entries.pop(victim)[2]
+            self._policy.evict(victim)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, name: str, rr_type: int, rr_class: int):
+        """Drop the entry of (name, type, class) if it is cached."""
+        with self._lock:
+            if (name, rr_type, rr_class) in self._entries:
+                self._remove((name, rr_type, rr_class))
+
+    def _remove(self, key: tuple):
+        """Remove an entry that was invalidated or expired. The caller must hold the lock."""
+        self._bytes -= self._entries.pop(key)[2]
+        self._policy.remove(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_size(self):
+        """Return the approximate number of bytes used by cached entries."""
+        return self._bytes
+
+    def get_max_entries(self):
+        """Return the maximum number of cached keys."""
+        return self._max_entries
+
+    def get_policy(self):
+        """Return the name of the eviction policy."""
+        return self._policy_name
+
+    def get_stats(self):
+        """
+        Return a copy of the hit, miss and eviction counters, and of the number of new keys
+        admitted and rejected by the admission filter while the cache was full.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    size = property(get_size)
+    max_entries = property(get_max_entries)
+    policy = property(get_policy)
+    stats = property(get_stats)
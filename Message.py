@@ -13,6 +13,14 @@ from copy import copy
 
 
 class Message:
+    # Set on answers built from expired records, which must not be cached again
+    stale = False
+    # UDP payload size advertised by the sender of the message (EDNS0, RFC 6891),
+    # None if it did not advertise one
+    payload_size = None
+    # Seconds the serialized message may be cached for, if fewer than the TTL of its records
+    cache_ttl = None
+
     def __init__(self, request=None, header: MessageHeader = None, question: MessageQuestion = None):
         """
         Initialize a Message.
@@ -81,6 +89,7 @@ class Message:
         #1-6    Header's fields
         #7      Question
         #Remaining lines are the numbers of records of each section
+        #Last    "edns;<payload size>" if the message advertises a UDP payload size
         """
         msg = ""
         msg += self.header.to_string() + "\n"
@@ -91,8 +100,51 @@ class Message:
             msg += record.to_string() + "\n"
         for record in self.additional:
             msg += record.to_string() + "\n"
+        if self.payload_size:
+            msg += f"edns;{self.payload_size}\n"
         return msg
 
+    def truncated(self, keep: int):
+        """
+        Return a copy of the message with only its first keep records, counted over the
+        Answer, Authority and Additional sections in that order. The TC flag is set if
+        a record of the Answer or Authority section was left out (RFC 2181 9).
+        """
+        result = Message(header=self._header, question=self._question)
+        before_additional = len(self._answer) + len(self._authority)
+        result._answer = self._answer[:keep]
+        result._authority = self._authority[:max(0, keep - len(self._answer))]
+        result._additional = self._additional[:max(0, keep - before_additional)]
+        for field, section in (("an", result._answer), ("ns", result._authority), ("ar", result._additional)):
+            result._header.set_count(field, len(section))
+        if keep < before_additional:
+            result._header.set_truncate_flag()
+        result.stale = self.stale
+        result.payload_size = self.payload_size
+        return result
+
+    def fit(self, encode, max_size: int):
+        """
+        Encode the message with encode, a function of a Message returning bytes. If the
+        result is longer than max_size, encode the largest truncated() copy that fits
+        instead, so that the message is cut at a record boundary.
+        Return a tuple of (encoded message, whether records were left out).
+        """
+        data = encode(self)
+        if len(data) <= max_size:
+            return data, False
+        # Binary search of the number of records that fit
+        low, high = 0, len(self._answer) + len(self._authority) + len(self._additional) - 1
+        best = None
+        while low <= high:
+            keep = (low + high) // 2
+            candidate = encode(self.truncated(keep))
+            if len(candidate) <= max_size:
+                best, low = candidate, keep + 1
+            else:
+                high = keep - 1
+        return (best if best is not None else encode(self.truncated(0))), True
+
     def add_a_new_record_to_answer_section(self, record: ResourceRecord):
         """Add a new record to the ANSWER section."""
         self._answer.append(record)
@@ -128,9 +180,22 @@ class Message:
             self._header.clear_recursion_desire_flag()
         if ra is not None and not ra:
             self._header.clear_recursion_available_flag()
+        elif ra:
+            self._header.set_recursion_available_flag()
         if rcode is not None:
             self._header.set_rcode(rcode)
 
+    def get_negative_ttl(self):
+        """
+        Return how long a negative answer in this Message may be cached (RFC 2308),
+        which is the smaller of the TTL and the MINIMUM field of the SOA record
+        in the Authority section. Return None if there is no SOA record.
+        """
+        for record in self._authority:
+            if record.rr_type == ResourceRecord.TYPE["SOA"]:
+                return min(record.ttl, int(record.rdata.split()[-1]))
+        return None
+
     def get_answer_records(self):
         """Return a copy of the list of ResourceRecords in the Answer section."""
         return copy(self._answer)
@@ -59,6 +59,12 @@ class MessageHeader:
         # 16-bit int specifies the number of RRs in the Additional Records section
         self._arcount = arcount
 
+    def __copy__(self):
+        """Return a copy of the header without the generic copy protocol."""
+        duplicate = MessageHeader.__new__(MessageHeader)
+        duplicate.__dict__.update(self.__dict__)
+        return duplicate
+
     def set_qr_flag(self) -> None:
         """[Only valid in responses] Set the query flag."""
         self._qr = 1
@@ -86,6 +92,10 @@ class MessageHeader:
         """Clear the recursion desire flag."""
         self._rd = False
 
+    def set_recursion_available_flag(self) -> None:
+        """[Only valid in responses] Set the recursion available flag to True."""
+        self._ra = True
+
     def clear_recursion_available_flag(self) -> None:
         """Clear the recursion available flag."""
         self._ra = False
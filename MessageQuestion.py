@@ -67,10 +67,16 @@ class MessageQuestion:
             self._qtype = None
             self._qclass = None
 
+    def __copy__(self):
+        """Return a copy of the question without validating it again."""
+        duplicate = MessageQuestion.__new__(MessageQuestion)
+        duplicate.__dict__.update(self.__dict__)
+        return duplicate
+
     @staticmethod
     def _check_data_type_(*args, dtype: str) -> bool:
         """Check if variables are of dtype."""
-        return all(str(type(arg)) == f"<class '{dtype}'>" for arg in args)
+        return all(type(arg).__name__ == dtype for arg in args)
 
     def _validate_(self, qname: str, qtype, qclass) -> bool:
         """Validate the QNAME, QTYPE, QCLASS before setting values."""
@@ -82,17 +88,19 @@ class MessageQuestion:
         elif not self._check_data_type_(qtype, qclass, dtype='int'):
             return False
         """
+        # the labels are split once for the checks below
+        labels = qname.split(".")
         # check if hostname is empty or exceeds the size limit of 255 bytes
         if qname == "" or len(qname) > 255:
             raise Exception("The size limit of domain is 255 bytes.")
             # return False
         # check if hostname is not of the format label.label[.label[.label...]]
-        elif len(qname.split(".")) <= 1:
+        elif len(labels) <= 1:
             raise Exception("Not exist '.' in domain.")
             # return False
         # if hostname is of valid format, check if any label of the hostname exceeds the size limit of 63 bytes
-        elif len(qname.split(".")) > 1:
-            for label in qname.split("."):
+        elif len(labels) > 1:
+            for label in labels:
                 if len(label) > 63:
                     raise Exception("The size limit of label is 63 bytes.")
                     # return False
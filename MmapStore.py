@@ -0,0 +1,383 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from itertools import groupby
+from time import time
+from CacheStore import CacheStore
+from MemoryCache import MemoryCache
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows), the file is only safe to share between the threads of one process
+    fcntl = None
+
+
+class MmapStore(CacheStore):
+    # The file starts with a header of (magic, number of slots, size of a slot, number of stripes),
+    # followed by the slots. The slots are split into stripes, each an open-addressing hash table
+    # probed linearly, and every key lives in the stripe chosen by its hash.
+    FILE_MAGIC = b"DNSMMAP2"
+    FILE_HEADER = struct.Struct("<8sIII")
+
+    # Every slot starts with a version, odd while the slot is being written, then
+    # (state, kind, type, class, rcode, ttd, length of the name, length of the rows),
+    # followed by the UTF-8 name and the rows of the RRset.
+    # ttd is the time-to-die of the negative answer, or of the last row of the RRset to expire.
+    VERSION = struct.Struct("<I")
+    SLOT_HEADER = struct.Struct("<IBBHHHqHH")
+    # Every row of an RRset is (ttl, ttd, length of the rdata) followed by the UTF-8 rdata
+    ROW_HEADER = struct.Struct("<IqH")
+
+    EMPTY, USED, DELETED = 0, 1, 2
+    RRSET, NEGATIVE = 0, 1
+
+    # Times a reader retries a slot that keeps being rewritten before reading it under the lock of its stripe
+    READ_RETRIES = 100
+
+    # Files opened by the stores of this process, by real path: [file, map, stores, stripe locks].
+    # The byte locks of a file belong to the process and closing any descriptor of the file, the
+    # copy held by a map included, releases all of them. So the stores of one file share a single
+    # descriptor and map, closed with the last of them, and the locks of its stripes.
+    _open_files = {}
+    _open_files_lock = threading.Lock()
+
+    def __init__(self, name: str, memory_cache: MemoryCache = None,
+                 slots: int = 65536, slot_size: int = 512, stripes: int = 64):
+        """
+        Init a store that keeps ResourceRecords in a fixed-size hash table mapped from a file.
+
+        Every (name, type, class) key owns one slot of slot_size bytes holding either its RRset
+        or its negative answer, so a lookup reads a single slot in the common case.
+        RRsets that do not fit in a slot are not cached. When every slot of a stripe is taken,
+        a write replaces the entry stored in the home slot of its key.
+
+        The file can be shared by every process of the host. Writers lock the stripe of
+        their key, with a lock on a byte of the file so that other processes are excluded
+        too, and readers take no lock: they retry a slot whose version changed while it
+        was being read. The stores of one process opened on the same file share its
+        descriptor. Opening a file laid out for other parameters raises an Exception.
+
+        Parameters:
+        name            -> Path of the file
+        slots           -> Number of slots of the table, rounded up to a multiple of stripes
+        slot_size       -> Size of a slot in bytes
+        stripes         -> Number of independently locked parts of the table
+        """
+        super().__init__(name, memory_cache)
+        self._stripes = stripes
+        self._stripe_slots = -(-slots // stripes)
+        self._slots = self._stripe_slots * stripes
+        self._slot_size = slot_size
+        # Slot where the next call of _expire resumes scanning
+        self._cursor = 0
+
+        size = self.FILE_HEADER.size + self._slots * slot_size
+        header = self.FILE_HEADER.pack(self.FILE_MAGIC, self._slots, slot_size, stripes)
+        self._path = os.path.realpath(name)
+        with MmapStore._open_files_lock:
+            shared = self._open_files.get(self._path)
+            if shared is None:
+                fd = os.open(name, os.O_RDWR | os.O_CREAT)
+                shared = [os.fdopen(fd, "r+b"), None, set(), [threading.Lock() for _ in range(stripes)]]
+            self._file = shared[0]
+            with self._file_lock(0):
+                self._file.seek(0)
+                stored = self._file.read(self.FILE_HEADER.size)
+                if not stored:
+                    # New file
+                    self._file.truncate(size)
+                    self._file.seek(0)
+                    self._file.write(header)
+                    self._file.flush()
+                elif stored != header or os.fstat(self._file.fileno()).st_size != size:
+                    # Another process may be serving from this file: never reformat it under it
+                    if not shared[2]:
+                        self._file.close()
+                    raise Exception(f"{name} is laid out for another number or size of slots or stripes.")
+            if shared[1] is None:
+                shared[1] = mmap.mmap(self._file.fileno(), size)
+            shared[2].add(self)
+            self._open_files[self._path] = shared
+        self._map = shared[1]
+        self._stripe_locks = shared[3]
+
+        # Seed the expiry heap with the earliest time-to-die already stored
+        self._schedule_earliest()
+
+    @contextmanager
+    def _file_lock(self, position: int):
+        """Hold an exclusive lock on one byte of the file, shared with other processes."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX, 1, position)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN, 1, position)
+
+    @contextmanager
+    def _locked(self, stripe: int):
+        """Hold the lock of a stripe, against the threads of this process and other processes."""
+        with self._stripe_locks[stripe]:
+            # Byte 0 guards the file header, the stripes use the bytes that follow it
+            with self._file_lock(1 + stripe):
+                yield
+
+    def _offset(self, slot: int) -> int:
+        """Return the offset of a slot in the file."""
+        return self.FILE_HEADER.size + slot * self._slot_size
+
+    def _hash(self, key: tuple) -> int:
+        """Return the hash of key. It is stable across processes."""
+        return zlib.crc32(f"{key[0]}\0{key[1]}\0{key[2]}".encode())
+
+    def _stripe(self, key: tuple) -> int:
+        """Return the stripe of key."""
+        return self._hash(key) % self._stripes
+
+    def _probe(self, key: tuple):
+        """Yield the slots of the stripe of key in probing order, from its home slot."""
+        digest = self._hash(key)
+        first = (digest % self._stripes) * self._stripe_slots
+        home = (digest // self._stripes) % self._stripe_slots
+        for i in range(self._stripe_slots):
+            yield first + (home + i) % self._stripe_slots
+
+    def _read_slot(self, slot: int, locked: bool = False):
+        """
+        Return a consistent copy of a slot. The copy is retried without locking while
+        a writer is changing the slot, then taken under the lock of its stripe if the
+        slot kept being rewritten. locked tells that the caller holds that lock already.
+        """
+        offset = self._offset(slot)
+        if not locked:
+            for _ in range(self.READ_RETRIES):
+                version = self.VERSION.unpack_from(self._map, offset)[0]
+                if version % 2 == 0:
+                    data = self._map[offset:offset + self._slot_size]
+                    if self.VERSION.unpack_from(data, 0)[0] == version and \
+                            self.VERSION.unpack_from(self._map, offset)[0] == version:
+                        return data
+            with self._locked(slot // self._stripe_slots):
+                return self._map[offset:offset + self._slot_size]
+        return self._map[offset:offset + self._slot_size]
+
+    def _publish(self, slot: int, data: bytes):
+        """
+        Overwrite a slot after its version. The version is odd while the slot is written,
+        so that readers retry instead of seeing half of it. The caller must hold the lock of the stripe.
+        """
+        offset = self._offset(slot)
+        # The version is only left odd by a process that died while writing the slot
+        version = self.VERSION.unpack_from(self._map, offset)[0] | 1
+        self.VERSION.pack_into(self._map, offset, version)
+        start = offset + self.VERSION.size
+        self._map[start:start + len(data)] = data
+        self.VERSION.pack_into(self._map, offset, (version + 1) & 0xFFFFFFFF)
+
+    def _delete(self, slot: int):
+        """Turn a slot into a tombstone. The caller must hold the lock of the stripe."""
+        self._publish(slot, bytes([self.DELETED]))
+
+    def _parse_header(self, data: bytes) -> tuple:
+        """Return the header of a copied slot, without its version."""
+        return self.SLOT_HEADER.unpack_from(data, 0)[1:]
+
+    def _parse_name(self, data: bytes, header: tuple) -> str:
+        """Return the name stored in a copied slot."""
+        return data[self.SLOT_HEADER.size:self.SLOT_HEADER.size + header[6]].decode()
+
+    def _parse_rows(self, data: bytes, header: tuple) -> list:
+        """Return the (ttl, rdata, ttd) rows of the RRset stored in a copied slot."""
+        rows = []
+        offset = self.SLOT_HEADER.size + header[6]
+        end = offset + header[7]
+        while offset < end:
+            ttl, ttd, length = self.ROW_HEADER.unpack_from(data, offset)
+            offset += self.ROW_HEADER.size
+            rows.append((ttl, data[offset:offset + length].decode(), ttd))
+            offset += length
+        return rows
+
+    def _find(self, key: tuple, now: int, locked: bool = False) -> tuple:
+        """
+        Probe the slots of key. locked tells that the caller holds the lock of its stripe.
+        Return a tuple of (slot holding key or None, copy of that slot or None,
+        slot where key can be written or None). A slot is only free to be written once
+        its entry is past the grace window of keep_stale(), so that stale answers are kept.
+        """
+        name = key[0].encode()
+        free = None
+        for slot in self._probe(key):
+            data = self._read_slot(slot, locked)
+            header = self._parse_header(data)
+            state = header[0]
+            if state == self.EMPTY:
+                return None, None, slot if free is None else free
+            if state == self.USED and header[2:4] == key[1:] and header[6] == len(name) and \
+                    data[self.SLOT_HEADER.size:self.SLOT_HEADER.size + len(name)] == name:
+                return slot, data, slot
+            if free is None and (state == self.DELETED or header[5] + self._stale_grace < now):
+                free = slot
+        return None, None, free
+
+    def _write(self, key: tuple, kind: int, rcode: int, ttd: int, rows: list):
+        """
+        Write an RRset of (ttl, rdata, ttd) rows, or a negative answer, into the slot of key.
+        The caller must hold the lock of the stripe of key.
+        """
+        now = int(time())
+        name = key[0].encode()
+        chunks = []
+        for ttl, rdata, row_ttd in rows:
+            data = rdata.encode()
+            chunks.append(self.ROW_HEADER.pack(ttl, row_ttd, len(data)))
+            chunks.append(data)
+        payload = b"".join(chunks)
+
+        slot, _, target = self._find(key, now, locked=True)
+        if self.SLOT_HEADER.size + len(name) + len(payload) > self._slot_size:
+            # Too large to be cached: drop any older entry so that it is not served instead
+            if slot is not None:
+                self._delete(slot)
+            return
+
+        if target is None:
+            target = next(self._probe(key))
+        if slot is not None and slot != target:
+            self._delete(slot)
+
+        header = self.SLOT_HEADER.pack(0, self.USED, kind, key[1], key[2], rcode, ttd, len(name), len(payload))
+        self._publish(target, header[self.VERSION.size:] + name + payload)
+
+    def _store_record(self, key: tuple, ttl: int, rdata: str, ttd: int):
+        """Insert one record, replacing the same record of the RRset."""
+        now = int(time())
+        with self._locked(self._stripe(key)):
+            _, data, _ = self._find(key, now, locked=True)
+            rows = []
+            if data is not None:
+                header = self._parse_header(data)
+                if header[1] == self.RRSET:
+                    rows = [row for row in self._parse_rows(data, header)
+                            if row[2] >= now and row[1] != rdata]
+            rows.append((ttl, rdata, ttd))
+            self._write(key, self.RRSET, 0, max(row[2] for row in rows), rows)
+
+    def _store_rrsets(self, rrsets: list):
+        """
+        Replace the RRsets, and with them any negative answer of their keys.
+        Each RRset is replaced under the lock of its stripe.
+        """
+        for key, rows, ttd in rrsets:
+            with self._locked(self._stripe(key)):
+                self._write(key, self.RRSET, 0, ttd, [(ttl, rdata, ttd) for ttl, rdata in rows])
+
+    def _store_negative(self, key: tuple, rcode: int, ttd: int):
+        """Store a negative answer in place of the RRset of key."""
+        with self._locked(self._stripe(key)):
+            self._write(key, self.NEGATIVE, rcode, ttd, [])
+
+    def _fetch_rrset(self, key: tuple, now: int):
+        """Return the live rows of the RRset of key and their earliest time-to-die, without locking."""
+        _, data, _ = self._find(key, now)
+        if data is None:
+            return None
+        header = self._parse_header(data)
+        if header[1] != self.RRSET or header[5] < now:
+            return None
+        rows = [row for row in self._parse_rows(data, header) if row[2] >= now]
+        if not rows:
+            return None
+        return [(ttl, rdata) for ttl, rdata, _ in rows], min(row[2] for row in rows)
+
+    def _fetch_negative(self, key: tuple, now: int):
+        """Return the live negative answer of key, without locking."""
+        _, data, _ = self._find(key, now)
+        if data is None:
+            return None
+        header = self._parse_header(data)
+        if header[1] != self.NEGATIVE or header[5] < now:
+            return None
+        return header[4], header[5]
+
+    def _expire(self, now: int, batch_size: int) -> int:
+        """
+        Free at most batch_size expired slots, resuming the scan where the last call stopped.
+        A call scans every slot at most once, locking one stripe at a time.
+        """
+        deleted = 0
+        scanned = 0
+        while scanned < self._slots and deleted < batch_size:
+            stripe = self._cursor // self._stripe_slots
+            end = (stripe + 1) * self._stripe_slots
+            with self._locked(stripe):
+                while self._cursor < end and scanned < self._slots and deleted < batch_size:
+                    header = self.SLOT_HEADER.unpack_from(self._map, self._offset(self._cursor))
+                    if header[1] == self.USED and header[6] < now:
+                        self._delete(self._cursor)
+                        deleted += 1
+                    self._cursor += 1
+                    scanned += 1
+            self._cursor %= self._slots
+        return deleted
+
+    def _live_slots(self):
+        """Yield a copy of the header and data of every used slot, without locking."""
+        for slot in range(self._slots):
+            data = self._read_slot(slot)
+            if data is not None:
+                header = self._parse_header(data)
+                if header[0] == self.USED:
+                    yield header, data
+
+    def _earliest_ttd(self):
+        """Return the earliest time-to-die of the used slots."""
+        return min((header[5] for header, _ in self._live_slots()), default=None)
+
+    def _dump(self, now: int) -> list:
+        """Return the live records and negative answers ordered by kind and key."""
+        records = []
+        negatives = []
+        for header, data in self._live_slots():
+            if header[5] < now:
+                continue
+            _, kind, rr_type, rr_class, rcode, ttd, _, _ = header
+            name = self._parse_name(data, header)
+            if kind == self.RRSET:
+                records.extend((0, rr_type, rr_class, ttl, row_ttd, name, rdata)
+                               for ttl, rdata, row_ttd in self._parse_rows(data, header)
+                               if row_ttd >= now)
+            else:
+                negatives.append((1, rr_type, rr_class, rcode, ttd, name, ""))
+        records.sort(key=lambda row: (row[5], row[1], row[2]))
+        negatives.sort(key=lambda row: (row[5], row[1], row[2]))
+        return records + negatives
+
+    def _load(self, records: list, negatives: list):
+        """Write records grouped by RRset and negative answers, replacing those stored under the same key."""
+        for key, rows in groupby(records, key=lambda record: record[:3]):
+            rows = [(ttl, rdata, ttd) for _, _, _, ttl, rdata, ttd in rows]
+            with self._locked(self._stripe(key)):
+                self._write(key, self.RRSET, 0, max(row[2] for row in rows), rows)
+        for domain, rr_type, rr_class, rcode, ttd in negatives:
+            self._store_negative((domain, rr_type, rr_class), rcode, ttd)
+
+    def _close(self):
+        """Flush the table to its file, and unmap it if no other store of this process uses it."""
+        with MmapStore._open_files_lock:
+            shared = self._open_files.get(self._path)
+            if shared is None or self not in shared[2]:
+                return
+            self._map.flush()
+            shared[2].discard(self)
+            if not shared[2]:
+                # Last store of the file in this process
+                del self._open_files[self._path]
+                self._map.close()
+                self._file.close()
@@ -4,25 +4,115 @@ from MessageQuestion import MessageQuestion
 from ResourceRecord import ResourceRecord
 from AES import AESCipher
 import dns.query
-import dns.zone
-import dns.resolver
+import dns.message
+import dns.rcode
 import dns.exception
+import asyncio
 import threading
 import socket
 import os
-from ParseString import parse_string_msg
+from ParseString import parse_string_msg, parse_string_payload_size
 from configurator import Configurator
-from Database import Database
+from CacheStore import create_store
+from MemoryCache import MemoryCache
+from WorkerPool import WorkerPool
+from BufferPool import BufferPool
+from UpstreamPool import UpstreamPool
+from IterativeResolver import IterativeResolver
+from Coalescer import Coalescer
+from ZoneStore import ZoneStore
+from ResponseCache import ResponseCache
+from Prefetcher import Prefetcher
+from Framing import recv_frame, send_frame, read_frame, frame
+from WireFormat import encode_message, decode_message, encode_error, echo_qname
 
 
 class NameServer:
-    def __init__(self):
+    def __init__(self, worker_index: int = None, counters=None, database=None, upstreams=None):
         """
         Initializes the Name Server, binds it to the correct port, and configures the database.
+
+        worker_index is set when the Name Server is one of the worker processes of a Supervisor.
+        The socket configuration is then inherited from the supervisor, and only the first
+        worker sweeps the shared database and takes snapshots. Workers read it without a
+        memory tier, which would keep serving the RRsets other workers replaced.
+        counters, if given, is the WorkerCounters of the process, shared with the supervisor.
+        database and upstreams, if given, replace the cache store and the external DNS
+        servers set by the Configurator.
+        """
+        self.counters = counters
+        if database is None:
+            memory_cache = None
+            if worker_index is None:
+                memory_cache = MemoryCache(
+                    Configurator.MEMORY_CACHE_ENTRIES,
+                    Configurator.MEMORY_CACHE_BYTES,
+                    policy=Configurator.MEMORY_CACHE_POLICY,
+                    admission=Configurator.MEMORY_CACHE_ADMISSION,
+                )
+            database = create_store("DatabaseNS", Configurator.CACHE_BACKEND, memory_cache=memory_cache)
+        self.database = database
+        if upstreams is not None:
+            self.upstreams = upstreams
+        elif Configurator.RESOLUTION_MODE == "iterative":
+            self.upstreams = IterativeResolver(
+                Configurator.ROOT_HINTS,
+                timeout=Configurator.UPSTREAM_TIMEOUT,
+                max_failures=Configurator.UPSTREAM_MAX_FAILURES,
+                eject_seconds=Configurator.UPSTREAM_EJECT_SECONDS,
+                max_delegations=Configurator.DELEGATION_CACHE_SIZE,
+            )
+        else:
+            self.upstreams = UpstreamPool(
+                Configurator.UPSTREAMS,
+                timeout=Configurator.UPSTREAM_TIMEOUT,
+                max_failures=Configurator.UPSTREAM_MAX_FAILURES,
+                eject_seconds=Configurator.UPSTREAM_EJECT_SECONDS,
+            )
+        # Concurrent cache misses for the same question share one external query
+        self.coalescer = Coalescer()
+        # Expired RRsets are kept to answer with when the external DNS servers fail or are slow,
+        # and refreshed by a few threads
+        self.stale_refresh_pool = None
+        if Configurator.SERVE_STALE:
+            self.database.keep_stale(Configurator.STALE_GRACE)
+            self.stale_refresh_pool = WorkerPool(
+                Configurator.STALE_REFRESH_THREADS,
+                Configurator.STALE_REFRESH_QUEUE_SIZE,
+                lambda refresh: refresh(),
+            )
+        # Hot RRsets are queried again before they expire
+        self.prefetcher = None
+        if Configurator.PREFETCH_WINDOW > 0:
+            self.prefetcher = Prefetcher(
+                self.refresh_record,
+                window=Configurator.PREFETCH_WINDOW,
+                min_hits=Configurator.PREFETCH_MIN_HITS,
+                jitter=Configurator.PREFETCH_JITTER,
+                max_in_flight=Configurator.PREFETCH_MAX_IN_FLIGHT,
+            )
+        # Serialized responses of hot questions, rendered with the ID of each query
+        self.response_cache = ResponseCache(Configurator.RESPONSE_CACHE_ENTRIES)
+        self.zones = ZoneStore(Configurator.ZONE_FILES)
+        # Queue and threads of the threaded UDP listener, once it is started, and its receive buffers
+        self.udp_pool = None
+        self.udp_buffers = BufferPool(
+            Configurator.BUFFER_SIZE, Configurator.WORKER_QUEUE_SIZE + Configurator.WORKER_THREADS + 1
+        )
+        if Configurator.ZONE_FILES and Configurator.ZONE_RELOAD_INTERVAL > 0:
+            self.zones.start_watching(Configurator.ZONE_RELOAD_INTERVAL)
+        if not worker_index:
+            self.database.start_sweeper(Configurator.SWEEP_INTERVAL, Configurator.SWEEP_BATCH_SIZE)
+            self.warm_start("DatabaseNS.snapshot")
+        if worker_index is None:
+            Configurator.config_me(53, 53)  # Ensure this is using port 53
+
+    def count(self, counter: str):
         """
-        self.ZONE = None
-        self.database = Database("DatabaseNS.db")
-        Configurator.config_me(53, 53)  # Ensure this is using port 53
+        Increments a counter of the WorkerCounters of this process, if there is one.
+        """
+        if self.counters is not None:
+            self.counters.increment(counter)
 
     def handle_query(self, query_message: Message) -> Message:
         """
@@ -37,81 +127,327 @@ class NameServer:
             else:
                 return self.non_recursive_query(header, question)
 
+    async def handle_query_async(self, query_message: Message) -> Message:
+        """
+        Handles incoming DNS queries on the event loop of the asyncio serving mode.
+        """
+        if query_message.header.qr == 0:  # If it's a query (not a response)
+            header = query_message.header
+            question = query_message.question
+            print(f"[SERVER] Handling query for {question.qname}")
+            if header.rd is True:
+                return await self.recursive_query_async(query_message)
+            else:
+                return self.non_recursive_query(header, question)
+
     def recursive_query(self, message_query: Message) -> Message:
         """
         Performs a recursive DNS query.
         """
+        result = self.search_locally(message_query)
+
+        if result is None:
+            print(f"[DEBUG] Not found in zone file. Querying external DNS servers...")
+            stale = self.search_stale_in_database(message_query)
+            if stale is None:
+                result = self.resolve_out(message_query)
+            else:
+                result = self.resolve_out_or_stale(message_query, stale)
+
+        return result
+
+    async def recursive_query_async(self, message_query: Message) -> Message:
+        """
+        Performs a recursive DNS query without blocking the event loop while
+        waiting for the external DNS servers.
+        """
+        result = self.search_locally(message_query)
+
+        if result is None:
+            print(f"[DEBUG] Not found in zone file. Querying external DNS servers...")
+            stale = self.search_stale_in_database(message_query)
+            if stale is None:
+                result = await self.resolve_out_async(message_query)
+            else:
+                result = await self.resolve_out_or_stale_async(message_query, stale)
+
+        return result
+
+    def resolve_out(self, message_query: Message) -> Message:
+        """
+        Queries the external DNS servers, sharing the query with the concurrent
+        cache misses for the same question.
+        """
+        if self.coalescer is None:
+            return self.query_out(message_query)
+        result = self.coalescer.call(self.coalescing_key(message_query), lambda: self.query_out(message_query))
+        return self.reply_with(result, message_query)
+
+    async def resolve_out_async(self, message_query: Message) -> Message:
+        """
+        Queries the external DNS servers without blocking the event loop, sharing
+        the query with the concurrent cache misses for the same question.
+        """
+        if self.coalescer is None:
+            return await self.query_out_async(message_query)
+        result = await self.coalescer.call_async(
+            self.coalescing_key(message_query), lambda: self.query_out_async(message_query)
+        )
+        return self.reply_with(result, message_query)
+
+    def resolve_out_or_stale(self, message_query: Message, stale: Message) -> Message:
+        """
+        Queries the external DNS servers, and answers with the stale answer if they fail or
+        take longer than Configurator.STALE_LATENCY_BUDGET. The external query runs on the
+        stale refresh pool, shared with the concurrent cache misses for the same question,
+        and keeps running in the background to refresh the cache when it completes.
+        """
+        call = self.coalescer.start(
+            self.coalescing_key(message_query),
+            lambda: self.query_out(message_query),
+            self.stale_refresh_pool.submit,
+        )
+        if call is not None and call.done.wait(Configurator.STALE_LATENCY_BUDGET):
+            if call.error is not None:
+                print(f"[ERROR] External DNS resolution failed: {call.error}")
+            elif call.result is not None:
+                return self.reply_with(call.result, message_query)
+        print(f"[WARNING] Answering {message_query.question.qname} with an expired record.")
+        return stale
+
+    async def resolve_out_or_stale_async(self, message_query: Message, stale: Message) -> Message:
+        """
+        Queries the external DNS servers without blocking the event loop, and answers with
+        the stale answer if they fail or take longer than Configurator.STALE_LATENCY_BUDGET.
+        The external query then keeps running, and refreshes the cache when it completes.
+        """
+        task = asyncio.ensure_future(self.resolve_out_async(message_query))
+        # Nobody awaits the task once the stale answer is sent, so its error is consumed here
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), Configurator.STALE_LATENCY_BUDGET)
+        except asyncio.TimeoutError:
+            result = None
+        except Exception as e:
+            print(f"[ERROR] External DNS resolution failed: {e}")
+            result = None
+        if result is not None:
+            return result
+        print(f"[WARNING] Answering {message_query.question.qname} with an expired record.")
+        return stale
+
+    def coalescing_key(self, message_query: Message) -> tuple:
+        """
+        Returns the key under which concurrent external queries for the same question are coalesced.
+        """
+        question = message_query.question
+        return question.qname.lower().rstrip("."), question.qtype, question.qclass
+
+    def reply_with(self, result: Message, message_query: Message):
+        """
+        Returns a copy of result answering message_query, since a coalesced
+        result may have been resolved for another query with another ID.
+        """
+        if result is None:
+            return None
+        response = Message(request=message_query)
+        for record in result.answers:
+            response.add_a_new_record_to_answer_section(record)
+        for record in result.authorities:
+            response.add_a_new_record_to_authority_section(record)
+        for record in result.additional:
+            response.add_a_new_record_to_additional_section(record)
+        response.set_header_flags(rcode=result.header.rcode)
+        return response
+
+    def search_locally(self, message_query: Message, referrals: bool = False):
+        """
+        Looks for an answer in the zones this Name Server is authoritative for, then in the cache.
+        A referral to a delegated zone is only returned if referrals is set.
+        If there is none, returns None.
+        """
+        result = self.search_record_in_zonefile(message_query, referrals)
+        if result is not None:
+            return result
+
         print(f"[DEBUG] Looking for {message_query.question.qname} in database...")
-        result = self.search_record_in_database(
+        cached_rrset, ttl = self.search_rrset_in_database(
             message_query.question.qname,
             message_query.question.qtype,
             message_query.question.qclass,
         )
 
-        if result is None:
-            print(f"[DEBUG] Not found in database. Checking zone file...")
-            result = self.search_record_in_zonefile(
-                message_query.question.qname, message_query.question.qtype
+        if cached_rrset:
+            result = Message(request=message_query)
+            for record in cached_rrset:
+                result.add_a_new_record_to_answer_section(record)
+            if self.prefetcher is not None:
+                # The response is not cached into the refresh window of the RRset,
+                # so that the hits in the window reach the prefetcher again
+                result.cache_ttl = self.prefetcher.time_to_window(cached_rrset[0].ttl, ttl)
+        else:
+            negative_answer = self.search_negative_in_database(
+                message_query.question.qname,
+                message_query.question.qtype,
+                message_query.question.qclass,
             )
+            if negative_answer is not None:
+                print(f"[DEBUG] Negative answer cached for {message_query.question.qname}.")
+                result = Message(request=message_query)
+                result.set_header_flags(rcode=negative_answer[0])
 
-        if result is None:
-            print(f"[DEBUG] Not found in zone file. Querying external DNS servers...")
-            result = self.query_out(message_query)
+        return result
 
+    def non_recursive_query(self, header: MessageHeader, question: MessageQuestion) -> Message:
+        """
+        Answers a query that does not desire recursion from the zones and the cache only,
+        with a referral if the name is delegated, and REFUSED if there is no local answer.
+        """
+        message_query = Message(header=header, question=question)
+        result = self.search_locally(message_query, referrals=True)
+        if result is None:
+            result = Message(request=message_query)
+            result.set_header_flags(rcode=5)
         return result
 
-    def search_record_in_database(self, qname: str, qtype: int = 1, qclass: int = 1):
+    def search_record_in_database(self, qname: str, qtype: int = 1, qclass: int = 1) -> list:
         """
-        Searches the DNS database for the requested record.
+        Searches the DNS database for the requested RRset.
+        The records carry the TTL remaining until they expire.
         """
-        self.database.refresh()
-        return self.database.query_from_database(qname, qtype, qclass)
+        return self.search_rrset_in_database(qname, qtype, qclass)[0]
 
-    def search_record_in_zonefile(self, qname: str, qtype: str):
+    def search_rrset_in_database(self, qname: str, qtype: int = 1, qclass: int = 1) -> tuple:
         """
-        Searches the local DNS zone file for a record.
-        If no record is found, returns None.
+        Searches the DNS database for the requested RRset, and counts the hit for the prefetcher.
+        Returns a tuple of (records with their remaining TTL, TTL the RRset was cached with).
         """
-        print(f"[DEBUG] Searching zone file for {qname} (Type: {qtype})...")
-        # Placeholder: Implement proper zone file search if needed
-        return None
+        # Records are cached under their fully qualified name
+        if not qname.endswith("."):
+            qname += "."
+        rrset, ttl = self.database.query_rrset_with_ttl(qname, qtype, qclass)
+        if rrset and self.prefetcher is not None:
+            self.prefetcher.hit((qname, qtype, qclass), rrset[0].ttl, ttl)
+        return rrset, ttl
 
-    def query_out(self, message_query: Message):
+    def refresh_record(self, key: tuple):
+        """
+        Queries the external DNS servers again for the (name, type, class) key of a cached
+        RRset, which replaces it. Called by the prefetcher before hot RRsets expire.
         """
-        Queries an external DNS server if the record is not found locally.
+        name, rr_type, rr_class = key
+        print(f"[DEBUG] Refreshing {name} before it expires...")
+        return self.query_out(Message(header=MessageHeader(), question=MessageQuestion(name.rstrip("."), rr_type, rr_class)))
+
+    def search_stale_in_database(self, message_query: Message):
+        """
+        Builds an answer from an RRset that expired less than Configurator.STALE_GRACE
+        seconds ago, with a TTL of Configurator.STALE_ANSWER_TTL (RFC 8767).
+        Returns None if there is none or the serve-stale mode is off.
         """
         qname = message_query.question.qname
-        qtype = message_query.question.qtype
-        resolver = dns.resolver.Resolver()
-        resolver.nameservers = ["8.8.8.8"]  # Google DNS as fallback
+        if not qname.endswith("."):
+            qname += "."
+        rrset = self.database.query_stale_rrset(qname, message_query.question.qtype, message_query.question.qclass)
+        if not rrset:
+            return None
+        result = Message(request=message_query)
+        for record in rrset:
+            result.add_a_new_record_to_answer_section(record.with_ttl(Configurator.STALE_ANSWER_TTL))
+        result.stale = True
+        return result
 
-        try:
-            resolve_query = resolver.resolve(
-                qname, message_query.question.INV_QTYPE[qtype], raise_on_no_answer=False
-            )
-            print(f"[DEBUG] External DNS query for {qname} succeeded.")
+    def search_negative_in_database(self, qname: str, qtype: int = 1, qclass: int = 1):
+        """
+        Searches the DNS database for a cached NXDOMAIN or NODATA answer.
+        Returns a tuple of (rcode, remaining TTL), or None.
+        """
+        if not qname.endswith("."):
+            qname += "."
+        return self.database.query_negative(qname, qtype, qclass)
 
-            # Check if there are answers before processing
-            if not resolve_query.response.answer:
-                print(f"[WARNING] No answer received from external DNS for {qname}.")
-                return None
+    def search_record_in_zonefile(self, message_query: Message, referrals: bool = False):
+        """
+        Searches the loaded zone files for the question of a query, and sets the AA flag
+        of the answer. A referral to a delegated zone is only returned if referrals is set.
+        If the name is in none of the zones, returns None.
+        """
+        if self.zones is None or message_query.question.qclass != 1:
+            return None
+        qname, qtype = message_query.question.qname, message_query.question.qtype
+        print(f"[DEBUG] Searching zone file for {qname} (Type: {qtype})...")
+        found = self.zones.lookup(qname, qtype)
+        if found is None or (not found["authoritative"] and not referrals):
+            return None
 
-            response_message = self.convert_response_answer_to_response_message(
-                resolve_query.response, message_query
-            )
+        result = Message(request=message_query)
+        for record in found["answers"]:
+            result.add_a_new_record_to_answer_section(record)
+        for record in found["authorities"]:
+            result.add_a_new_record_to_authority_section(record)
+        for record in found["additional"]:
+            result.add_a_new_record_to_additional_section(record)
+        result.set_header_flags(aa=found["authoritative"], rcode=found["rcode"])
+        return result
 
-            self.save_to_database(response_message)
-            return response_message
+    def make_external_query(self, message_query: Message) -> dns.message.Message:
+        """
+        Builds the query sent to the external DNS servers for a query message.
+        """
+        return dns.message.make_query(message_query.question.qname, message_query.question.qtype)
 
-        except dns.resolver.NoAnswer:
-            print(f"[WARNING] No answer available for {qname}.")
-            return None
-        except dns.resolver.NXDOMAIN:
-            print(f"[WARNING] {qname} does not exist (NXDOMAIN).")
+    def query_out(self, message_query: Message):
+        """
+        Queries the external DNS servers if the record is not found locally: the upstream pool,
+        or the authoritative servers found from the root in the iterative resolution mode.
+        """
+        try:
+            response = self.upstreams.query(self.make_external_query(message_query))
+        except dns.exception.DNSException as e:
+            print(f"[ERROR] External DNS resolution failed: {e}")
             return None
+        return self.handle_external_response(response, message_query)
+
+    async def query_out_async(self, message_query: Message):
+        """
+        Queries the external DNS servers of the upstream pool without blocking the event
+        loop, so that other queries keep being served while this one is in flight.
+        """
+        try:
+            response = await self.upstreams.query_async(self.make_external_query(message_query))
         except dns.exception.DNSException as e:
             print(f"[ERROR] External DNS resolution failed: {e}")
             return None
+        return self.handle_external_response(response, message_query)
+
+    def handle_external_response(self, response: dns.message.Message, message_query: Message):
+        """
+        Converts the response of an external DNS server and caches it. A response without
+        record (NODATA) or NXDOMAIN is cached as a negative answer, other errors return None.
+        """
+        qname = message_query.question.qname
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            print(f"[WARNING] {qname} does not exist (NXDOMAIN).")
+            response_message = self.convert_response_answer_to_response_message(response, message_query)
+            response_message.set_header_flags(rcode=3)
+            self.save_negative_to_database(response_message, 3)
+            return response_message
+        if rcode != dns.rcode.NOERROR:
+            print(f"[ERROR] External DNS resolution failed: {dns.rcode.to_text(rcode)}")
+            return None
+
+        print(f"[DEBUG] External DNS query for {qname} succeeded.")
+        response_message = self.convert_response_answer_to_response_message(response, message_query)
+
+        # Check if there are answers before processing
+        if not response.answer:
+            print(f"[WARNING] No answer received from external DNS for {qname}.")
+            self.save_negative_to_database(response_message, 0)
+            return response_message
+
+        self.save_to_database(response_message)
+        return response_message
 
     def convert_response_answer_to_response_message(self, response_answer, message_query: Message) -> Message:
         """
@@ -140,20 +476,271 @@ class NameServer:
 
         return message_response
 
+    def warm_start(self, snapshot_path: str):
+        """
+        Load the cache entries of the last snapshot that have not expired yet,
+        then keep saving snapshots every Configurator.SNAPSHOT_INTERVAL seconds.
+        """
+        if os.path.exists(snapshot_path):
+            try:
+                loaded = self.database.load_snapshot(snapshot_path)
+                print(f"[DEBUG] Loaded {loaded} cache entries from {snapshot_path}")
+            except Exception as e:
+                print(f"[ERROR] Failed to load snapshot {snapshot_path}: {e}")
+        if Configurator.SNAPSHOT_INTERVAL > 0:
+            self.database.start_snapshots(snapshot_path, Configurator.SNAPSHOT_INTERVAL)
+
     def save_to_database(self, response: Message):
         """
         Saves the resolved DNS records into the local database for caching.
         """
         print(f"[DEBUG] Saving resolved records to database...")
-        for answer in response.answers:
-            self.database.add_to_database(answer)
+        self.database.add_many(response.answers)
+
+    def save_negative_to_database(self, response: Message, rcode: int):
+        """
+        Caches a negative answer (NXDOMAIN or NODATA) for the question of the response.
+        The TTL comes from the SOA record of the Authority section, capped by
+        Configurator.NEGATIVE_TTL_MAX, or Configurator.NEGATIVE_TTL if there is no SOA.
+        """
+        ttl = response.get_negative_ttl()
+        ttl = Configurator.NEGATIVE_TTL if ttl is None else min(ttl, Configurator.NEGATIVE_TTL_MAX)
+        qname = response.question.qname
+        if not qname.endswith("."):
+            qname += "."
+        print(f"[DEBUG] Caching negative answer for {qname} for {ttl} seconds...")
+        self.database.add_negative(qname, response.question.qtype, response.question.qclass, rcode, ttl)
+
+    def answer(self, byte_data: bytes, udp: bool = False):
+        """
+        Decrypts a query, resolves it and returns the encrypted response,
+        or None if the query could not be answered.
+        udp is set for queries received over UDP, whose responses must fit in the payload
+        size the query advertised, see fit_response.
+        """
+        if Configurator.MESSAGE_FORMAT == "wire":
+            return self.answer_wire(byte_data, udp)
+        self.count("queries")
+        try:
+            data_receive = AESCipher().decrypt(byte_data)
+            if not data_receive:
+                return None
+
+            cached = self.cached_text_response(data_receive, udp)
+            if cached is not None:
+                self.count("answered")
+                return cached
+
+            message_query = parse_string_msg(data_receive)
+            print(f"[SERVER] Received request for {message_query.question.qname}")
+            response = self.handle_query(message_query)
+            return self.text_response(data_receive, message_query, response, udp)
+        except Exception as e:
+            print(f"[ERROR] Exception while answering a query: {e}")
+            self.count("failed")
+            return None
+
+    def answer_wire(self, byte_data: bytes, udp: bool = False):
+        """
+        Resolves a query in the wire format and returns the response in the wire format.
+        A query that cannot be decoded gets a FORMERR response, one with an opcode other
+        than QUERY a NOTIMP response and one that could not be answered a SERVFAIL response,
+        see wire_error. None is only returned for data that is not a query.
+        """
+        self.count("queries")
+        try:
+            if self.wire_opcode(byte_data):
+                return self.wire_error(byte_data, 4)
+            message_query = self.decode_wire_query(byte_data)
+            if message_query is None:
+                return self.wire_error(byte_data, 1)
+
+            cached = self.cached_wire_response(byte_data, message_query, udp)
+            if cached is not None:
+                self.count("answered")
+                return cached
+
+            print(f"[SERVER] Received request for {message_query.question.qname}")
+            response = self.handle_query(message_query)
+            return self.wire_response(byte_data, message_query, response, udp)
+        except Exception as e:
+            print(f"[ERROR] Exception while answering a query: {e}")
+            return self.wire_error(byte_data, 2)
+
+    @staticmethod
+    def wire_opcode(byte_data: bytes) -> int:
+        """Returns the opcode of a message in the wire format, 0 for a standard query."""
+        return byte_data[2] >> 3 & 0xF if len(byte_data) > 2 else 0
+
+    def decode_wire_query(self, byte_data: bytes):
+        """
+        Decodes a query in the wire format, or returns None if it cannot be decoded,
+        such as a query for the root or a single-label name, which Message does not support.
+        """
+        try:
+            return decode_message(byte_data)
+        except Exception as e:
+            print(f"[ERROR] Malformed query: {e}")
+            return None
+
+    def wire_error(self, byte_data: bytes, rcode: int):
+        """
+        Returns a response with rcode to a query in the wire format, built from its header
+        and question without decoding them, or None if the data is not a query.
+        Messages with the QR flag set are responses and are never answered.
+        """
+        self.count("failed")
+        if len(byte_data) > 2 and byte_data[2] & 0x80:
+            return None
+        return encode_error(byte_data, rcode, ra=True)
+
+    def text_response(self, data_receive: str, message_query: Message, response: Message, udp: bool) -> bytes:
+        """
+        Caches and encrypts the response to a decrypted query.
+        """
+        if isinstance(response, str):
+            self.count("answered")
+            return AESCipher().encrypt(response)
+        return self.fit_response(data_receive, message_query, response, udp,
+                                 lambda message: AESCipher().encrypt(message.to_string()))
+
+    def wire_response(self, byte_data: bytes, message_query: Message, response: Message, udp: bool) -> bytes:
+        """
+        Caches and encodes the response to a query in the wire format. The NameServer
+        resolves recursively, so the RA flag is set whatever the query carried.
+        A query that got no response is answered with SERVFAIL.
+        """
+        if response is None:
+            print(f"[ERROR] No response to the query for {message_query.question.qname}")
+            return self.wire_error(byte_data, 2)
+        response.set_header_flags(ra=True)
+        data = bytearray(self.fit_response(byte_data, message_query, response, udp, encode_message))
+        echo_qname(data, byte_data)
+        return bytes(data)
+
+    def fit_response(self, query_data, message_query: Message, response: Message, udp: bool, encode) -> bytes:
+        """
+        Caches the whole response to a query, then encodes it with encode. The response
+        advertises Configurator.UDP_PAYLOAD_SIZE if the query advertised a payload size.
+        Over UDP, a response longer than Configurator.udp_limit() for the query is cut at a record
+        boundary with the TC flag set, so that the client retries over TCP.
+        """
+        response.payload_size = Configurator.UDP_PAYLOAD_SIZE if message_query.payload_size else None
+        self.cache_response(query_data, response)
+        if not udp:
+            data = encode(response)
+        else:
+            data, truncated = response.fit(encode, Configurator.udp_limit(message_query.payload_size))
+            if truncated:
+                print(f"[SERVER] Truncated UDP response for {message_query.question.qname} to {len(data)} bytes")
+                self.count("truncated")
+        self.count("answered")
+        return data
+
+    def cached_text_response(self, data_receive: str, udp: bool):
+        """
+        Returns the encrypted cached response to a decrypted query, or None if there is none
+        or it is too long for a UDP response to the query, which is then truncated from the
+        Message instead.
+        """
+        cached = self.cached_response(data_receive)
+        if cached is None:
+            return None
+        data = AESCipher().encrypt(cached)
+        if (udp and len(data) > Configurator.DEFAULT_UDP_PAYLOAD_SIZE
+                and len(data) > Configurator.udp_limit(parse_string_payload_size(data_receive))):
+            return None
+        return data
+
+    def cached_wire_response(self, byte_data: bytes, message_query: Message, udp: bool):
+        """
+        Returns the cached response to a query in the wire format, decoded as message_query,
+        or None if there is none or it is too long for a UDP response to the query.
+        """
+        data = self.cached_response(byte_data)
+        if (data is not None and udp and len(data) > Configurator.DEFAULT_UDP_PAYLOAD_SIZE
+                and len(data) > Configurator.udp_limit(message_query.payload_size)):
+            return None
+        return data
+
+    def cached_response(self, data_receive):
+        """
+        Returns the text of the cached response to a decrypted query, or the cached response
+        to a query in the wire format, with the ID of the query and the remaining TTLs
+        filled in, or None if there is none.
+        """
+        if self.response_cache is None:
+            return None
+        if not isinstance(data_receive, str):
+            return self.response_cache.get_wire(data_receive, self.zones_generation())
+        return self.response_cache.get(data_receive, self.zones_generation())
+
+    def cache_response(self, data_receive, response: Message):
+        """
+        Caches the serialized response to a decrypted query, if it has records to expire it by.
+        Stale answers are not cached, so that the answer of the refresh is served once it arrives.
+        With prefetching on, a response is only cached until the refresh window of its records
+        starts: the hits in the window then reach the prefetcher through search_locally.
+        """
+        if self.response_cache is None or response is None or response.stale:
+            return
+        if self.prefetcher is not None and response.cache_ttl is None and response.answers:
+            # A fresh answer, whose records carry their whole TTL
+            ttl = min(record.ttl for record in response.answers)
+            response.cache_ttl = self.prefetcher.time_to_window(ttl, ttl)
+        if not isinstance(data_receive, str):
+            self.response_cache.put_wire(data_receive, response, self.zones_generation())
+        else:
+            self.response_cache.put(data_receive, response, self.zones_generation())
+
+    def zones_generation(self) -> int:
+        """
+        Returns the generation of the loaded zones, so that the responses cached
+        before a zone reload are not served after it.
+        """
+        return self.zones.generation if self.zones is not None else 0
+
+    def get_response_cache_stats(self):
+        """
+        Returns the hits, misses and evictions of the response cache, or None if there is none.
+        """
+        return self.response_cache.stats if self.response_cache is not None else None
+
+    def servfail(self, byte_data: bytes):
+        """
+        Returns a SERVFAIL response to a query without resolving it, encrypted or in the
+        wire format like the query, or None if the query cannot be parsed.
+        """
+        try:
+            if Configurator.MESSAGE_FORMAT == "wire":
+                self.count("shed")
+                return encode_error(byte_data, 2, ra=True)
+            response = Message(request=parse_string_msg(AESCipher().decrypt(byte_data)))
+            response.set_header_flags(rcode=2)
+            self.count("shed")
+            return AESCipher().encrypt(response.to_string())
+        except Exception as e:
+            print(f"[ERROR] Exception while building a SERVFAIL response: {e}")
+            return None
 
     def start_listening_udp(self):
         """
         Starts a UDP listener for incoming DNS queries.
+
+        The listening thread only drains the socket into the bounded queue of a WorkerPool
+        of Configurator.WORKER_THREADS threads, which resolve the queries and reply. When
+        Configurator.WORKER_QUEUE_SIZE queries are waiting, the oldest one is dropped or
+        the new one gets an immediate SERVFAIL, following Configurator.SHED_POLICY.
+
+        Datagrams are received with recvfrom_into() into the buffers of a BufferPool, one per
+        query in the queue or being answered, and are decoded from a memoryview over them.
+        A buffer is given back once its query has been answered or shed.
         """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Prevent binding issues
+        if Configurator.REUSE_PORT:
+            # Every worker process of a Supervisor binds the same port and the kernel spreads the load
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_address = (Configurator.IP, Configurator.UDP_PORT)
 
         try:
@@ -163,37 +750,80 @@ class NameServer:
             print(f"[ERROR] Failed to bind UDP socket: {e}")
             return
 
-        while True:
+        def reply(request: tuple, answer):
+            byte_data, client_address, buffer = request
             try:
-                byte_data, client_address = sock.recvfrom(Configurator.BUFFER_SIZE)
-                data_receive = AESCipher().decrypt(byte_data)
-
-                if data_receive:
-                    message_query = parse_string_msg(data_receive)
-                    print(f"[SERVER] Received request for {message_query.question.qname} via UDP")
-
-                    response = self.handle_query(message_query)
-
-                    if not isinstance(response, str):
-                        response = response.to_string()
-
-                    response_data = AESCipher().encrypt(response)
+                response_data = answer(byte_data) if answer is not None else None
+                if response_data:
                     sock.sendto(response_data, client_address)
                     print(f"[SERVER] Sent response to {client_address}")
+            finally:
+                self.udp_buffers.give(buffer)
 
+        drop_oldest = Configurator.SHED_POLICY == "drop-oldest"
+        self.udp_pool = WorkerPool(
+            Configurator.WORKER_THREADS,
+            Configurator.WORKER_QUEUE_SIZE,
+            lambda request: reply(request, lambda byte_data: self.answer(byte_data, udp=True)),
+            drop_oldest=drop_oldest,
+            on_shed=lambda request: reply(request, None if drop_oldest else self.servfail),
+        )
+
+        while True:
+            buffer = self.udp_buffers.take()
+            try:
+                size, client_address = sock.recvfrom_into(buffer)
             except Exception as e:
                 print(f"[ERROR] Exception while handling UDP connection: {e}")
+                self.udp_buffers.give(buffer)
+                continue
+            self.udp_pool.submit((memoryview(buffer)[:size], client_address, buffer))
+
+    def get_udp_pool_stats(self):
+        """
+        Returns the queue depth, wait times and shed count of the UDP worker pool, with the
+        use of its receive buffers, or None if the threaded UDP listener is not running.
+        """
+        if self.udp_pool is None:
+            return None
+        stats = self.udp_pool.stats
+        stats["buffers"] = self.udp_buffers.stats
+        return stats
+
+    def get_coalescing_stats(self):
+        """
+        Returns how many external queries ran and how many cache misses waited for one
+        already in flight for the same question, or None if coalescing is off.
+        """
+        return self.coalescer.stats if self.coalescer is not None else None
+
+    def get_prefetch_stats(self):
+        """
+        Returns how many hot RRsets were refreshed before they expired, or None if prefetching is off.
+        """
+        return self.prefetcher.stats if self.prefetcher is not None else None
+
+    def get_upstream_stats(self):
+        """
+        Returns the smoothed RTT, failures and ejection state of every external DNS server,
+        or the query, referral and delegation cache counters in the iterative resolution mode.
+        """
+        return self.upstreams.stats
 
     def start_listening_tcp(self):
         """
         Starts a TCP listener for incoming DNS queries.
+        Every connection is served by its own thread, see serve_tcp_connection.
         """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if Configurator.REUSE_PORT:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_address = (Configurator.IP, Configurator.TCP_PORT)
 
         try:
             sock.bind(server_address)
-            sock.listen(5)
+            sock.listen(Configurator.TCP_BACKLOG)
             print(f"[SERVER] Listening for TCP connections at {Configurator.IP}:{Configurator.TCP_PORT}...")
         except OSError as e:
             print(f"[ERROR] Failed to bind TCP socket: {e}")
@@ -202,37 +832,223 @@ class NameServer:
         while True:
             try:
                 connection, client_address = sock.accept()
-                byte_data = connection.recv(Configurator.BUFFER_SIZE)
-                data_receive = AESCipher().decrypt(byte_data)
+                threading.Thread(
+                    target=self.serve_tcp_connection, args=(connection, client_address), daemon=True
+                ).start()
+            except Exception as e:
+                print(f"[ERROR] Exception while accepting TCP connection: {e}")
+
+    def serve_tcp_connection(self, connection: socket.socket, client_address: tuple):
+        """
+        Serves the length-prefixed queries of one TCP connection until the client closes it
+        or it stays idle for Configurator.TCP_IDLE_TIMEOUT seconds.
+        Up to Configurator.TCP_PIPELINE queries of the connection are resolved at once, and
+        each response is sent as soon as it is ready; clients match them by message ID.
+        """
+        connection.settimeout(Configurator.TCP_IDLE_TIMEOUT)
+        send_lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(Configurator.TCP_PIPELINE)
+
+        def respond(byte_data: bytes):
+            try:
+                response_data = self.answer(byte_data)
+                if response_data:
+                    with send_lock:
+                        send_frame(connection, response_data)
+            except OSError as e:
+                print(f"[ERROR] Failed to send TCP response to {client_address}: {e}")
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                byte_data = recv_frame(connection)
+                if byte_data is None:
+                    break
+                in_flight.acquire()
+                threading.Thread(target=respond, args=(byte_data,), daemon=True).start()
+        except socket.timeout:
+            print(f"[SERVER] Closing idle TCP connection from {client_address}")
+        except Exception as e:
+            print(f"[ERROR] Exception while handling TCP connection: {e}")
+        finally:
+            # Let the responses in flight be sent before closing
+            for _ in range(Configurator.TCP_PIPELINE):
+                in_flight.acquire()
+            connection.close()
 
-                if not data_receive:
-                    continue
+    async def answer_async(self, byte_data: bytes, udp: bool = False):
+        """
+        Decrypts a query, resolves it and returns the encrypted response,
+        or None if the query could not be answered.
+        """
+        if Configurator.MESSAGE_FORMAT == "wire":
+            return await self.answer_wire_async(byte_data, udp)
+        self.count("queries")
+        try:
+            data_receive = AESCipher().decrypt(byte_data)
+            if not data_receive:
+                return None
 
-                message_query = parse_string_msg(data_receive)
-                print(f"[SERVER] Received request for {message_query.question.qname} via TCP")
+            cached = self.cached_text_response(data_receive, udp)
+            if cached is not None:
+                self.count("answered")
+                return cached
 
-                response = self.handle_query(message_query)
+            message_query = parse_string_msg(data_receive)
+            response = await self.handle_query_async(message_query)
+            return self.text_response(data_receive, message_query, response, udp)
+        except Exception as e:
+            print(f"[ERROR] Exception while answering a query: {e}")
+            self.count("failed")
+            return None
 
-                if not isinstance(response, str):
-                    response = response.to_string()
+    async def answer_wire_async(self, byte_data: bytes, udp: bool = False):
+        """
+        Resolves a query in the wire format on the event loop and returns the response
+        in the wire format, like answer_wire.
+        """
+        self.count("queries")
+        try:
+            if self.wire_opcode(byte_data):
+                return self.wire_error(byte_data, 4)
+            message_query = self.decode_wire_query(byte_data)
+            if message_query is None:
+                return self.wire_error(byte_data, 1)
 
-                response_data = AESCipher().encrypt(response)
-                connection.sendall(response_data)
-                connection.close()
-                print(f"[SERVER] Response sent to {client_address}")
+            cached = self.cached_wire_response(byte_data, message_query, udp)
+            if cached is not None:
+                self.count("answered")
+                return cached
 
+            response = await self.handle_query_async(message_query)
+            return self.wire_response(byte_data, message_query, response, udp)
+        except Exception as e:
+            print(f"[ERROR] Exception while answering a query: {e}")
+            return self.wire_error(byte_data, 2)
+
+    async def handle_tcp_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves the length-prefixed queries of one TCP connection in the asyncio serving mode,
+        like serve_tcp_connection.
+        """
+        client_address = writer.get_extra_info("peername")
+        in_flight = asyncio.Semaphore(Configurator.TCP_PIPELINE)
+        tasks = set()
+
+        async def respond(byte_data: bytes):
+            try:
+                response_data = await self.answer_async(byte_data)
+                if response_data and not writer.is_closing():
+                    writer.write(frame(response_data))
+                    await writer.drain()
             except Exception as e:
-                print(f"[ERROR] Exception while handling TCP connection: {e}")
+                print(f"[ERROR] Failed to send TCP response to {client_address}: {e}")
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                byte_data = await asyncio.wait_for(read_frame(reader), Configurator.TCP_IDLE_TIMEOUT)
+                if byte_data is None:
+                    break
+                await in_flight.acquire()
+                task = asyncio.ensure_future(respond(byte_data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except asyncio.TimeoutError:
+            print(f"[SERVER] Closing idle TCP connection from {client_address}")
+        except Exception as e:
+            print(f"[ERROR] Exception while handling TCP connection: {e}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def start_async_servers(self, ip: str = None, udp_port: int = None, tcp_port: int = None):
+        """
+        Starts the UDP and TCP listeners of the asyncio serving mode on the running event loop.
+        Defaults to the address in Configurator. Returns the UDP transport and the TCP server.
+        """
+        ip = Configurator.IP if ip is None else ip
+        udp_port = Configurator.UDP_PORT if udp_port is None else udp_port
+        tcp_port = Configurator.TCP_PORT if tcp_port is None else tcp_port
+
+        loop = asyncio.get_running_loop()
+        reuse_port = Configurator.REUSE_PORT or None
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: NameServerProtocol(self), local_addr=(ip, udp_port), reuse_port=reuse_port
+        )
+        server = await asyncio.start_server(
+            self.handle_tcp_async, ip, tcp_port, reuse_port=reuse_port, backlog=Configurator.TCP_BACKLOG
+        )
+        print(f"[SERVER] Listening for UDP and TCP connections at {ip}:{udp_port}/{tcp_port} (asyncio)...")
+        return transport, server
+
+    async def serve_async(self):
+        """
+        Serves UDP and TCP queries on a single event loop until cancelled.
+        """
+        transport, server = await self.start_async_servers()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            transport.close()
+
+    def serve(self):
+        """
+        Serves UDP and TCP queries in the mode selected by Configurator.SERVER_MODE until interrupted.
+        """
+        if Configurator.SERVER_MODE == "asyncio":
+            asyncio.run(self.serve_async())
+        else:
+            udp_thread = threading.Thread(target=self.start_listening_udp)
+            udp_thread.start()
+
+            tcp_thread = threading.Thread(target=self.start_listening_tcp)
+            tcp_thread.start()
+
+            udp_thread.join()
+            tcp_thread.join()
+
+
+class NameServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, name_server: NameServer):
+        """
+        Serves the UDP queries of a NameServer on an asyncio event loop.
+        Every datagram is answered by its own task, so a query waiting for an
+        external DNS server does not hold back the others.
+        """
+        self.name_server = name_server
+        self.transport = None
+        self.tasks = set()
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        task = asyncio.ensure_future(self.answer(data, addr))
+        # Keep a reference until the task is done, the event loop only keeps a weak one
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def answer(self, data: bytes, addr: tuple):
+        response_data = await self.name_server.answer_async(data, udp=True)
+        if response_data and not self.transport.is_closing():
+            self.transport.sendto(response_data, addr)
+            print(f"[SERVER] Sent response to {addr}")
+
 
 if __name__ == "__main__":
     try:
-        name_server = NameServer()
-
-        udp_thread = threading.Thread(target=name_server.start_listening_udp)
-        udp_thread.start()
+        if Configurator.SERVER_PROCESSES > 1:
+            from Supervisor import Supervisor
 
-        tcp_thread = threading.Thread(target=name_server.start_listening_tcp)
-        tcp_thread.start()
+            Configurator.config_me(53, 53)
+            Supervisor(Configurator.SERVER_PROCESSES).run()
+        else:
+            NameServer().serve()
 
     except KeyboardInterrupt:
         print("\n[INFO] NameServer shutting down.")
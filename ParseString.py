@@ -6,49 +6,17 @@ from ResourceRecord import ResourceRecord
 
 def parse_string_flag(flags: str) -> dict:
     """Parse a hex string of flags to a dictionary of flags with values converted properly."""
-    # convert hex string to bin string
-    bin_str = bin(int(flags, 16))[2:].rjust(16, "0")
+    # read the bits of the 16-bit value in place, instead of slicing a binary string
+    value = int(flags, 16)
 
-    d_flags = dict()
-    cur_bit_pos = 0
-
-    # get 1-bit QR
-    d_flags['qr'] = int(bin_str[cur_bit_pos])
-    cur_bit_pos += 1
-
-    # get 4-bit OPCODE
-    d_flags['opcode'] = int(bin_str[cur_bit_pos: cur_bit_pos + 4], 2)
-    cur_bit_pos += 4
-
-    # get 1-bit AA
-    d_flags['aa'] = bin_str[cur_bit_pos] == '1'
-    cur_bit_pos += 1
-
-    # get 1-bit TC
-    d_flags['tc'] = bin_str[cur_bit_pos] == '1'
-    cur_bit_pos += 1
-
-    # get 1-bit RD
-    d_flags['rd'] = bin_str[cur_bit_pos] == '1'
-    cur_bit_pos += 1
-
-    # get 1-bit RA
-    d_flags['ra'] = bin_str[cur_bit_pos] == '1'
-    cur_bit_pos += 1
-
-    # get 3-bit Z
-    z_flg = bin_str[cur_bit_pos:cur_bit_pos + 3]
-    d_flags['z'] = int(z_flg)
-    cur_bit_pos += 3
-
-    # get 4-bit RCODE
-    r_code = bin_str[cur_bit_pos:cur_bit_pos + 4]
-    if r_code != '':
-        d_flags['rcode'] = int(bin_str[cur_bit_pos: cur_bit_pos + 4], 2)
-    else:
-        d_flags['rcode'] = 0
-
-    return d_flags
+    return dict(qr=value >> 15 & 1,             # 1-bit QR
+                opcode=value >> 11 & 0xF,       # 4-bit OPCODE
+                aa=bool(value & 0x400),         # 1-bit AA
+                tc=bool(value & 0x200),         # 1-bit TC
+                rd=bool(value & 0x100),         # 1-bit RD
+                ra=bool(value & 0x80),          # 1-bit RA
+                z=value >> 4 & 0x7,             # 3-bit Z
+                rcode=value & 0xF)              # 4-bit RCODE
 
 
 def parse_string_question(question: str) -> MessageQuestion:
@@ -138,4 +106,19 @@ def parse_string_msg(msg: str) -> Message:
             parse_string_resource_record(lines[cur_line]))
         cur_line += 1
 
+    # advertised UDP payload size
+    if cur_line < len(lines):
+        message.payload_size = parse_string_payload_size(lines[cur_line])
+
     return message
+
+
+def parse_string_payload_size(msg: str):
+    """
+    Return the UDP payload size advertised on the "edns;<size>" last line of a message string,
+    or None if there is none. Sizes below 512 bytes are read as 512 (RFC 6891 6.2.5).
+    """
+    index = msg.rfind("edns;")
+    if index < 0 or (index > 0 and msg[index - 1] != "\n"):
+        return None
+    return max(512, int(msg[index + 5:].strip()))
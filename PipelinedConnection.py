@@ -0,0 +1,111 @@
+import socket
+import threading
+from Framing import recv_frame, send_frame
+
+
+class PipelinedConnection:
+    def __init__(self, address: tuple, decode, key, timeout: float = 2.0):
+        """
+        Init a persistent TCP connection carrying many length-prefixed queries at once.
+
+        A query is sent as soon as it is made, under a lock held only while its frame is
+        written, and then waits for its response. A reader thread receives the responses
+        in the order the server sends them and hands each one to the oldest query waiting
+        for its key. Responses that no query waits for, such as the late responses of
+        queries that timed out, are dropped.
+
+        Parameters:
+        address         -> (ip, port) of the server
+        decode          -> Function converting a received frame into a response
+        key             -> Function returning the key matching a response to its query
+        timeout         -> Seconds to wait for the connection and for every response
+        """
+        self._sock = socket.create_connection(address, timeout=timeout)
+        self._sock.settimeout(None)
+        self._decode = decode
+        self._key = key
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        # Queries waiting for a response, by key, each a list of [event, response] in sending order
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # Why the connection was closed, None while it is open
+        self._error = None
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def get_sock(self) -> socket.socket:
+        """Return the socket of the connection."""
+        return self._sock
+
+    def is_closed(self) -> bool:
+        """Return True once the connection was closed by either side or failed."""
+        return self._error is not None
+
+    sock = property(get_sock)
+    closed = property(is_closed)
+
+    def request(self, data: bytes, key):
+        """
+        Send a query and return its response, the first one received with key.
+        Raise socket.timeout if none arrives in time, and ConnectionError if the connection
+        is closed before. Other queries keep being sent and answered meanwhile.
+        """
+        waiter = [threading.Event(), None]
+        with self._pending_lock:
+            if self._error is not None:
+                raise ConnectionError(self._error)
+            self._pending.setdefault(key, []).append(waiter)
+        try:
+            try:
+                with self._send_lock:
+                    send_frame(self._sock, data)
+            except OSError as e:
+                self.close(f"failed to send: {e}")
+                raise
+            if not waiter[0].wait(self._timeout):
+                raise socket.timeout("timed out waiting for the response")
+        finally:
+            with self._pending_lock:
+                waiters = self._pending.get(key, [])
+                for i, other in enumerate(waiters):
+                    if other is waiter:
+                        del waiters[i]
+                        break
+                if not waiters:
+                    self._pending.pop(key, None)
+        if waiter[1] is None:
+            raise ConnectionError(self._error)
+        return waiter[1]
+
+    def _read(self):
+        """Receive the responses and wake the queries waiting for them, until the connection closes."""
+        try:
+            while True:
+                data = recv_frame(self._sock)
+                if data is None:
+                    raise ConnectionError("connection closed by the server")
+                response = self._decode(data)
+                with self._pending_lock:
+                    waiters = self._pending.get(self._key(response))
+                    if not waiters:
+                        continue
+                    waiter = waiters.pop(0)
+                waiter[1] = response
+                waiter[0].set()
+        except Exception as e:
+            self.close(str(e))
+
+    def close(self, reason: str = "connection closed"):
+        """Close the connection. The queries still waiting fail with a ConnectionError."""
+        with self._pending_lock:
+            if self._error is not None:
+                return
+            self._error = reason
+            waiters = [waiter for waiters in self._pending.values() for waiter in waiters]
+        for waiter in waiters:
+            waiter[0].set()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
@@ -0,0 +1,100 @@
+import random
+import threading
+
+
+class Prefetcher:
+    # Cache entries whose hits are counted at once; the oldest counts are dropped beyond it
+    MAX_TRACKED = 100000
+
+    def __init__(self, refresh, window: float = 0.1, min_hits: int = 3, jitter: float = 0.5,
+                 max_in_flight: int = 4):
+        """
+        Init a refresh-ahead tracker of the hits on cached RRsets.
+
+        When an RRset that was hit at least min_hits times is hit again in the last window
+        fraction of its TTL, refresh is called with its key on a background thread, to query
+        it again and replace it before it expires. The window of every entry is shortened
+        by a random fraction of up to jitter, so entries cached at the same time are not all
+        refreshed at once, and at most max_in_flight refreshes run at the same time.
+
+        Parameters:
+        refresh         -> Function called with the (name, type, class) key of an RRset to refresh it,
+                           returning None if it failed
+        window          -> Fraction of the TTL at the end of which hot entries are refreshed
+        min_hits        -> Hits after which an entry is hot
+        jitter          -> Largest fraction of the window taken off for an entry
+        max_in_flight   -> Maximum number of refreshes running at once
+        """
+        self._refresh = refresh
+        self._window = window
+        self._min_hits = min_hits
+        self._jitter = jitter
+        self._max_in_flight = max_in_flight
+        # key -> [hits, window of the entry]
+        self._entries = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stats = dict(refreshes=0, failures=0, capped=0)
+
+    def hit(self, key: tuple, remaining: int, ttl: int) -> bool:
+        """
+        Count a hit on the RRset of key, which has remaining of its ttl seconds left.
+        Return True if this hit started a refresh of the RRset.
+        """
+        if ttl <= 0:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.MAX_TRACKED:
+                    del self._entries[next(iter(self._entries))]
+                entry = self._entries[key] = [0, self._window * (1 - random.uniform(0, self._jitter))]
+            entry[0] += 1
+            if entry[0] < self._min_hits or remaining > ttl * entry[1] or key in self._in_flight:
+                return False
+            if len(self._in_flight) >= self._max_in_flight:
+                self._stats["capped"] += 1
+                return False
+            self._in_flight.add(key)
+            # The refreshed RRset is a new entry, whose hits are counted from 0
+            del self._entries[key]
+            self._stats["refreshes"] += 1
+
+        threading.Thread(target=self._run, args=(key,), daemon=True).start()
+        return True
+
+    def time_to_window(self, remaining: int, ttl: int) -> int:
+        """
+        Return the seconds left before an RRset with remaining of its ttl seconds left enters
+        the window of any entry, 0 if it already has. Until then, its hits cannot start a refresh.
+        """
+        return max(0, int(remaining - ttl * self._window))
+
+    def _run(self, key: tuple):
+        """Refresh the RRset of key."""
+        try:
+            refreshed = self._refresh(key)
+        except Exception as e:
+            print(f"[ERROR] Exception while refreshing {key[0]}: {e}")
+            refreshed = None
+        if refreshed is None:
+            with self._lock:
+                self._stats["failures"] += 1
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def get_in_flight(self):
+        """Return the number of refreshes running."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def get_stats(self):
+        """Return how many refreshes were started, failed, or not started because too many were running."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._in_flight)
+            stats["tracked"] = len(self._entries)
+        return stats
+
+    in_flight = property(get_in_flight)
+    stats = property(get_stats)
@@ -5,122 +5,197 @@ import time
 from Message import Message
 from AES import AESCipher
 from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
 from ParseString import parse_string_msg
 from configurator import Configurator
-from ParseString import parse_string_question
-from Database import Database
+from ParseString import parse_string_question, parse_string_flag
+from CacheStore import create_store
+from MemoryCache import MemoryCache
+from Framing import recv_frame, send_frame
+from PipelinedConnection import PipelinedConnection
+from Prefetcher import Prefetcher
+from BufferPool import BufferPool
 
 
 class Resolver:
     def __init__(self):
         """Initialize the Resolver."""
-        self.database = Database("DatabaseResolver.db")
+        self.database = create_store(
+            "DatabaseResolver",
+            Configurator.CACHE_BACKEND,
+            memory_cache=MemoryCache(
+                Configurator.MEMORY_CACHE_ENTRIES,
+                Configurator.MEMORY_CACHE_BYTES,
+                policy=Configurator.MEMORY_CACHE_POLICY,
+                admission=Configurator.MEMORY_CACHE_ADMISSION,
+            ),
+        )
+        self.database.start_sweeper(Configurator.SWEEP_INTERVAL, Configurator.SWEEP_BATCH_SIZE)
+        self.warm_start("DatabaseResolver.snapshot")
+        self.prefetcher = None
+        if Configurator.PREFETCH_WINDOW > 0:
+            self.prefetcher = Prefetcher(
+                self.refresh_record,
+                window=Configurator.PREFETCH_WINDOW,
+                min_hits=Configurator.PREFETCH_MIN_HITS,
+                jitter=Configurator.PREFETCH_JITTER,
+                max_in_flight=Configurator.PREFETCH_MAX_IN_FLIGHT,
+            )
         Configurator.config_me(9292, 9393)
         Configurator.config_others(int(input("Number of name servers: ")))
+        # Index of the NameServer asked next, shared by the listener and the prefetch threads
         self.this_ns_idx = 0
+        self._ns_lock = threading.Lock()
+
+        # Receive buffers of the UDP queries to the NameServers, which prefetching runs from several threads
+        self.receive_buffers = BufferPool(Configurator.BUFFER_SIZE, Configurator.PREFETCH_MAX_IN_FLIGHT + 2)
+
+        # Persistent, pipelined TCP connections to the NameServers, by address
+        self._tcp_connections = {}
+        self._tcp_lock = threading.Lock()
 
         # Fix the "clear" error for Windows users
         os.system("cls" if os.name == "nt" else "clear")
 
-    def _use_tcp(self, message: str) -> str:
+    def _next_name_server(self) -> dict:
+        """Return the entry of Configurator.OTHERS of the NameServer to ask, in turn."""
+        with self._ns_lock:
+            name_server = Configurator.OTHERS[self.this_ns_idx]
+            self.this_ns_idx = (self.this_ns_idx + 1) % len(Configurator.OTHERS)
+        return name_server
+
+    @staticmethod
+    def _response_key(message: str) -> tuple:
+        """Return the message ID and the question of a message, which its response repeats."""
+        lines = message.split("\n", 7)
+        return lines[0], lines[6] if len(lines) > 6 else None
+
+    def _use_tcp(self, message: str, name_server: dict = None) -> str:
         """
-        Create a TCP connection to the NameServer, then send the message.
+        Send the message to a NameServer, the next one unless name_server is given, over a
+        persistent TCP connection shared with the queries of the other threads, and wait for
+        the response with the same message ID and question.
+        A connection that the NameServer closed while idle is reopened once.
         If there is an error while sending and receiving the message, return an error message.
         """
-        tcp_resolver_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_address = (
-            Configurator.OTHERS[self.this_ns_idx]["ip"],
-            Configurator.OTHERS[self.this_ns_idx]["tcp"],
-        )
-        self.this_ns_idx = (self.this_ns_idx + 1) % len(Configurator.OTHERS)
-
-        tcp_resolver_socket.settimeout(2.0)  # Increased timeout for better stability
-
-        try:
-            print(f"[DEBUG] Connecting to NameServer at {server_address} via TCP")
-            tcp_resolver_socket.connect(server_address)
+        if name_server is None:
+            name_server = self._next_name_server()
+        server_address = (name_server["ip"], name_server["tcp"])
+        key = self._response_key(message)
 
-            # Encrypt and send message
-            bytes_to_send = AESCipher().encrypt(message)
-            tcp_resolver_socket.sendall(bytes_to_send)
-
-            # Receive response
-            response_bytes = tcp_resolver_socket.recv(Configurator.BUFFER_SIZE)
-            print(f"[DEBUG] Raw response received (TCP): {response_bytes}")
-
-            response = AESCipher().decrypt(response_bytes)
-            print(f"[DEBUG] Decrypted response (TCP): {response}")
-
-        except Exception as e:
-            print(f"[ERROR] TCP Connection failed: {e}")
-            response = "Failed-" + str(e)
-
-        finally:
-            tcp_resolver_socket.close()
-            return response
+        for attempt in range(2):
+            try:
+                with self._tcp_lock:
+                    connection = self._tcp_connections.get(server_address)
+                    reused = connection is not None and not connection.closed
+                    if not reused:
+                        print(f"[DEBUG] Connecting to NameServer at {server_address} via TCP")
+                        connection = PipelinedConnection(
+                            server_address, AESCipher().decrypt, self._response_key, timeout=2.0
+                        )
+                        self._tcp_connections[server_address] = connection
+
+                response = connection.request(AESCipher().encrypt(message), key)
+                print(f"[DEBUG] Decrypted response (TCP): {response}")
+                return response
+
+            except socket.timeout as e:
+                # Only this query failed, the others on the connection are still answered
+                print(f"[ERROR] TCP Connection failed: {e}")
+                return "Failed-" + str(e)
+            except Exception as e:
+                if reused and attempt == 0:
+                    continue
+                print(f"[ERROR] TCP Connection failed: {e}")
+                return "Failed-" + str(e)
 
     def _use_udp(self, message: str) -> str:
         """
         Create a UDP connection to the NameServer, send the message, and retry on failure.
+        A truncated response (TC flag set) is retried over TCP, with the same NameServer.
         """
-        server_address = (
-            Configurator.OTHERS[self.this_ns_idx]["ip"],
-            Configurator.OTHERS[self.this_ns_idx]["udp"],
-        )
-        self.this_ns_idx = (self.this_ns_idx + 1) % len(Configurator.OTHERS)
+        name_server = self._next_name_server()
+        server_address = (name_server["ip"], name_server["udp"])
 
         udp_resolver_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         udp_resolver_socket.settimeout(2.0)  # Increased timeout to avoid premature failure
 
+        # The response is received into a pooled buffer and decrypted from a memoryview over it
+        buffer = self.receive_buffers.take()
+
         retries = 2  # Retry twice before failing
-        for attempt in range(retries):
-            try:
-                print(f"[DEBUG] Sending query to {server_address} via UDP (Attempt {attempt + 1})")
-                bytes_to_send = AESCipher().encrypt(message)
-                udp_resolver_socket.sendto(bytes_to_send, server_address)
+        try:
+            for attempt in range(retries):
+                try:
+                    print(f"[DEBUG] Sending query to {server_address} via UDP (Attempt {attempt + 1})")
+                    bytes_to_send = AESCipher().encrypt(message)
+                    udp_resolver_socket.sendto(bytes_to_send, server_address)
 
-                # Receive and decrypt response
-                response_bytes, _ = udp_resolver_socket.recvfrom(Configurator.BUFFER_SIZE)
-                print(f"[DEBUG] Raw response received (UDP): {response_bytes}")
+                    # Receive and decrypt response
+                    size, _ = udp_resolver_socket.recvfrom_into(buffer)
+                    print(f"[DEBUG] Raw response received (UDP): {size} bytes")
 
-                response = AESCipher().decrypt(response_bytes)
-                print(f"[DEBUG] Decrypted response (UDP): {response}")
+                    response = AESCipher().decrypt(memoryview(buffer)[:size])
+                    print(f"[DEBUG] Decrypted response (UDP): {response}")
 
-                # Validate the response format before proceeding
-                if not response or len(response.split("\n")) < 5:
-                    print(f"[ERROR] Invalid response format: {response}")
-                    continue  # Try again with the next retry
+                    # Validate the response format before proceeding
+                    if not response or response.count("\n") < 4:
+                        print(f"[ERROR] Invalid response format: {response}")
+                        continue  # Try again with the next retry
 
-                udp_resolver_socket.close()
-                return response  # Successful response, return immediately
+                    # A response cut to fit in UDP is asked for again, whole, over TCP
+                    if parse_string_flag(response.split("\n", 2)[1])["tc"]:
+                        print("[DEBUG] Truncated response (UDP), retrying over TCP")
+                        return self._use_tcp(message, name_server)
 
-            except Exception as e:
-                print(f"[ERROR] UDP Query failed (Attempt {attempt + 1}): {e}")
-                time.sleep(1)  # Wait before retrying
+                    return response  # Successful response, return immediately
+
+                except Exception as e:
+                    print(f"[ERROR] UDP Query failed (Attempt {attempt + 1}): {e}")
+                    time.sleep(1)  # Wait before retrying
+        finally:
+            self.receive_buffers.give(buffer)
+            udp_resolver_socket.close()
 
-        udp_resolver_socket.close()
         return "Failed-UDP Timeout"
 
     def query(self, request: Message, tcp: bool = False) -> str:
         """
         Resolve the request.
         Before asking the NameServer, check the cache system for cached records.
+        The answer is a complete response Message in string form.
         """
         print(f"[DEBUG] Searching cache for {request.question.qname}")
 
-        self.database.refresh()
-        cache_record = self.database.query_from_database(
+        key = (request.question.qname + ".", request.question.qtype, request.question.qclass)
+        cached_rrset, ttl = self.database.query_rrset_with_ttl(*key)
+
+        if cached_rrset and self.prefetcher is not None:
+            self.prefetcher.hit(key, cached_rrset[0].ttl, ttl)
+
+        if cached_rrset:
+            print(f"[DEBUG] Cache hit: Found {len(cached_rrset)} records for {request.question.qname}")
+            message_answer = Message(request=request)
+            for record in cached_rrset:
+                message_answer.add_a_new_record_to_answer_section(record)
+            return message_answer.to_string()
+
+        negative_answer = self.database.query_negative(
             request.question.qname + ".",
             request.question.qtype,
             request.question.qclass,
         )
 
-        if cache_record is not None:
-            print(f"[DEBUG] Cache hit: Found {request.question.qname} -> {cache_record.to_string()}")
-            return cache_record.to_string()
+        if negative_answer is not None:
+            print(f"[DEBUG] Negative cache hit for {request.question.qname}")
+            message_answer = Message(request=request)
+            message_answer.set_header_flags(rcode=negative_answer[0])
+            return message_answer.to_string()
 
         print(f"[DEBUG] Cache miss: Querying NameServer for {request.question.qname}")
 
+        # Advertise how large a UDP response can be, so that big answers are not truncated
+        request.payload_size = Configurator.UDP_PAYLOAD_SIZE
         response = self._use_tcp(request.to_string()) if tcp else self._use_udp(request.to_string())
 
         if response.startswith("Failed"):
@@ -128,22 +203,106 @@ class Resolver:
             return response.split("-")[1]
         else:
             message_answer = parse_string_msg(response)
+            # The payload size of the NameServer is not advertised to the client
+            message_answer.payload_size = None
             self.save_to_database(message_answer)
 
-        first_rr = message_answer.answers[0] if message_answer.answers else "[ERROR] No answer section found."
-        return first_rr.to_string()
+        if not message_answer.answers:
+            print("[ERROR] No answer section found.")
+            if message_answer.header.rcode in (0, 3):
+                self.save_negative_to_database(message_answer)
+        return message_answer.to_string()
+
+    def refresh_record(self, key: tuple):
+        """
+        Ask the NameServer again for the (name, type, class) key of a cached RRset and
+        replace it. Called by the prefetcher before hot RRsets expire.
+        Return the response Message, or None if the NameServer could not be reached.
+        """
+        name, rr_type, rr_class = key
+        request = Message(header=MessageHeader(), question=MessageQuestion(name.rstrip("."), rr_type, rr_class))
+        request.payload_size = Configurator.UDP_PAYLOAD_SIZE
+        response = self._use_udp(request.to_string())
+        if response.startswith("Failed"):
+            return None
+        message_answer = parse_string_msg(response)
+        self.save_to_database(message_answer)
+        return message_answer
+
+    def warm_start(self, snapshot_path: str):
+        """
+        Load the cache entries of the last snapshot that have not expired yet,
+        then keep saving snapshots every Configurator.SNAPSHOT_INTERVAL seconds.
+        """
+        if os.path.exists(snapshot_path):
+            try:
+                loaded = self.database.load_snapshot(snapshot_path)
+                print(f"[DEBUG] Loaded {loaded} cache entries from {snapshot_path}")
+            except Exception as e:
+                print(f"[ERROR] Failed to load snapshot {snapshot_path}: {e}")
+        if Configurator.SNAPSHOT_INTERVAL > 0:
+            self.database.start_snapshots(snapshot_path, Configurator.SNAPSHOT_INTERVAL)
 
     def save_to_database(self, message_response: Message):
-        """Save resolved records to the database."""
-        for answer in message_response.answers:
-            print(f"[DEBUG] Saving record: {answer}")
-            self.database.add_to_database(answer)
+        """Save resolved records to the database, one RRset per (name, type, class)."""
+        records = message_response.answers + message_response.authorities + message_response.additional
+        print(f"[DEBUG] Saving {len(records)} records")
+        self.database.add_many(records)
+
+    def save_negative_to_database(self, message_response: Message):
+        """Cache an NXDOMAIN or NODATA response, using the TTL of its SOA record if any."""
+        ttl = message_response.get_negative_ttl()
+        ttl = Configurator.NEGATIVE_TTL if ttl is None else min(ttl, Configurator.NEGATIVE_TTL_MAX)
+        self.database.add_negative(
+            message_response.question.qname + ".",
+            message_response.question.qtype,
+            message_response.question.qclass,
+            message_response.header.rcode,
+            ttl,
+        )
 
-        for authority in message_response.authorities:
-            self.database.add_to_database(authority)
+    def answer_client(self, byte_data, udp: bool = False) -> bytes:
+        """
+        Answer the request of a client such as UserScript: "encrypted" or "non-encrypted",
+        then "qname;qtype;qclass;protocol" on the next line, where protocol is the one used
+        to ask the NameServer, optionally followed by ";payload size", the largest UDP
+        response the client can receive. Over UDP, a longer response is cut at a record
+        boundary with the TC flag set, and the client asks again over TCP.
+        """
+        kind, _, body = str(byte_data, "utf-8").partition("\n")
 
-        for add in message_response.additional:
-            self.database.add_to_database(add)
+        encrypted = kind == "encrypted"
+        request = AESCipher().decrypt(body).split(";") if encrypted else body.split(";")
+        payload_size = int(request.pop()) if len(request) > 4 else None
+        protocol = request.pop()
+        request = ";".join(request)
+
+        print(f"[RESOLVER] Received request for {request} using {protocol.upper()}")
+
+        response = ""
+        try:
+            question = parse_string_question(request)
+        except Exception as e:
+            response = "[EXCEPTION] " + str(e)
+
+        if not response:
+            header = MessageHeader()
+            request_message = Message(header=header, question=question)
+            response = self.query(request=request_message, tcp=(protocol.lower() == "tcp"))
+
+        def encode(message) -> bytes:
+            text = message if isinstance(message, str) else message.to_string()
+            return AESCipher().encrypt(text) if encrypted else text.encode("utf-8")
+
+        bytes_to_send = encode(response)
+        if udp and len(bytes_to_send) > Configurator.udp_limit(payload_size):
+            try:
+                message = parse_string_msg(response)
+            except Exception:
+                return bytes_to_send  # Not a response Message: an error message is sent as it is
+            bytes_to_send, _ = message.fit(encode, Configurator.udp_limit(payload_size))
+            print(f"[RESOLVER] Truncated UDP response for {request} to {len(bytes_to_send)} bytes")
+        return bytes_to_send
 
     def start_listening_udp(self):
         """
@@ -153,31 +312,14 @@ class Resolver:
         listener_socket.bind((Configurator.IP, Configurator.UDP_PORT))
         print(f"[RESOLVER] Listening for client requests at {Configurator.IP}:{Configurator.UDP_PORT}...")
 
+        # Requests are received one at a time into the same buffer
+        buffer = bytearray(Configurator.BUFFER_SIZE)
         while True:
             try:
-                byte_data, client_address = listener_socket.recvfrom(Configurator.BUFFER_SIZE)
-                request = byte_data.decode("utf-8").split("\n")
-
-                encrypted = request[0] == "encrypted"
-                request = AESCipher().decrypt(request[1]).split(";") if encrypted else request[1].split(";")
-                protocol = request.pop()
-                request = ";".join(request)
-
-                print(f"[RESOLVER] Received request for {request} from {client_address} using {protocol.upper()}")
+                size, client_address = listener_socket.recvfrom_into(buffer)
+                bytes_to_send = self.answer_client(memoryview(buffer)[:size], udp=True)
 
-                response = ""
                 try:
-                    question = parse_string_question(request)
-                except Exception as e:
-                    response = "[EXCEPTION] " + str(e)
-
-                if not response:
-                    header = MessageHeader()
-                    request_message = Message(header=header, question=question)
-                    response = self.query(request=request_message, tcp=(protocol.lower() == "tcp"))
-
-                try:
-                    bytes_to_send = AESCipher().encrypt(response) if encrypted else response.encode("utf-8")
                     listener_socket.sendto(bytes_to_send, client_address)
                     print(f"[DEBUG] Response sent to {client_address}")
 
@@ -187,11 +329,53 @@ class Resolver:
             except Exception as e:
                 print(f"[ERROR] Exception while handling UDP connection: {e}")
 
+    def start_listening_tcp(self):
+        """
+        Listen for client requests over TCP, where clients retry the requests whose UDP
+        response was truncated. Every connection is served by its own thread.
+        """
+        listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener_socket.bind((Configurator.IP, Configurator.TCP_PORT))
+        listener_socket.listen(Configurator.TCP_BACKLOG)
+        print(f"[RESOLVER] Listening for client requests at {Configurator.IP}:{Configurator.TCP_PORT} (TCP)...")
+
+        while True:
+            try:
+                connection, client_address = listener_socket.accept()
+                threading.Thread(
+                    target=self.serve_client_connection, args=(connection, client_address), daemon=True
+                ).start()
+            except Exception as e:
+                print(f"[ERROR] Exception while accepting TCP connection: {e}")
+
+    def serve_client_connection(self, connection: socket.socket, client_address: tuple):
+        """
+        Answer the length-prefixed requests of one TCP connection in order, whatever their size,
+        until the client closes it or it stays idle for Configurator.TCP_IDLE_TIMEOUT seconds.
+        """
+        connection.settimeout(Configurator.TCP_IDLE_TIMEOUT)
+        try:
+            while True:
+                byte_data = recv_frame(connection)
+                if byte_data is None:
+                    break
+                send_frame(connection, self.answer_client(byte_data))
+                print(f"[DEBUG] Response sent to {client_address} (TCP)")
+        except socket.timeout:
+            print(f"[RESOLVER] Closing idle TCP connection from {client_address}")
+        except Exception as e:
+            print(f"[ERROR] Exception while handling TCP connection: {e}")
+        finally:
+            connection.close()
+
 
 if __name__ == "__main__":
     try:
         resolver = Resolver()
         udp_thread = threading.Thread(target=resolver.start_listening_udp)
+        tcp_thread = threading.Thread(target=resolver.start_listening_tcp)
         udp_thread.start()
+        tcp_thread.start()
     except KeyboardInterrupt:
         print("\n[INFO] Resolver shutting down.")
@@ -1,3 +1,6 @@
+from copy import copy
+
+
 class ResourceRecord:
     # Static variables
     TYPE = {"A": 1, "NS": 2, "CNAME": 5, "SOA": 6, "WKS": 11,
@@ -98,7 +101,8 @@ class ResourceRecord:
     def _check_data_type_(*args, dtype: str) -> bool:
         """Check if variables are of dtype."""
         for arg in args:
-            if str(type(arg)) != f"<class '{dtype}'>":
+            # Compared by name, so that a bool is not taken for an int, without formatting the type
+            if type(arg).__name__ != dtype:
                 return False
         return True
 
@@ -142,6 +146,12 @@ class ResourceRecord:
         """
         return self._name + ";" + str(self._type) + ";" + str(self._class) + ";" + str(self._ttl) + ";" + self._rdata
 
+    def with_ttl(self, ttl: int):
+        """Return a copy of this record with its TTL replaced."""
+        record = copy(self)
+        record._ttl = ttl
+        return record
+
     def get_name(self):
         """Return the name of the record."""
         return self._name
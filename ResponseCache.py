@@ -0,0 +1,183 @@
+import struct
+import threading
+from collections import OrderedDict
+from time import time
+from WireFormat import encode_message, echo_qname
+
+TTL = struct.Struct("!I")
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int):
+        """
+        Init a cache of serialized responses keyed by the query they answer, without its ID.
+
+        A response is kept as a template: the text after the ID line, with a hole for the TTL
+        of every record. Rendering fills in the ID of the query and the remaining TTLs, so a
+        hit costs a string join instead of building and serializing a Message. Responses in the
+        wire format are kept encoded, with the offsets of their TTL fields to patch. The TTLs
+        of authoritative answers (AA) are the ones of the zone and are kept without holes.
+        An entry expires when the first of its records does, and the least recently used
+        entry is evicted when the cache is full.
+
+        Parameters:
+        max_entries     -> Maximum number of cached responses
+        """
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, stored=0, expired=0, evictions=0)
+
+    @staticmethod
+    def split_query(query: str):
+        """Split the text of a query into its ID and the key of the responses to it."""
+        message_id, _, key = query.partition("\n")
+        return message_id, key
+
+    @staticmethod
+    def split_wire_query(query):
+        """
+        Split a query in the wire format, which may be a memoryview over a receive buffer,
+        into its ID and the key of the responses to it: its flags, counts and question,
+        with the name in lowercase. Records after the question, such as an EDNS OPT record,
+        are left out of the key.
+        """
+        offset = 12
+        while offset < len(query) and 0 < query[offset] < 64:
+            offset += query[offset] + 1
+        if offset >= len(query) or query[offset] != 0:
+            # Compressed or malformed name: the whole query is the key
+            return query[:2], bytes(query[2:])
+        # The label lengths are below 64, so only the letters of the name are lowered
+        return query[:2], bytes(query[2:12]) + bytes(query[12:offset]).lower() + bytes(query[offset:offset + 5])
+
+    def _lookup(self, key, generation: int, now: int):
+        """Return the entry of key, or None if there is none or it is no longer valid."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] <= now or entry[1] != generation:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        return entry
+
+    def _store(self, key, entry: tuple):
+        """Cache an entry, evicting the least recently used ones beyond max_entries."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._stats["stored"] += 1
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _cacheable_ttl(self, response):
+        """
+        Return the TTL a response may be cached for, or None if it is not cached.
+        It is the TTL of the first of its records to expire, or its cache_ttl if shorter.
+        """
+        if response.header.rcode != 0 or not response.answers or self._max_entries <= 0:
+            return None
+        ttl = min(record.ttl for record in response.answers + response.authorities + response.additional)
+        if response.cache_ttl is not None:
+            ttl = min(ttl, response.cache_ttl)
+        return ttl if ttl > 0 else None
+
+    def get(self, query: str, generation: int = 0):
+        """
+        Return the text of the cached response to query with the ID of the query and the
+        remaining TTLs, or None if there is none, it expired, or it was cached for
+        another generation of the data it was built from.
+        """
+        message_id, key = self.split_query(query)
+        now = int(time())
+        entry = self._lookup(key, generation, now)
+        if entry is None:
+            return None
+        _, _, prefix, records = entry
+        parts = [message_id, "\n", prefix]
+        for before, record_ttd, after in records:
+            parts += (before, str(record_ttd - now), after)
+        return "".join(parts)
+
+    def put(self, query: str, response, generation: int = 0) -> bool:
+        """
+        Cache a response Message to query. Only answers with records are cached,
+        until the TTL of the first of them ends. Return whether it was cached.
+        """
+        ttl = self._cacheable_ttl(response)
+        if ttl is None:
+            return False
+
+        now = int(time())
+        lines = response.to_string().split("\n")
+        _, key = self.split_query(query)
+        if response.header.aa:
+            self._store(key, (now + ttl, generation, "\n".join(lines[1:]), []))
+            return True
+
+        records = response.answers + response.authorities + response.additional
+        # Lines 2 to 7 are the flags, the counts and the question, then one line per record
+        prefix = "\n".join(lines[1:7]) + "\n"
+        templates = []
+        for record, line in zip(records, lines[7:]):
+            name, rr_type, rr_class, _, rdata = line.split(";", 4)
+            templates.append([f"{name};{rr_type};{rr_class};", now + record.ttl, f";{rdata}\n"])
+        # The lines after the records, such as the advertised payload size, follow the last one
+        templates[-1][2] += "\n".join(lines[7 + len(records):])
+        self._store(key, (now + ttl, generation, prefix, templates))
+        return True
+
+    def get_wire(self, query: bytes, generation: int = 0):
+        """
+        Return the cached response to a query in the wire format, like get(),
+        with the question name in the case of the query.
+        """
+        message_id, key = self.split_wire_query(query)
+        now = int(time())
+        entry = self._lookup(key, generation, now)
+        if entry is None:
+            return None
+        _, _, data, ttl_fields = entry
+        response = bytearray(data)
+        response[:2] = message_id
+        echo_qname(response, query)
+        for offset, record_ttd in ttl_fields:
+            TTL.pack_into(response, offset, record_ttd - now)
+        return bytes(response)
+
+    def put_wire(self, query: bytes, response, generation: int = 0) -> bool:
+        """Cache a response Message to a query in the wire format, like put()."""
+        ttl = self._cacheable_ttl(response)
+        if ttl is None:
+            return False
+
+        now = int(time())
+        offsets = []
+        data = encode_message(response, offsets)
+        records = response.answers + response.authorities + response.additional
+        ttl_fields = [] if response.header.aa else [
+            (offset, now + record.ttl) for offset, record in zip(offsets, records)]
+        _, key = self.split_wire_query(query)
+        self._store(key, (now + ttl, generation, data, ttl_fields))
+        return True
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Return a copy of the counters, with the number of cached responses."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+    stats = property(get_stats)
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+from configurator import Configurator
+
+
+class WorkerCounters:
+    # Counters kept by every worker process, in this order in the shared array
+    COUNTERS = ("queries", "answered", "failed", "shed", "truncated")
+
+    def __init__(self, array, index: int):
+        """
+        A view of the counters of one worker in an array shared with the supervisor.
+        Only the worker writes its own counters, so the array needs no cross-process lock.
+        """
+        self._array = array
+        self._base = index * len(self.COUNTERS)
+        self._lock = threading.Lock()
+
+    def increment(self, counter: str):
+        """Increment a counter of the worker."""
+        with self._lock:
+            self._array[self._base + self.COUNTERS.index(counter)] += 1
+
+    def get_values(self):
+        """Return the counters of the worker as a dictionary."""
+        return {name: self._array[self._base + i] for i, name in enumerate(self.COUNTERS)}
+
+    values = property(get_values)
+
+
+def _serve(index: int, array, server_class):
+    """Entry point of a worker process."""
+    server = server_class(worker_index=index, counters=WorkerCounters(array, index))
+    print(f"[SERVER] Worker {index} started")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    def __init__(self, workers: int, server_class=None):
+        """
+        Init a supervisor of worker processes that each run a NameServer.
+
+        Every worker binds the UDP and TCP ports of Configurator with SO_REUSEPORT, so the
+        kernel spreads the queries across processes and therefore across cores. Workers that
+        die are restarted, and their counters are kept in shared memory so that they can be
+        aggregated by the supervisor.
+
+        Parameters:
+        workers         -> Number of worker processes
+        server_class    -> Class run by the workers, NameServer by default
+        """
+        if server_class is None:
+            from NameServer import NameServer
+            server_class = NameServer
+        self._workers = workers
+        self._server_class = server_class
+        # Workers inherit the configuration of the supervisor when they are forked
+        self._context = multiprocessing.get_context("fork")
+        self._array = self._context.Array("q", workers * len(WorkerCounters.COUNTERS), lock=False)
+        self._processes = [None] * workers
+        self._restarts = 0
+        self._stop = threading.Event()
+
+    def _start_worker(self, index: int):
+        """Start the worker process of index."""
+        process = self._context.Process(target=_serve, args=(index, self._array, self._server_class),
+                                        daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        """Start every worker process."""
+        Configurator.REUSE_PORT = True
+        for index in range(self._workers):
+            self._start_worker(index)
+
+    def check(self) -> int:
+        """Restart the workers that died. Return how many were restarted."""
+        restarted = 0
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                print(f"[SERVER] Worker {index} exited with code {process.exitcode}, restarting it")
+                self._start_worker(index)
+                restarted += 1
+        self._restarts += restarted
+        return restarted
+
+    def run(self, interval: float = None):
+        """Start the workers and restart them when they die, until stop() is called or interrupted."""
+        interval = Configurator.SUPERVISOR_INTERVAL if interval is None else interval
+        self.start()
+        try:
+            while not self._stop.wait(interval):
+                self.check()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """Make run() return."""
+        self._stop.set()
+
+    def shutdown(self):
+        """Terminate every worker process."""
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+    def get_pids(self):
+        """Return the process id of every worker."""
+        return [process.pid if process is not None else None for process in self._processes]
+
+    def get_stats(self):
+        """
+        Return the counters summed over every worker, the counters of each worker,
+        and the number of restarts.
+        """
+        workers = [WorkerCounters(self._array, index).values for index in range(self._workers)]
+        total = {name: sum(worker[name] for worker in workers) for name in WorkerCounters.COUNTERS}
+        return dict(total=total, workers=workers, restarts=self._restarts)
+
+    pids = property(get_pids)
+    stats = property(get_stats)
@@ -0,0 +1,225 @@
+import asyncio
+import socket
+import threading
+from time import monotonic, perf_counter
+import dns.asyncbackend
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.query
+import dns.rcode
+
+
+class Upstream:
+    # Weight of the last round trip in the smoothed RTT, as in RFC 6298
+    ALPHA = 0.125
+    # Factor applied to the smoothed RTT of the upstreams not selected for a query, so that
+    # slower upstreams are measured again once in a while
+    DECAY = 0.98
+
+    def __init__(self, ip: str, port: int = 53):
+        """
+        An external DNS server of an UpstreamPool, with its health and latency.
+
+        Parameters:
+        ip      -> IP address of the server
+        port    -> UDP and TCP port of the server
+        """
+        self.ip = ip
+        self.port = port
+        self.family = dns.inet.af_for_address(ip)
+        # Unmeasured upstreams have a smoothed RTT of 0 so that each one is tried first
+        self.srtt = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.queries = 0
+        self.errors = 0
+        self.ejections = 0
+        # Idle sockets, so that a socket is reused by one query at a time
+        self._sockets = []
+        self._async_sockets = []
+
+    def is_ejected(self, now: float) -> bool:
+        """Whether the upstream is out of the pool at now."""
+        return now < self.ejected_until
+
+    def get_stats(self):
+        """Return the health and latency of the upstream."""
+        return dict(ip=self.ip, port=self.port, srtt=self.srtt, failures=self.failures,
+                    ejected=self.is_ejected(monotonic()), queries=self.queries,
+                    errors=self.errors, ejections=self.ejections)
+
+    stats = property(get_stats)
+
+
+class UpstreamPool:
+    # Response codes after which the next upstream is tried
+    RETRY_RCODES = (dns.rcode.SERVFAIL, dns.rcode.REFUSED, dns.rcode.NOTIMP)
+
+    def __init__(self, upstreams: list, timeout: float = 2.0, max_failures: int = 3, eject_seconds: float = 30.0):
+        """
+        Init a pool of external DNS servers, created once and shared by every query.
+
+        Each query goes to the healthy upstream with the lowest smoothed RTT, and to the next
+        one if it times out or fails. An upstream failing max_failures times in a row is
+        ejected for eject_seconds, after which one query probes it again. Sockets are kept
+        open and reused across queries.
+
+        Parameters:
+        upstreams       -> List of dict(ip=..., port=...) of the external DNS servers
+        timeout         -> Seconds to wait for one upstream
+        max_failures    -> Failures in a row after which an upstream is ejected
+        eject_seconds   -> Seconds an ejected upstream is left out
+        """
+        if not upstreams:
+            raise Exception("An upstream pool needs at least one upstream.")
+        self._upstreams = [Upstream(upstream["ip"], upstream.get("port", 53)) for upstream in upstreams]
+        self._timeout = timeout
+        self._max_failures = max_failures
+        self._eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def select(self) -> list:
+        """
+        Return the upstreams in the order they should be tried: an upstream whose ejection
+        ended, to probe it, then the healthy ones by smoothed RTT, then the ejected ones by
+        end of ejection, to be used only if every other failed.
+        """
+        now = monotonic()
+        with self._lock:
+            healthy = sorted((upstream for upstream in self._upstreams if not upstream.is_ejected(now)),
+                             key=lambda upstream: upstream.srtt)
+            ejected = sorted((upstream for upstream in self._upstreams if upstream.is_ejected(now)),
+                             key=lambda upstream: upstream.ejected_until)
+            probes = [upstream for upstream in healthy if upstream.ejected_until][:1]
+            for upstream in probes:
+                # Only this query probes it: it stays ejected until it answers
+                upstream.ejected_until = now + self._eject_seconds
+                healthy.remove(upstream)
+            for upstream in healthy[1:]:
+                upstream.srtt *= Upstream.DECAY
+        return probes + healthy + ejected
+
+    def _succeeded(self, upstream: Upstream, rtt: float):
+        """Record a response of upstream received after rtt seconds."""
+        with self._lock:
+            upstream.queries += 1
+            upstream.srtt = rtt if upstream.srtt == 0.0 else upstream.srtt + Upstream.ALPHA * (rtt - upstream.srtt)
+            upstream.failures = 0
+            upstream.ejected_until = 0.0
+
+    def _failed(self, upstream: Upstream, error):
+        """Record a failure of upstream, and eject it after too many in a row."""
+        with self._lock:
+            upstream.queries += 1
+            upstream.errors += 1
+            upstream.failures += 1
+            # A failure counts as a round trip of the whole timeout
+            upstream.srtt = max(upstream.srtt, self._timeout)
+            if upstream.failures >= self._max_failures:
+                upstream.ejected_until = monotonic() + self._eject_seconds
+                upstream.ejections += 1
+                print(f"[WARNING] Upstream {upstream.ip} ejected for {self._eject_seconds} seconds: {error}")
+
+    def _take_socket(self, upstream: Upstream) -> socket.socket:
+        """Return an idle socket to upstream, or a new one."""
+        with self._lock:
+            if upstream._sockets:
+                return upstream._sockets.pop()
+        sock = socket.socket(upstream.family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        return sock
+
+    def _release_socket(self, upstream: Upstream, sock: socket.socket):
+        """Keep a socket for the next query to upstream."""
+        with self._lock:
+            upstream._sockets.append(sock)
+
+    def _take_async_socket(self, upstream: Upstream, loop):
+        """
+        Return an idle asynchronous socket to upstream opened on loop, or None if there is none.
+        Sockets belong to the event loop they were opened on, the ones of other loops are dropped.
+        """
+        with self._lock:
+            while upstream._async_sockets:
+                sock_loop, sock = upstream._async_sockets.pop()
+                if sock_loop is loop:
+                    return sock
+        return None
+
+    def query(self, request: dns.message.Message) -> dns.message.Message:
+        """
+        Send a query to the upstreams until one answers.
+        Raise the last error if none does.
+        """
+        error = None
+        for upstream in self.select():
+            sock = self._take_socket(upstream)
+            start = perf_counter()
+            try:
+                response = dns.query.udp(request, upstream.ip, timeout=self._timeout, port=upstream.port,
+                                         ignore_unexpected=True, sock=sock)
+                if response.flags & dns.flags.TC:
+                    response = dns.query.tcp(request, upstream.ip, timeout=self._timeout, port=upstream.port)
+            except (dns.exception.DNSException, OSError) as e:
+                # A late answer could still arrive on this socket
+                sock.close()
+                self._failed(upstream, e)
+                error = e
+                continue
+            self._release_socket(upstream, sock)
+            if response.rcode() in self.RETRY_RCODES:
+                self._failed(upstream, dns.rcode.to_text(response.rcode()))
+                error = dns.exception.DNSException(f"{upstream.ip} answered {dns.rcode.to_text(response.rcode())}")
+                continue
+            self._succeeded(upstream, perf_counter() - start)
+            return response
+        raise error
+
+    async def query_async(self, request: dns.message.Message) -> dns.message.Message:
+        """
+        Send a query to the upstreams until one answers, without blocking the event loop.
+        Raise the last error if none does.
+        """
+        error = None
+        loop = asyncio.get_running_loop()
+        backend = dns.asyncbackend.get_backend("asyncio")
+        for upstream in self.select():
+            sock = self._take_async_socket(upstream, loop)
+            if sock is None:
+                sock = await backend.make_socket(upstream.family, socket.SOCK_DGRAM)
+            start = perf_counter()
+            try:
+                response = await dns.asyncquery.udp(request, upstream.ip, timeout=self._timeout, port=upstream.port,
+                                                    ignore_unexpected=True, sock=sock, backend=backend)
+                if response.flags & dns.flags.TC:
+                    response = await dns.asyncquery.tcp(request, upstream.ip, timeout=self._timeout,
+                                                        port=upstream.port, backend=backend)
+            except (dns.exception.DNSException, OSError) as e:
+                await sock.close()
+                self._failed(upstream, e)
+                error = e
+                continue
+            with self._lock:
+                upstream._async_sockets.append((loop, sock))
+            if response.rcode() in self.RETRY_RCODES:
+                self._failed(upstream, dns.rcode.to_text(response.rcode()))
+                error = dns.exception.DNSException(f"{upstream.ip} answered {dns.rcode.to_text(response.rcode())}")
+                continue
+            self._succeeded(upstream, perf_counter() - start)
+            return response
+        raise error
+
+    def get_upstreams(self):
+        """Return the upstreams of the pool."""
+        return list(self._upstreams)
+
+    def get_stats(self):
+        """Return the health and latency of every upstream."""
+        with self._lock:
+            return [upstream.stats for upstream in self._upstreams]
+
+    upstreams = property(get_upstreams)
+    stats = property(get_stats)
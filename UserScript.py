@@ -7,6 +7,10 @@ domain name will be printed; otherwise, it prints "Timeout".
 import argparse
 import socket
 from AES import AESCipher
+from Framing import send_frame, recv_frame
+
+# Largest UDP response the script can receive, advertised to the resolver
+PAYLOAD_SIZE = 1232
 
 
 def parse_args():
@@ -17,6 +21,8 @@ def parse_args():
     -d, --domain    : the domain name to be queried [required]
     -t, --type      : the type of the query         ["A" by default]
     -c, --class     : the class of the query        ["IN" by default]
+    --payload-size  : the largest UDP response      [PAYLOAD_SIZE by default]
+    --tcp-port      : the TCP port of the resolver, to retry truncated responses [9393 by default]
     """
     parser = argparse.ArgumentParser(description="Parse DNS arguments from CLI")
 
@@ -77,9 +83,44 @@ def parse_args():
         type=int,
     )
 
+    parser.add_argument(
+        "--payload-size",
+        default=PAYLOAD_SIZE,
+        help=f"Largest UDP response accepted, longer ones are retried over TCP (default is {PAYLOAD_SIZE})",
+        dest="payload_size",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--tcp-port",
+        default=9393,
+        help="TCP port number of the resolver, to retry truncated responses (default is 9393)",
+        dest="resolver_tcp_port",
+        type=int,
+    )
+
     return parser.parse_args()
 
 
+def is_truncated(response: str) -> bool:
+    """Return True if response is a response message with the TC flag set."""
+    lines = response.split("\n", 2)
+    try:
+        return len(lines) > 2 and bool(int(lines[1], 16) & 0x200)
+    except ValueError:
+        return False
+
+
+def query_tcp(msg: bytes, resolver_address: tuple) -> bytes:
+    """Send the query to the resolver over TCP and return the whole response."""
+    with socket.create_connection(resolver_address, timeout=2.5) as connection:
+        send_frame(connection, msg)
+        response_bytes = recv_frame(connection)
+    if response_bytes is None:
+        raise ConnectionError("connection closed by the resolver")
+    return response_bytes
+
+
 def make_query(args_obj) -> str:
     """
     Create a socket and send a query to resolver.
@@ -89,7 +130,8 @@ def make_query(args_obj) -> str:
     client_socket.settimeout(2.5)  # Ensure timeout is not too short
 
     # Prepare a message for transmission
-    msg = f"{args_obj.qname};{args_obj.qtype};{args_obj.qclass};{args_obj.protocol}"
+    payload_size = getattr(args_obj, "payload_size", PAYLOAD_SIZE)
+    msg = f"{args_obj.qname};{args_obj.qtype};{args_obj.qclass};{args_obj.protocol};{payload_size}"
     resolver_address = (args_obj.resolver_ip, args_obj.resolver_port)
 
     # Send the message to the resolver
@@ -105,13 +147,21 @@ def make_query(args_obj) -> str:
         print(f"[DEBUG] Query sent to resolver at {resolver_address}")
 
         # Receive the response
-        response_bytes, _ = client_socket.recvfrom(1024)
+        response_bytes, _ = client_socket.recvfrom(payload_size)
         print(f"[DEBUG] Raw response received: {response_bytes}")
 
         # Decrypt response
         response = AESCipher().decrypt(response_bytes) if args_obj.secure != 0 else response_bytes.decode("utf-8")
         print(f"[DEBUG] Decrypted response: {response}")
 
+        # The response did not fit in UDP: ask again over TCP for the whole of it
+        if is_truncated(response):
+            tcp_address = (args_obj.resolver_ip, getattr(args_obj, "resolver_tcp_port", 9393))
+            print(f"[DEBUG] Truncated response, retrying over TCP at {tcp_address}")
+            response_bytes = query_tcp(msg, tcp_address)
+            response = AESCipher().decrypt(response_bytes) if args_obj.secure != 0 else response_bytes.decode("utf-8")
+            print(f"[DEBUG] Decrypted response (TCP): {response}")
+
         # Check if response is valid
         if not response.strip():
             print("[ERROR] Empty response received")
@@ -0,0 +1,307 @@
+"""
+Encoder and decoder of the DNS wire format (RFC 1035 4.1) for Message objects.
+
+Messages are encoded with name compression (RFC 1035 4.1.4), so that the standard DNS tools
+and servers can talk to the NameServer. The RDATA of the common types is converted from and to
+the text form kept by ResourceRecord, that of the other types with dnspython.
+"""
+
+import re
+import socket
+import struct
+import dns.rdata
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+
+HEADER = struct.Struct("!HHHHHH")
+QUESTION_TAIL = struct.Struct("!HH")
+RECORD_TAIL = struct.Struct("!HHIH")
+UINT16 = struct.Struct("!H")
+SOA_TAIL = struct.Struct("!IIIII")
+
+# The two high bits of a compression pointer, and the largest offset a pointer can reach
+POINTER = 0xC000
+MAX_POINTER = 0x3FFF
+# Pointers followed while reading one name, to stop on loops
+MAX_POINTERS = 64
+
+TYPE_A, TYPE_NS, TYPE_CNAME, TYPE_SOA, TYPE_PTR, TYPE_HINFO, TYPE_MX, TYPE_TXT, TYPE_AAAA, TYPE_OPT = \
+    1, 2, 5, 6, 12, 13, 15, 16, 28, 41
+# Types whose RDATA is a single domain name, which may be compressed
+NAME_TYPES = (TYPE_NS, TYPE_CNAME, TYPE_PTR)
+
+CHARACTER_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+ESCAPE = re.compile(r"\\(\d{3}|.)")
+
+
+class WireFormatError(Exception):
+    """Raised when a message cannot be decoded."""
+
+
+def encode_flags(header: MessageHeader) -> int:
+    """Return the 16-bit flags field of a header."""
+    return (int(header.qr) << 15 | header.opcode << 11 | int(header.aa) << 10 | int(header.tc) << 9 |
+            int(header.rd) << 8 | int(header.ra) << 7 | header.rcode)
+
+
+def encode_name(buffer: bytearray, name: str, compression: dict):
+    """
+    Append a domain name to buffer, pointing to the longest suffix already written.
+    compression maps the names written so far, in lowercase since names are compared
+    without case (RFC 4343), to their offset in the message. The name keeps its case.
+    """
+    name = name.rstrip(".")
+    labels = name.split(".") if name else []
+    for i in range(len(labels)):
+        suffix = ".".join(labels[i:]).lower()
+        offset = compression.get(suffix)
+        if offset is not None:
+            buffer += UINT16.pack(POINTER | offset)
+            return
+        if len(buffer) <= MAX_POINTER:
+            compression[suffix] = len(buffer)
+        label = labels[i].encode()
+        if not 0 < len(label) < 64:
+            raise WireFormatError(f"Invalid label in {name}")
+        buffer.append(len(label))
+        buffer += label
+    buffer.append(0)
+
+
+def _character_strings(text: str) -> list:
+    """Split the text of TXT or HINFO RDATA into its character-strings."""
+    strings = []
+    for quoted, bare in CHARACTER_STRING.findall(text):
+        value = ESCAPE.sub(lambda m: chr(int(m.group(1))) if m.group(1).isdigit() else m.group(1), bare or quoted)
+        strings.append(value.encode("latin-1"))
+    return strings
+
+
+def encode_rdata(buffer: bytearray, record: ResourceRecord, compression: dict):
+    """Append the RDATA of a record to buffer."""
+    rr_type, rdata = record.rr_type, record.rdata
+    if rr_type == TYPE_A:
+        buffer += socket.inet_aton(rdata)
+    elif rr_type in NAME_TYPES:
+        encode_name(buffer, rdata, compression)
+    elif rr_type == TYPE_MX:
+        preference, exchange = rdata.split()
+        buffer += UINT16.pack(int(preference))
+        encode_name(buffer, exchange, compression)
+    elif rr_type == TYPE_SOA:
+        fields = rdata.split()
+        encode_name(buffer, fields[0], compression)
+        encode_name(buffer, fields[1], compression)
+        buffer += SOA_TAIL.pack(*(int(field) for field in fields[2:7]))
+    elif rr_type in (TYPE_TXT, TYPE_HINFO):
+        for string in _character_strings(rdata):
+            buffer.append(len(string))
+            buffer += string
+    elif rr_type == TYPE_AAAA:
+        buffer += socket.inet_pton(socket.AF_INET6, rdata)
+    else:
+        buffer += dns.rdata.from_text(record.rr_class, rr_type, rdata).to_wire()
+
+
+def encode_record(buffer: bytearray, record: ResourceRecord, compression: dict, ttl_offsets: list = None):
+    """
+    Append a resource record to buffer. If ttl_offsets is given, the offset
+    of the TTL field of the record is appended to it.
+    """
+    encode_name(buffer, record.name, compression)
+    start = len(buffer)
+    buffer += RECORD_TAIL.pack(record.rr_type, record.rr_class, record.ttl, 0)
+    if ttl_offsets is not None:
+        ttl_offsets.append(start + 4)
+    encode_rdata(buffer, record, compression)
+    UINT16.pack_into(buffer, start + 8, len(buffer) - start - RECORD_TAIL.size)
+
+
+def encode_message(message: Message, ttl_offsets: list = None) -> bytes:
+    """
+    Encode a Message in the wire format. The counts of the header are those of the sections,
+    and an EDNS OPT record is added if the message has a payload_size to advertise.
+    If ttl_offsets is given, the offset of the TTL field of every record is appended to it.
+    """
+    header, question = message.header, message.question
+    answers, authorities, additional = message.answers, message.authorities, message.additional
+    opt = 1 if message.payload_size else 0
+    buffer = bytearray(HEADER.pack(header.id, encode_flags(header), 1, len(answers), len(authorities),
+                                   len(additional) + opt))
+    compression = {}
+    encode_name(buffer, question.qname, compression)
+    buffer += QUESTION_TAIL.pack(question.qtype, question.qclass)
+    for record in answers + authorities + additional:
+        encode_record(buffer, record, compression, ttl_offsets)
+    if opt:
+        # EDNS OPT pseudo-record advertising the payload size in its CLASS field (RFC 6891 6.1.2)
+        buffer.append(0)
+        buffer += RECORD_TAIL.pack(TYPE_OPT, message.payload_size, 0, 0)
+    return bytes(buffer)
+
+
+def encode_error(data, rcode: int, ra: bool = False):
+    """
+    Encode a response with rcode to the query in data from its header and the bytes of its
+    question, without decoding them, so that queries decode_message rejects are answered too.
+    The question is left out if it cannot be read back. Return None if data is shorter than a header.
+    """
+    if len(data) < HEADER.size:
+        return None
+    message_id, flags, qdcount = HEADER.unpack_from(data)[:3]
+    # QR, then the opcode and RD of the query
+    flags = 0x8000 | flags & 0x7900 | int(ra) << 7 | rcode
+    if qdcount == 1:
+        try:
+            end = skip_name(data, HEADER.size) + QUESTION_TAIL.size
+            response = HEADER.pack(message_id, flags, 1, 0, 0, 0) + bytes(data[HEADER.size:end])
+            # A compression pointer of the question may point past it
+            decode_name(response, HEADER.size)
+            if end <= len(data):
+                return response
+        except WireFormatError:
+            pass
+    return HEADER.pack(message_id, flags, 0, 0, 0, 0)
+
+
+def echo_qname(response: bytearray, query):
+    """
+    Overwrite the question name of an encoded response with the one of the query, which
+    is the same apart from case, so that the response echoes the case the client sent.
+    Resolvers randomizing the case of their queries (DNS 0x20) check it.
+    """
+    end = skip_name(query, HEADER.size)
+    if bytes(response[HEADER.size:end]).lower() == bytes(query[HEADER.size:end]).lower():
+        response[HEADER.size:end] = query[HEADER.size:end]
+
+
+def skip_name(data, offset: int) -> int:
+    """Return the offset after the domain name at offset, without reading its labels."""
+    while True:
+        if offset >= len(data):
+            raise WireFormatError("Name runs past the end of the message")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length & 0xC0:
+            raise WireFormatError("Unknown label type")
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def decode_name(data, offset: int) -> tuple:
+    """
+    Read the domain name at offset, following compression pointers, in the case it was sent in.
+    Return a tuple of (name without the trailing dot, offset after the name).
+    data may be any bytes-like object, such as a memoryview. Every label is sliced
+    from it as it is read, then the labels are joined and decoded into the name.
+    """
+    labels = []
+    end = None
+    pointers = 0
+    while True:
+        if offset >= len(data):
+            raise WireFormatError("Name runs past the end of the message")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise WireFormatError("Truncated compression pointer")
+            if end is None:
+                end = offset + 2
+            pointers += 1
+            if pointers > MAX_POINTERS:
+                raise WireFormatError("Compression pointer loop")
+            offset = UINT16.unpack_from(data, offset)[0] & MAX_POINTER
+        elif length & 0xC0:
+            raise WireFormatError("Unknown label type")
+        elif length == 0:
+            name = str(b".".join(labels), "latin-1")
+            return name, offset + 1 if end is None else end
+        else:
+            labels.append(data[offset + 1:offset + 1 + length])
+            offset += 1 + length
+
+
+def _quote(string: bytes) -> str:
+    """Return a character-string in the quoted text form of dnspython."""
+    text = ""
+    for byte in string:
+        if byte in (0x22, 0x5C):
+            text += "\\" + chr(byte)
+        elif 0x20 <= byte < 0x7F:
+            text += chr(byte)
+        else:
+            text += f"\\{byte:03d}"
+    return f'"{text}"'
+
+
+def decode_rdata(data: bytes, offset: int, length: int, rr_type: int, rr_class: int) -> str:
+    """Return the text form of the RDATA of length bytes at offset."""
+    end = offset + length
+    if rr_type == TYPE_A and length == 4:
+        return socket.inet_ntoa(data[offset:end])
+    if rr_type in NAME_TYPES:
+        return decode_name(data, offset)[0] + "."
+    if rr_type == TYPE_MX:
+        preference = UINT16.unpack_from(data, offset)[0]
+        return f"{preference} {decode_name(data, offset + 2)[0]}."
+    if rr_type == TYPE_SOA:
+        mname, offset = decode_name(data, offset)
+        rname, offset = decode_name(data, offset)
+        return f"{mname}. {rname}. " + " ".join(str(field) for field in SOA_TAIL.unpack_from(data, offset))
+    if rr_type in (TYPE_TXT, TYPE_HINFO):
+        strings = []
+        while offset < end:
+            size = data[offset]
+            strings.append(_quote(data[offset + 1:offset + 1 + size]))
+            offset += 1 + size
+        return " ".join(strings)
+    if rr_type == TYPE_AAAA and length == 16:
+        return socket.inet_ntop(socket.AF_INET6, data[offset:end])
+    return dns.rdata.from_wire(rr_class, rr_type, bytes(data), offset, length).to_text()
+
+
+def decode_message(data) -> Message:
+    """
+    Decode a message in the wire format from a bytes-like object, such as a memoryview
+    over a receive buffer. The fields are unpacked at their offsets without copying the
+    message, and the owner name of a record is only read once it is known to be kept:
+    EDNS OPT pseudo-records are not records of the message and are left out of the
+    Additional section: the payload size they advertise is set on the message.
+    """
+    if len(data) < HEADER.size:
+        raise WireFormatError("Message shorter than its header")
+    message_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(data)
+    if qdcount != 1:
+        raise WireFormatError(f"Messages must have one question, not {qdcount}")
+    header = MessageHeader(id=message_id, qr=flags >> 15 & 1, opcode=flags >> 11 & 0xF, aa=bool(flags & 0x400),
+                           tc=bool(flags & 0x200), rd=bool(flags & 0x100), ra=bool(flags & 0x80),
+                           rcode=flags & 0xF)
+    qname, offset = decode_name(data, HEADER.size)
+    qtype, qclass = QUESTION_TAIL.unpack_from(data, offset)
+    offset += QUESTION_TAIL.size
+    message = Message(header=header, question=MessageQuestion(qname, qtype, qclass))
+
+    sections = (message.add_a_new_record_to_answer_section, message.add_a_new_record_to_authority_section,
+                message.add_a_new_record_to_additional_section)
+    for add, count in zip(sections, (ancount, nscount, arcount)):
+        for _ in range(count):
+            start = offset
+            offset = skip_name(data, offset)
+            if offset + RECORD_TAIL.size > len(data):
+                raise WireFormatError("Truncated resource record")
+            rr_type, rr_class, ttl, length = RECORD_TAIL.unpack_from(data, offset)
+            offset += RECORD_TAIL.size
+            if offset + length > len(data):
+                raise WireFormatError("RDATA runs past the end of the message")
+            if rr_type == TYPE_OPT:
+                # Sizes below 512 bytes are read as 512 (RFC 6891 6.2.5)
+                message.payload_size = max(512, rr_class)
+            else:
+                add(ResourceRecord(decode_name(data, start)[0] + ".", rr_type, rr_class, ttl,
+                                   decode_rdata(data, offset, length, rr_type, rr_class)))
+            offset += length
+    return message
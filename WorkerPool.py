@@ -0,0 +1,112 @@
+import threading
+from collections import deque
+from time import perf_counter
+
+
+class WorkerPool:
+    def __init__(self, workers: int, max_queue: int, handler, drop_oldest: bool = False, on_shed=None):
+        """
+        Init a fixed number of worker threads that call handler on the items of a bounded queue.
+
+        submit() never blocks. When the queue is full, an item is shed: the oldest queued item
+        if drop_oldest is set, otherwise the submitted one. on_shed, if given, is called with
+        the shed item on the submitting thread, so it must be cheap.
+
+        Parameters:
+        workers         -> Number of worker threads
+        max_queue       -> Maximum number of items waiting for a worker
+        handler         -> Function called with each item by a worker thread
+        drop_oldest     -> Shed the oldest queued item instead of the submitted one
+        on_shed         -> Function called with each shed item
+        """
+        self._max_queue = max_queue
+        self._handler = handler
+        self._drop_oldest = drop_oldest
+        self._on_shed = on_shed
+
+        # Items are queued with the time they were submitted, to measure how long they wait
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._stats = dict(submitted=0, started=0, completed=0, shed=0, errors=0, max_depth=0,
+                           total_wait=0.0, max_wait=0.0)
+
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item) -> bool:
+        """Queue an item for the workers. Return False if the submitted item was shed."""
+        shed = None
+        accepted = True
+        with self._condition:
+            self._stats["submitted"] += 1
+            if len(self._queue) >= self._max_queue:
+                self._stats["shed"] += 1
+                if self._drop_oldest:
+                    shed = self._queue.popleft()[1]
+                else:
+                    shed = item
+                    accepted = False
+            if accepted:
+                self._queue.append((perf_counter(), item))
+                self._stats["max_depth"] = max(self._stats["max_depth"], len(self._queue))
+                self._condition.notify()
+
+        if shed is not None and self._on_shed is not None:
+            try:
+                self._on_shed(shed)
+            except Exception as e:
+                print(f"[ERROR] Exception while shedding a request: {e}")
+        return accepted
+
+    def _work(self):
+        """Run the handler on queued items until the pool is shut down."""
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                submitted_at, item = self._queue.popleft()
+                wait = perf_counter() - submitted_at
+                self._stats["started"] += 1
+                self._stats["total_wait"] += wait
+                self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+
+            try:
+                self._handler(item)
+            except Exception as e:
+                print(f"[ERROR] Exception while handling a request: {e}")
+                with self._condition:
+                    self._stats["errors"] += 1
+            with self._condition:
+                self._stats["completed"] += 1
+
+    def shutdown(self):
+        """Stop the workers once they finish their current item. Queued items are dropped."""
+        with self._condition:
+            self._running = False
+            self._queue.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def get_depth(self):
+        """Return the number of items waiting for a worker."""
+        with self._condition:
+            return len(self._queue)
+
+    def get_stats(self):
+        """
+        Return a copy of the counters, with the current queue depth
+        and the average time in seconds items waited for a worker.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats["depth"] = len(self._queue)
+        stats["average_wait"] = stats["total_wait"] / stats["started"] if stats["started"] else 0.0
+        return stats
+
+    depth = property(get_depth)
+    stats = property(get_stats)
@@ -0,0 +1,259 @@
+import os
+import threading
+import dns.rdataclass
+import dns.zone
+from ResourceRecord import ResourceRecord
+
+TYPE_NS = ResourceRecord.TYPE["NS"]
+TYPE_CNAME = ResourceRecord.TYPE["CNAME"]
+TYPE_SOA = ResourceRecord.TYPE["SOA"]
+TYPE_ANY = 255
+# Types of the glue records added to referrals
+GLUE_TYPES = (ResourceRecord.TYPE["A"], 28)
+# CNAMEs followed inside the zones for one answer
+MAX_CNAME_CHAIN = 8
+
+
+class _Node:
+    __slots__ = ("children", "rrsets", "origin")
+
+    def __init__(self):
+        """A label of the trie, with the records of the name it ends."""
+        self.children = {}
+        self.rrsets = {}
+        # Name of the zone if this node is the apex of a loaded zone
+        self.origin = None
+
+
+def _labels(name: str) -> list:
+    """Return the labels of a name from the root down, lowercased."""
+    name = name.lower().rstrip(".")
+    return name.split(".")[::-1] if name else []
+
+
+class ZoneStore:
+    def __init__(self, zones: list):
+        """
+        Init an in-memory index of zone files, to answer for them authoritatively.
+
+        Records are kept in a trie of labels from the root down, so a lookup walks the labels
+        of the name once and finds the exact name, the closest enclosing zone, the zone cuts
+        (delegations) on the way, and the wildcard to use if the name does not exist.
+        A reload builds a new trie and swaps it in, so lookups never wait for it.
+
+        Parameters:
+        zones   -> List of dict(origin=..., path=...) of the zone files
+        """
+        self._zones = zones
+        self._root = _Node()
+        self._mtimes = {}
+        # Incremented by every load that swaps in new zones, so that answers built from the
+        # previous ones can be told apart
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self.load()
+
+    def _build(self, mtimes: dict) -> _Node:
+        """
+        Parse every zone file into a new trie. Keep the last good version of a file that fails
+        to parse, and record the mtime of the failed attempt so that it is not parsed again
+        until the file changes.
+        """
+        root = _Node()
+        for zone_config in self._zones:
+            path = zone_config["path"]
+            try:
+                mtimes[path] = None
+                mtimes[path] = os.stat(path).st_mtime_ns
+                zone = dns.zone.from_file(path, origin=zone_config["origin"], relativize=False)
+            except Exception as e:
+                print(f"[ERROR] Failed to load zone {zone_config['origin']} from {path}: {e}")
+                self._copy_zone(self._root, root, zone_config["origin"])
+                continue
+            self._add_zone(root, zone)
+        return root
+
+    @staticmethod
+    def _add_zone(root: _Node, zone: dns.zone.Zone):
+        """Add every record of a zone to a trie."""
+        origin = zone.origin.to_text().lower()
+        apex = ZoneStore._node(root, origin)
+        apex.origin = origin
+        for name, ttl, rdata in zone.iterate_rdatas():
+            if rdata.rdclass != dns.rdataclass.IN:
+                continue
+            owner = name.to_text().lower()
+            record = ResourceRecord(owner, int(rdata.rdtype), int(rdata.rdclass), ttl, rdata.to_text())
+            ZoneStore._node(root, owner).rrsets.setdefault(int(rdata.rdtype), []).append(record)
+
+    @staticmethod
+    def _copy_zone(source: _Node, target: _Node, origin: str):
+        """Graft the subtree of a zone in source onto target."""
+        labels = _labels(origin)
+        node = source
+        for label in labels:
+            node = node.children.get(label)
+            if node is None:
+                return
+        parent = target
+        for label in labels[:-1]:
+            parent = parent.children.setdefault(label, _Node())
+        parent.children[labels[-1]] = node
+
+    @staticmethod
+    def _node(root: _Node, name: str) -> _Node:
+        """Return the node of name in a trie, creating it and its parents if needed."""
+        node = root
+        for label in _labels(name):
+            node = node.children.setdefault(label, _Node())
+        return node
+
+    def load(self) -> bool:
+        """Load the zone files and swap them in. Return False if none changed since the last load."""
+        with self._lock:
+            mtimes = {}
+            for zone_config in self._zones:
+                try:
+                    mtimes[zone_config["path"]] = os.stat(zone_config["path"]).st_mtime_ns
+                except OSError:
+                    mtimes[zone_config["path"]] = None
+            if self._mtimes and mtimes == self._mtimes:
+                return False
+            mtimes = {}
+            self._root = self._build(mtimes)
+            self._mtimes = mtimes
+            self._generation += 1
+            print(f"[DEBUG] Loaded {len(self._zones)} zones")
+            return True
+
+    def start_watching(self, interval: float):
+        """Start a background thread that reloads the zone files every interval seconds if they changed."""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"[ERROR] Exception while reloading zones: {e}")
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """Stop the background reload thread."""
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+            self._stop.clear()
+
+    def lookup(self, qname: str, qtype: int) -> dict:
+        """
+        Answer a question from the zones.
+
+        Return None if qname is in none of the zones. Otherwise return a dict with the rcode,
+        the answers, authorities and additional records, and whether the answer is
+        authoritative. It is not for a referral to a delegated zone, which has the NS
+        records of the zone cut in the authorities and their glue in the additional records.
+        """
+        root = self._root
+        result = self._lookup(root, qname, qtype)
+        if result is None:
+            return None
+        for _ in range(MAX_CNAME_CHAIN):
+            if result["cname"] is None:
+                break
+            target = self._lookup(root, result["cname"], qtype)
+            if target is None or not target["authoritative"]:
+                break
+            target["answers"] = result["answers"] + target["answers"]
+            result = target
+        del result["cname"]
+        return result
+
+    def _lookup(self, root: _Node, qname: str, qtype: int):
+        """Answer a question from one trie, without following CNAMEs."""
+        labels = _labels(qname)
+        node = root
+        apex = root if root.origin is not None else None
+        matched = 0
+        for label in labels:
+            child = node.children.get(label)
+            if child is None:
+                break
+            node = child
+            matched += 1
+            if node.origin is not None:
+                apex = node
+            elif apex is not None and TYPE_NS in node.rrsets:
+                return self._referral(root, node)
+
+        if apex is None:
+            return None
+        soa = apex.rrsets.get(TYPE_SOA, [])
+
+        if matched < len(labels):
+            wildcard = node.children.get("*")
+            if wildcard is None:
+                return dict(rcode=3, answers=[], authorities=list(soa), additional=[], authoritative=True,
+                            cname=None)
+            node = wildcard
+
+        if qtype == TYPE_ANY:
+            records = [record for rrset in node.rrsets.values() for record in rrset]
+        else:
+            records = node.rrsets.get(qtype) or []
+        cname = None
+        if not records and qtype != TYPE_CNAME and TYPE_CNAME in node.rrsets:
+            records = node.rrsets[TYPE_CNAME]
+            cname = records[0].rdata
+        if not records:
+            return dict(rcode=0, answers=[], authorities=list(soa), additional=[], authoritative=True,
+                        cname=None)
+
+        if matched < len(labels):
+            # Records of a wildcard are synthesized with the name of the question
+            owner = ".".join(labels[::-1]) + "."
+            records = [ResourceRecord(owner, record.rr_type, record.rr_class, record.ttl, record.rdata)
+                       for record in records]
+        return dict(rcode=0, answers=list(records), authorities=[], additional=[], authoritative=True,
+                    cname=cname)
+
+    @staticmethod
+    def _referral(root: _Node, cut: _Node) -> dict:
+        """Return the referral to the zone delegated at cut, with the glue records found in the trie."""
+        authorities = list(cut.rrsets[TYPE_NS])
+        additional = []
+        for record in authorities:
+            node = root
+            for label in _labels(record.rdata):
+                node = node.children.get(label)
+                if node is None:
+                    break
+            if node is not None:
+                for rr_type in GLUE_TYPES:
+                    additional.extend(node.rrsets.get(rr_type, []))
+        return dict(rcode=0, answers=[], authorities=authorities, additional=additional, authoritative=False,
+                    cname=None)
+
+    def get_origins(self):
+        """Return the names of the loaded zones."""
+        origins = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.origin is not None:
+                origins.append(node.origin)
+            stack.extend(node.children.values())
+        return sorted(origins)
+
+    def get_generation(self):
+        """Return the number of loads that swapped in new zones."""
+        return self._generation
+
+    origins = property(get_origins)
+    generation = property(get_generation)
@@ -0,0 +1,694 @@
+"""
+Micro-benchmarks for the cache system.
+
+The benchmarks never touch the tracked database files directly; they work on a
+copy placed in a temporary directory.
+
+Usage:
+python3 benchmark.py [--suite database|snapshot|backends|policies|server|processes|shared|tcp|prefetch|decode] [--records N] [--queries N] [--threads N]
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import tracemalloc
+from time import perf_counter, sleep, time
+
+from Crypto.Cipher import AES
+
+from CacheStore import create_store
+from Database import Database
+from AES import AESCipher
+from configurator import Configurator
+from MemoryCache import MemoryCache
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from NameServer import NameServer
+from ResourceRecord import ResourceRecord
+from Supervisor import Supervisor
+from Framing import recv_frame, send_frame
+from PipelinedConnection import PipelinedConnection
+from Resolver import Resolver
+import ParseString
+from ParseString import parse_string_msg
+from ResponseCache import ResponseCache
+from WireFormat import encode_message, decode_message
+
+
+def _copy_database(source: str, directory: str) -> str:
+    """Copy a database file into directory and return the path of the copy."""
+    target = os.path.join(directory, os.path.basename(source))
+    if os.path.exists(source):
+        shutil.copyfile(source, target)
+    return target
+
+
+def _make_record(i: int) -> ResourceRecord:
+    """Create the i-th synthetic A record."""
+    return ResourceRecord(f"host{i}.example.com.", 1, 1, 3600,
+                          f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}")
+
+
+def bench_database(source: str = "DatabaseResolver.db", records: int = 1000,
+                   queries: int = 5000, threads: int = 1) -> dict:
+    """
+    Measure the lookup throughput of Database the way Resolver.query uses it
+    on a copy of the source database.
+    Return a dictionary of results.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        database = Database(_copy_database(source, directory))
+
+        start = perf_counter()
+        for i in range(records):
+            database.add_to_database(_make_record(i))
+        insert_seconds = perf_counter() - start
+
+        def worker(offset: int, count: int):
+            for i in range(count):
+                record = _make_record((offset + i) % records)
+                database.query_from_database(record.name, record.rr_type, record.rr_class)
+
+        per_thread = queries // threads
+        workers = [threading.Thread(target=worker, args=(n * per_thread, per_thread))
+                   for n in range(threads)]
+
+        start = perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        query_seconds = perf_counter() - start
+
+        if hasattr(database, "close"):
+            database.close()
+
+        return dict(inserts_per_second=records / insert_seconds,
+                    queries_per_second=per_thread * threads / query_seconds)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_snapshot(records: int = 1000000) -> dict:
+    """
+    Measure how long it takes to save a snapshot of records entries and to
+    warm-start a fresh database from it, and the time to the first cache hit.
+    Return a dictionary of results.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        database = Database(os.path.join(directory, "source.db"))
+        database.add_many([_make_record(i) for i in range(records)])
+
+        start = perf_counter()
+        database.save_snapshot(os.path.join(directory, "cache.snapshot"))
+        save_seconds = perf_counter() - start
+        database.close()
+
+        start = perf_counter()
+        warm = Database(os.path.join(directory, "warm.db"), memory_cache=MemoryCache())
+        warm.load_snapshot(os.path.join(directory, "cache.snapshot"))
+        load_seconds = perf_counter() - start
+
+        record = _make_record(records - 1)
+        warm.query_rrset(record.name, record.rr_type, record.rr_class)
+        time_to_first_hit = warm.stats["time_to_first_hit"]
+        warm.close()
+
+        return dict(save_seconds=save_seconds, load_seconds=load_seconds,
+                    time_to_first_hit=time_to_first_hit,
+                    snapshot_bytes=os.path.getsize(os.path.join(directory, "cache.snapshot")))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_backends(records: int = 10000, queries: int = 50000,
+                   backends: tuple = ("sqlite", "memory", "mmap")) -> dict:
+    """
+    Compare the put, get and expire throughput of the cache backends, without a memory tier.
+    Return a dictionary of results per backend.
+    """
+    results = {}
+    for backend in backends:
+        directory = tempfile.mkdtemp()
+        try:
+            store = create_store(os.path.join(directory, "bench"), backend)
+
+            start = perf_counter()
+            for i in range(records):
+                store.add_many([_make_record(i)])
+            put_seconds = perf_counter() - start
+
+            start = perf_counter()
+            for i in range(queries):
+                record = _make_record(i % records)
+                store.query_rrset(record.name, record.rr_type, record.rr_class)
+            get_seconds = perf_counter() - start
+
+            # Expire everything at once, as if the records had been stored an hour ago
+            start = perf_counter()
+            purged = 0
+            while True:
+                deleted = store._expire(int(time()) + 3601, 500)
+                purged += deleted
+                if deleted < 500:
+                    break
+            expire_seconds = perf_counter() - start
+            store.close()
+
+            results[backend] = dict(puts_per_second=records / put_seconds,
+                                    gets_per_second=queries / get_seconds,
+                                    expires_per_second=purged / expire_seconds)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_policies(entries: int = 1000, queries: int = 200000, names: int = 50000,
+                   flood: float = 0.5) -> dict:
+    """
+    Replay a Zipf-like workload mixed with a flood of unique random names against the
+    memory tier, for every eviction policy with and without admission.
+    flood is the share of queries for names that are never requested again.
+    Return a dictionary of hit rates and counters per configuration.
+    """
+    rng = random.Random(1)
+    weights = [1 / (rank + 1) for rank in range(names)]
+    popular = rng.choices(range(names), weights=weights, k=queries)
+    workload = [f"random{i}.example.com." if rng.random() < flood else f"host{popular[i]}.example.com."
+                for i in range(queries)]
+
+    results = {}
+    for policy in MemoryCache.POLICIES:
+        for admission in (False, True):
+            cache = MemoryCache(max_entries=entries, policy=policy, admission=admission)
+            for name in workload:
+                if cache.get(name, 1, 1, 0) is None:
+                    cache.put(name, 1, 1, 1, 1)
+            stats = cache.stats
+            popular_queries = queries - sum(1 for name in workload if name.startswith("random"))
+            results[(policy, admission)] = dict(hit_rate=stats["hits"] / popular_queries, **stats)
+    return results
+
+
+class _BenchNameServer(NameServer):
+    def __init__(self, path: str, delay: float):
+        """A NameServer whose external DNS server answers every query after delay seconds."""
+        super().__init__(worker_index=1, database=Database(path))
+        self.delay = delay
+
+    def _answer(self, message_query: Message) -> Message:
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + ".", 1, 1, 60, "127.0.0.1"))
+        return result
+
+    def query_out(self, message_query: Message):
+        sleep(self.delay)
+        return self._answer(message_query)
+
+    async def query_out_async(self, message_query: Message):
+        await asyncio.sleep(self.delay)
+        return self._answer(message_query)
+
+
+def bench_server(mode: str = "asyncio", queries: int = 200, delay: float = 0.05) -> dict:
+    """
+    Send queries for distinct names at once to a NameServer over UDP on the loopback,
+    in the threaded or the asyncio serving mode, while every external query takes delay seconds.
+    Return a dictionary of results.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        name_server = _BenchNameServer(os.path.join(directory, "ns.db"), delay)
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(("127.0.0.1", 0))
+        address = probe.getsockname()
+        probe.close()
+
+        if mode == "asyncio":
+            loop = asyncio.new_event_loop()
+
+            def serve():
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(name_server.start_async_servers(*address, 0))
+                loop.run_forever()
+
+            threading.Thread(target=serve, daemon=True).start()
+        else:
+            Configurator.IP, Configurator.UDP_PORT = address
+            threading.Thread(target=name_server.start_listening_udp, daemon=True).start()
+        sleep(0.2)
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(max(5.0, 2 * queries * delay))
+        start = perf_counter()
+        for i in range(queries):
+            message = Message(header=MessageHeader(), question=MessageQuestion(f"host{i}.example.com", 1, 1))
+            client.sendto(AESCipher().encrypt(message.to_string()), address)
+        answered = 0
+        try:
+            while answered < queries:
+                client.recvfrom(Configurator.BUFFER_SIZE)
+                answered += 1
+        except socket.timeout:
+            pass
+        seconds = perf_counter() - start
+        client.close()
+
+        result = dict(answered=answered, seconds=seconds, queries_per_second=answered / seconds)
+        if mode == "threaded":
+            result.update(name_server.get_udp_pool_stats())
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class _CachedNameServer(NameServer):
+    PATH = None
+
+    def __init__(self, worker_index: int = None, counters=None):
+        """A NameServer worker answering from a pre-filled database."""
+        super().__init__(worker_index, counters, database=Database(_CachedNameServer.PATH, memory_cache=MemoryCache()))
+
+
+def _client(port: int, seconds: float, results):
+    """Send queries for cached names one at a time for seconds, and record how many were answered."""
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(1.0)
+    answered = 0
+    deadline = perf_counter() + seconds
+    i = 0
+    while perf_counter() < deadline:
+        message = Message(header=MessageHeader(), question=MessageQuestion(f"host{i % 100}.example.com", 1, 1))
+        client.sendto(AESCipher().encrypt(message.to_string()), ("127.0.0.1", port))
+        try:
+            client.recv(Configurator.BUFFER_SIZE)
+            answered += 1
+        except socket.timeout:
+            pass
+        i += 1
+    client.close()
+    results.put(answered)
+
+
+def bench_processes(workers: tuple = (1, 2, 4), clients: int = 8, seconds: float = 3.0) -> dict:
+    """
+    Measure the throughput of cached answers over UDP on the loopback with a Supervisor
+    of each number of worker processes, all bound to one port with SO_REUSEPORT.
+    Return a dictionary of queries per second by number of workers.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        _CachedNameServer.PATH = os.path.join(directory, "ns.db")
+        database = Database(_CachedNameServer.PATH)
+        database.add_many([_make_record(i) for i in range(100)])
+        database.close()
+
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(("127.0.0.1", 0))
+        Configurator.IP, Configurator.UDP_PORT = probe.getsockname()
+        probe.close()
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        Configurator.TCP_PORT = probe.getsockname()[1]
+        probe.close()
+
+        context = multiprocessing.get_context("fork")
+        results = {}
+        for count in workers:
+            supervisor = Supervisor(count, server_class=_CachedNameServer)
+            supervisor.start()
+            sleep(0.5)
+            queue = context.Queue()
+            processes = [context.Process(target=_client, args=(Configurator.UDP_PORT, seconds, queue))
+                         for _ in range(clients)]
+            for process in processes:
+                process.start()
+            answered = sum(queue.get() for _ in processes)
+            for process in processes:
+                process.join()
+            supervisor.shutdown()
+            results[count] = answered / seconds
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _shared_worker(path: str, backend: str, names: int, seed: int, results):
+    """Look up every name once in a random order, storing the misses as an external answer would."""
+    store = create_store(path, backend)
+    order = list(range(names))
+    random.Random(seed).shuffle(order)
+    misses = 0
+    for i in order:
+        record = _make_record(i)
+        if not store.query_rrset(record.name, record.rr_type, record.rr_class):
+            misses += 1
+            store.add_many([record])
+    store.close()
+    results.put(misses)
+
+
+def bench_shared(processes: int = 4, names: int = 2000) -> dict:
+    """
+    Let processes worker processes resolve the same names, each with a private store ("memory")
+    or with one store shared through an mmap'd file ("mmap").
+    Return the number of misses, that is of external queries, per backend.
+    """
+    context = multiprocessing.get_context("fork")
+    results = {}
+    for backend in ("memory", "mmap"):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "shared")
+            create_store(path, backend).close()
+            queue = context.Queue()
+            workers = [context.Process(target=_shared_worker, args=(path, backend, names, seed, queue))
+                       for seed in range(processes)]
+            for worker in workers:
+                worker.start()
+            results[backend] = sum(queue.get() for _ in workers)
+            for worker in workers:
+                worker.join()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_tcp(queries: int = 500, threads: int = 8, delay: float = 0.02) -> dict:
+    """
+    Send queries to a NameServer process over TCP on the loopback: on a new connection per
+    query, one at a time on the persistent connection the Resolver keeps, and from threads
+    sharing that connection, whose queries are then pipelined. The names are either cached,
+    or missing from the cache and answered by an external DNS server after delay seconds.
+    Return the queries per second of each way, by workload.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        name_server = _BenchNameServer(os.path.join(directory, "ns.db"), delay)
+        name_server.database.add_many([_make_record(i) for i in range(100)])
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        address = probe.getsockname()
+        probe.close()
+        Configurator.IP, Configurator.TCP_PORT = address
+        # The NameServer runs in its own process, so that it does not share the GIL with the clients
+        server = multiprocessing.get_context("fork").Process(target=name_server.start_listening_tcp, daemon=True)
+        server.start()
+        sleep(0.5)
+
+        results = {}
+        for workload, name in (("cached", "host{}.example.com"), ("uncached", "miss{}.example.com")):
+            def query(i: int) -> str:
+                question = MessageQuestion(name.format(i % 100 if workload == "cached" else i), 1, 1)
+                return Message(header=MessageHeader(id=i % 65536), question=question).to_string()
+
+            count = queries if workload == "cached" else min(queries, 100)
+            start = perf_counter()
+            for i in range(count):
+                connection = socket.create_connection(address)
+                send_frame(connection, AESCipher().encrypt(query(i)))
+                AESCipher().decrypt(recv_frame(connection))
+                connection.close()
+            results[(workload, "new connection per query")] = count / (perf_counter() - start)
+
+            connection = PipelinedConnection(address, AESCipher().decrypt, Resolver._response_key)
+            start = perf_counter()
+            for i in range(count, 2 * count):
+                connection.request(AESCipher().encrypt(query(i)), Resolver._response_key(query(i)))
+            results[(workload, "persistent connection")] = count / (perf_counter() - start)
+
+            def ask(first: int):
+                for i in range(2 * count + first, 3 * count, threads):
+                    connection.request(AESCipher().encrypt(query(i)), Resolver._response_key(query(i)))
+
+            workers = [threading.Thread(target=ask, args=(first,)) for first in range(threads)]
+            start = perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            results[(workload, f"pipelined from {threads} threads")] = count / (perf_counter() - start)
+            connection.close()
+
+        server.terminate()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class _SlowUpstreamNameServer(NameServer):
+    DELAY = 0.05
+    TTL = 10
+
+    def query_out(self, message_query: Message):
+        """Answer after DELAY seconds with a record of TTL seconds, like a slow external DNS server."""
+        sleep(self.DELAY)
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + ".", 1, 1, self.TTL, "127.0.0.1"))
+        self.save_to_database(result)
+        return result
+
+
+def bench_prefetch(seconds: float = 32.0, ttl: int = 10, delay: float = 0.05, interval: float = 0.002) -> dict:
+    """
+    Query one hot name through NameServer.answer() every interval seconds for seconds, without
+    and with prefetching (a window of 0.2), while its RRset has a TTL of ttl seconds and the
+    external DNS server takes delay seconds. The response cache is on, as by default.
+    Return the latency percentiles and the number of queries that waited for the external
+    DNS server after the first one, by mode.
+    """
+    saved = Configurator.CACHE_BACKEND, Configurator.PREFETCH_WINDOW
+    _SlowUpstreamNameServer.DELAY, _SlowUpstreamNameServer.TTL = delay, ttl
+    query = Message(header=MessageHeader(), question=MessageQuestion("hot.example.com", 1, 1))
+    query = AESCipher().encrypt(query.to_string())
+    results = {}
+    try:
+        Configurator.CACHE_BACKEND = "memory"
+        for mode, window in (("without prefetch", 0), ("with prefetch", 0.2)):
+            Configurator.PREFETCH_WINDOW = window
+            name_server = _SlowUpstreamNameServer(worker_index=1)
+            # The first query always waits for the external DNS server, and is left out
+            name_server.answer(query)
+            latencies = []
+            deadline = perf_counter() + seconds
+            while perf_counter() < deadline:
+                start = perf_counter()
+                name_server.answer(query)
+                latencies.append(perf_counter() - start)
+                sleep(interval)
+            name_server.database.close()
+
+            latencies.sort()
+            results[mode] = dict(
+                queries=len(latencies),
+                p99=latencies[int(len(latencies) * 0.99)],
+                p999=latencies[int(len(latencies) * 0.999)],
+                max=latencies[-1],
+                waited=sum(1 for latency in latencies if latency >= delay),
+            )
+        return results
+    finally:
+        Configurator.CACHE_BACKEND, Configurator.PREFETCH_WINDOW = saved
+
+
+def _allocated_blocks(function, messages: int) -> float:
+    """
+    Return the memory blocks left allocated by a call of function, with its result kept,
+    on average over messages calls. The blocks are counted with sys.getallocatedblocks()
+    with the garbage collector off, so that they are not freed while counting.
+    """
+    function()
+    results = [None] * messages
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        for i in range(messages):
+            results[i] = function()
+        return (sys.getallocatedblocks() - before) / messages
+    finally:
+        gc.enable()
+
+
+def _traced_peak(function, messages: int) -> float:
+    """Return the bytes traced by tracemalloc at the peak of a call of function, on average over messages calls."""
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(messages):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            function()
+            total += tracemalloc.get_traced_memory()[1] - before
+        return total / messages
+    finally:
+        tracemalloc.stop()
+
+
+def _split_parse_string_flag(flags: str) -> dict:
+    """parse_string_flag as it was before decoding by offset: through a binary string."""
+    bin_str = bin(int(flags, 16))[2:].rjust(16, "0")
+    return dict(qr=int(bin_str[0]), opcode=int(bin_str[1:5], 2), aa=bin_str[5] == "1", tc=bin_str[6] == "1",
+                rd=bin_str[7] == "1", ra=bin_str[8] == "1", z=int(bin_str[9:12]), rcode=int(bin_str[12:16], 2))
+
+
+def _split_text_decode(data: bytes) -> Message:
+    """
+    Decrypt and parse a text message as before decoding by offset: base64 of the received
+    bytes, the padding cut from the decrypted bytes without checking it, and the flags
+    parsed through a binary string.
+    """
+    cipher = AESCipher()
+    plain = AES.new(cipher.key, AES.MODE_CBC, cipher.iv).decrypt(base64.b64decode(data))
+    saved = ParseString.parse_string_flag
+    ParseString.parse_string_flag = _split_parse_string_flag
+    try:
+        return parse_string_msg(AESCipher.unpadding(plain).decode("utf-8"))
+    finally:
+        ParseString.parse_string_flag = saved
+
+
+def _split_wire_query(query: bytes) -> tuple:
+    """ResponseCache.split_wire_query as it was before: the key joined from two slices of the received bytes."""
+    offset = 12
+    while offset < len(query) and 0 < query[offset] < 64:
+        offset += query[offset] + 1
+    return query[:2], query[2:4] + query[12:offset + 5]
+
+
+def bench_decode(messages: int = 2000) -> dict:
+    """
+    Receive and decode a response of 8 records messages times, the way the listeners did
+    before decoding by offset and the way they do now: receive it over UDP with recvfrom()
+    and with recvfrom_into() a preallocated buffer, decrypt and parse its text, decode its
+    wire format and cut the response cache key of its query, from the received bytes
+    before and from a memoryview over the buffer now.
+    Return the memory blocks left allocated per message with the results kept, the bytes
+    traced by tracemalloc at the peak of one message, and the messages per second, by step.
+    """
+    query = Message(header=MessageHeader(id=7), question=MessageQuestion("www.example.com", 1, 1))
+    response = Message(request=query)
+    for i in range(8):
+        response.add_a_new_record_to_answer_section(ResourceRecord("www.example.com.", 1, 1, 300, f"10.0.0.{i}"))
+    text = AESCipher().encrypt(response.to_string())
+    wire = encode_message(response)
+    wire_query = encode_message(query)
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    buffer = bytearray(Configurator.BUFFER_SIZE)
+
+    def receive():
+        sender.sendto(wire, address)
+        return receiver.recvfrom(Configurator.BUFFER_SIZE)
+
+    def receive_into():
+        sender.sendto(wire, address)
+        return receiver.recvfrom_into(buffer)
+
+    steps = {
+        ("receive", "before"): receive,
+        ("receive", "now"): receive_into,
+        ("text decrypt + parse", "before"): lambda: _split_text_decode(text),
+        ("text decrypt + parse", "now"): lambda: parse_string_msg(AESCipher().decrypt(memoryview(text))),
+        ("wire decode", "now"): lambda: decode_message(memoryview(wire)),
+        ("wire cache key", "before"): lambda: _split_wire_query(wire_query),
+        ("wire cache key", "now"): lambda: ResponseCache.split_wire_query(memoryview(wire_query)),
+    }
+    results = {}
+    try:
+        for step, function in steps.items():
+            blocks = _allocated_blocks(function, messages)
+            peak = _traced_peak(function, messages)
+            start = perf_counter()
+            for _ in range(messages):
+                function()
+            results[step] = dict(blocks=blocks, peak_bytes=peak,
+                                 messages_per_second=messages / (perf_counter() - start))
+        return results
+    finally:
+        receiver.close()
+        sender.close()
+
+
+def parse_args():
+    """Parse arguments from the command-line string."""
+    parser = argparse.ArgumentParser(description="Benchmark the DNS cache system")
+    parser.add_argument("--suite", default="database", choices=["database", "snapshot", "backends", "policies", "server", "processes", "shared", "tcp", "prefetch", "decode"],
+                        help="Benchmark to run (database by default)")
+    parser.add_argument("--source", default="DatabaseResolver.db",
+                        help="Database file to copy before benchmarking")
+    parser.add_argument("--records", default=1000, type=int,
+                        help="Number of records inserted before querying")
+    parser.add_argument("--queries", default=5000, type=int,
+                        help="Number of cache lookups")
+    parser.add_argument("--threads", default=1, type=int,
+                        help="Number of threads issuing lookups")
+    parser.add_argument("--mode", default="asyncio", choices=["asyncio", "threaded"],
+                        help="Serving mode of the NameServer for the server suite")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.suite == "database":
+        result = bench_database(args.source, args.records, args.queries, args.threads)
+        print(f"[BENCH] Database: {result['inserts_per_second']:.0f} inserts/s, "
+              f"{result['queries_per_second']:.0f} queries/s")
+    elif args.suite == "snapshot":
+        result = bench_snapshot(args.records)
+        print(f"[BENCH] Snapshot of {args.records} records ({result['snapshot_bytes']} bytes): "
+              f"saved in {result['save_seconds']:.2f} s, loaded in {result['load_seconds']:.2f} s, "
+              f"first hit after {result['time_to_first_hit']:.2f} s")
+    elif args.suite == "backends":
+        for backend, result in bench_backends(args.records, args.queries).items():
+            print(f"[BENCH] {backend}: {result['puts_per_second']:.0f} puts/s, "
+                  f"{result['gets_per_second']:.0f} gets/s, "
+                  f"{result['expires_per_second']:.0f} expires/s")
+    elif args.suite == "policies":
+        for (policy, admission), result in bench_policies().items():
+            print(f"[BENCH] {policy}{' + admission' if admission else ''}: "
+                  f"{result['hit_rate'] * 100:.1f}% of popular queries hit, "
+                  f"{result['evictions']} evictions, {result['rejected']} rejected")
+    elif args.suite == "server":
+        result = bench_server(args.mode, min(args.queries, 1000))
+        print(f"[BENCH] NameServer ({args.mode}): {result['answered']} queries answered "
+              f"in {result['seconds']:.2f} s, {result['queries_per_second']:.0f} queries/s")
+        if args.mode == "threaded":
+            print(f"[BENCH] Worker pool: max depth {result['max_depth']}, {result['shed']} shed, "
+                  f"average wait {result['average_wait'] * 1000:.1f} ms")
+    elif args.suite == "processes":
+        for workers, queries_per_second in bench_processes().items():
+            print(f"[BENCH] {workers} worker processes: {queries_per_second:.0f} queries/s")
+    elif args.suite == "shared":
+        for backend, misses in bench_shared().items():
+            print(f"[BENCH] 4 processes x 2000 names, {backend} store: {misses} external queries")
+    elif args.suite == "tcp":
+        for (workload, way), queries_per_second in bench_tcp(min(args.queries, 500),
+                                                             args.threads if args.threads > 1 else 8).items():
+            print(f"[BENCH] {workload.capitalize()} queries over TCP, {way}: {queries_per_second:.0f} queries/s")
+    elif args.suite == "prefetch":
+        for mode, result in bench_prefetch().items():
+            print(f"[BENCH] Hot name, {mode}: p99 {result['p99'] * 1000:.2f} ms, "
+                  f"p99.9 {result['p999'] * 1000:.2f} ms, max {result['max'] * 1000:.2f} ms, "
+                  f"{result['waited']} of {result['queries']} "
+                  f"queries waited for the external DNS server")
+    elif args.suite == "decode":
+        for (step, version), result in bench_decode().items():
+            print(f"[BENCH] {step} ({version}): {result['blocks']:.1f} blocks allocated per message, "
+                  f"{result['peak_bytes']:.0f} bytes at the peak, {result['messages_per_second']:.0f} messages/s")
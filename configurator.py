@@ -20,6 +20,122 @@ class Configurator:
 
     BUFFER_SIZE = 4096
 
+    # Largest UDP reply, advertised with EDNS0 (RFC 6891) by the NameServer and the Resolver.
+    # A reply to a query that advertises a smaller size, or none (then 512 bytes, RFC 1035),
+    # is cut at a record boundary with the TC flag set, and the client retries over TCP
+    UDP_PAYLOAD_SIZE = 1232
+    DEFAULT_UDP_PAYLOAD_SIZE = 512
+
+    # How the NameServer serves queries: "threaded" (a listener thread per protocol, UDP queries
+    # resolved by the bounded WorkerPool below) or "asyncio" (UDP and TCP on one event loop,
+    # external queries in flight at once, but without load shedding or pooled receive buffers,
+    # and with the cache lookups and decryption run on the loop)
+    SERVER_MODE = "threaded"
+
+    # Format of the messages the NameServer accepts and answers: "text" (the encrypted text
+    # messages of the Resolver) or "wire" (plain RFC 1035 packets, as sent by dig or dnsperf)
+    MESSAGE_FORMAT = "text"
+
+    # Threads resolving the UDP queries of the threaded mode, the number of queries that can
+    # wait for one, and what happens to a query when that many are waiting: "drop-oldest"
+    # drops the query that waited longest, "servfail" answers the new one with SERVFAIL at once
+    WORKER_THREADS = 16
+    WORKER_QUEUE_SIZE = 1024
+    SHED_POLICY = "servfail"
+
+    # TCP connections carry length-prefixed messages: the listen backlog, the seconds a
+    # connection may stay idle before it is closed, and the queries of one connection resolved at once
+    TCP_BACKLOG = 128
+    TCP_IDLE_TIMEOUT = 10.0
+    TCP_PIPELINE = 16
+
+    # External DNS servers the NameServer forwards cache misses to, the seconds to wait for
+    # one, and the failures in a row after which one is left out for UPSTREAM_EJECT_SECONDS
+    UPSTREAMS = [dict(ip="8.8.8.8", port=53), dict(ip="1.1.1.1", port=53)]
+    UPSTREAM_TIMEOUT = 2.0
+    UPSTREAM_MAX_FAILURES = 3
+    UPSTREAM_EJECT_SECONDS = 30.0
+
+    # How cache misses are resolved: "forward" sends them to the UPSTREAMS, "iterative" walks
+    # the DNS tree from the ROOT_HINTS, caching the name servers of up to DELEGATION_CACHE_SIZE zones
+    RESOLUTION_MODE = "forward"
+    ROOT_HINTS = [dict(ip=ip, port=53) for ip in (
+        "198.41.0.4", "170.247.170.2", "192.33.4.12", "199.7.91.13", "192.203.230.10",
+        "192.5.5.241", "192.112.36.4", "198.97.190.53", "192.36.148.17", "192.58.128.30",
+        "193.0.14.129", "199.7.83.42", "202.12.27.33")]
+    DELEGATION_CACHE_SIZE = 10000
+
+    # Zone files the NameServer answers for authoritatively, as dict(origin=..., path=...),
+    # and seconds between two checks for changed zone files (0 disables reloading)
+    ZONE_FILES = []
+    ZONE_RELOAD_INTERVAL = 5
+
+    # Number of NameServer processes started by the Supervisor (1 runs a single process),
+    # and whether the listening sockets are bound with SO_REUSEPORT so that they can share a port
+    SERVER_PROCESSES = 1
+    REUSE_PORT = False
+
+    # Seconds between two checks of the worker processes by the Supervisor
+    SUPERVISOR_INTERVAL = 1.0
+
+    # Storage engine of the cache: "sqlite", "memory" or "mmap" (see CacheStore.create_store)
+    CACHE_BACKEND = "sqlite"
+
+    # Number and size in bytes of the slots of the mmap cache file, and number of stripes
+    # locked independently by writers. Every process of the host opening the file shares it,
+    # so "mmap" is the backend to use with several SERVER_PROCESSES.
+    MMAP_SLOTS = 65536
+    MMAP_SLOT_SIZE = 512
+    MMAP_STRIPES = 64
+
+    # Budget of the in-memory cache tier in front of the cache store (not used by the "mmap" backend)
+    MEMORY_CACHE_ENTRIES = 10000
+    MEMORY_CACHE_BYTES = 16 * 1024 * 1024
+
+    # Eviction policy of the memory tier ("lru", "lfu" or "arc"), and whether new names
+    # must have been requested more often than the entry they would evict to be cached
+    MEMORY_CACHE_POLICY = "lru"
+    MEMORY_CACHE_ADMISSION = False
+
+    # Serialized responses kept by the NameServer to answer repeated questions without
+    # building a Message (0 disables the response cache)
+    RESPONSE_CACHE_ENTRIES = 10000
+
+    # Refresh-ahead of hot RRsets: an RRset hit PREFETCH_MIN_HITS times is queried again
+    # when it is hit in the last PREFETCH_WINDOW fraction of its TTL (0, the default, disables
+    # prefetching; 0.1 refreshes hot RRsets in the last tenth of their TTL).
+    # The window of every RRset is shortened by a random fraction of up to PREFETCH_JITTER,
+    # and at most PREFETCH_MAX_IN_FLIGHT refreshes run at once.
+    PREFETCH_WINDOW = 0
+    PREFETCH_MIN_HITS = 3
+    PREFETCH_JITTER = 0.5
+    PREFETCH_MAX_IN_FLIGHT = 4
+
+    # Serve-stale (RFC 8767): whether RRsets are kept STALE_GRACE seconds after they expire,
+    # to answer with a TTL of STALE_ANSWER_TTL when the external DNS servers fail or take
+    # longer than STALE_LATENCY_BUDGET seconds
+    SERVE_STALE = False
+    STALE_GRACE = 3600
+    STALE_ANSWER_TTL = 30
+    STALE_LATENCY_BUDGET = 1.8
+    # Threads running the external queries of stale answers, which keep running after the
+    # stale answer is sent, and the number of queries that can wait for one. A stale answer
+    # sent while that many are waiting does not query the external DNS servers again.
+    STALE_REFRESH_THREADS = 4
+    STALE_REFRESH_QUEUE_SIZE = 256
+
+    # Seconds between two background sweeps of expired records, and rows deleted per batch
+    SWEEP_INTERVAL = 30
+    SWEEP_BATCH_SIZE = 500
+
+    # Seconds a negative answer is cached when the response has no SOA record,
+    # and the upper bound applied to the TTL derived from the SOA record
+    NEGATIVE_TTL = 60
+    NEGATIVE_TTL_MAX = 900
+
+    # Seconds between two snapshots of the cache used for warm starts (0 disables snapshots)
+    SNAPSHOT_INTERVAL = 300
+
     @staticmethod
     def get_ip() -> str:
         """Extract ip from the local machine."""
@@ -60,6 +176,16 @@ class Configurator:
             Configurator.OTHERS.append(dict(ip=ip, udp=udp_port, tcp=tcp_port))
         os.system("cls" if os.name == "nt" else "clear")
 
+    @staticmethod
+    def udp_limit(payload_size) -> int:
+        """
+        Return the largest UDP response to a query that advertised payload_size: the smaller
+        of it and UDP_PAYLOAD_SIZE, or DEFAULT_UDP_PAYLOAD_SIZE if it advertised none.
+        """
+        if not payload_size:
+            return Configurator.DEFAULT_UDP_PAYLOAD_SIZE
+        return max(Configurator.DEFAULT_UDP_PAYLOAD_SIZE, min(payload_size, Configurator.UDP_PAYLOAD_SIZE))
+
     @staticmethod
     def set_buffer_size(size: int):
         if size > 0:
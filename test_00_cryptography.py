@@ -1,3 +1,5 @@
+import base64
+import pytest
 from AES import *
 from Message import Message
 from MessageHeader import MessageHeader
@@ -21,3 +23,14 @@ def test_crypto_functions_on_message():
     recovered_text = AESCipher().decrypt(ciphertext)
 
     assert recovered_text == plain_message
+
+
+def test_invalid_padding_is_rejected():
+    cipher = AESCipher()
+    # a last byte of 5 announces padding that the bytes before it do not repeat
+    data = AES.new(cipher.key, AES.MODE_CBC, cipher.iv).encrypt(b'a' * 15 + b'\x05')
+    with pytest.raises(ValueError):
+        cipher.decrypt(base64.b64encode(data))
+    with pytest.raises(ValueError):
+        cipher.decrypt(base64.b64encode(data[:-1]))
+    assert cipher.decrypt(memoryview(cipher.encrypt('www.google.com'))) == 'www.google.com'
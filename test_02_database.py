@@ -1,6 +1,7 @@
+import pytest
 from Database import Database
 from ResourceRecord import ResourceRecord
-from time import sleep
+from time import sleep, time
 
 
 def test_database():
@@ -9,3 +10,370 @@ def test_database():
     db.add_to_database(rr)
 
     assert rr == db.query_from_database('www.google.com', 1, 1)
+
+
+def test_database_shared_between_threads():
+    import threading
+
+    db = Database('test.db')
+    errors = []
+
+    def worker(i):
+        try:
+            rr = ResourceRecord(f'thread{i}.example.com', 1, 1, 60, '127.0.0.1')
+            db.add_to_database(rr)
+            db.refresh()
+            assert rr == db.query_from_database(f'thread{i}.example.com', 1, 1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.close()
+
+    assert errors == []
+
+
+def test_database_migrates_legacy_file(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Cache(domain text, type integer, class integer,"
+                 " ttl integer, data text, ttd integer)")
+    conn.execute("INSERT INTO Cache VALUES ('www.google.com', 1, 1, 100, '127.0.0.1', 9999999999)")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    plan = db._connection().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM Cache WHERE domain = ? AND type = ? AND class = ?",
+        ('www.google.com', 1, 1)).fetchall()
+
+    assert 'CacheRecord' in str(plan)
+    assert db.query_from_database('www.google.com', 1, 1).rdata == '127.0.0.1'
+    db.close()
+
+
+def test_database_vacuums_a_file_once(tmp_path, monkeypatch):
+    import sqlite3
+    import Database as database_module
+
+    statements = []
+    sqlite_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        conn = sqlite_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database_module.sqlite3, 'connect', connect)
+    path = str(tmp_path / 'vacuum.db')
+    db = Database(path)
+    assert db._connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    db.close()
+    assert 'VACUUM' in statements
+
+    # the migration is recorded in the file, so opening it again does not rewrite it
+    statements.clear()
+    Database(path).close()
+    assert 'VACUUM' not in statements
+
+
+def test_database_sweep_purges_expired_records(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'sweep.db')
+    db = Database(path)
+    db.add_to_database(ResourceRecord('live.google.com', 1, 1, 100, '127.0.0.1'))
+    # store records that are already expired, as if they were left from an old run
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO Cache VALUES (?, 1, 1, 1, '127.0.0.2', 1)",
+                     [(f'old{i}.google.com',) for i in range(25)])
+    conn.commit()
+    conn.close()
+    db._schedule_expiry(1)
+
+    assert db.query_from_database('old0.google.com', 1, 1) is None
+
+    purged, seconds = db.sweep(batch_size=10)
+
+    assert purged == 25
+    assert db.sweep_stats['last_purged'] == 25
+    assert db.query_from_database('live.google.com', 1, 1) is not None
+    db.close()
+
+
+def test_database_replaces_rrsets(tmp_path):
+    db = Database(str(tmp_path / 'rrset.db'))
+    rr = ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.1')
+    db.add_to_database(rr)
+    db.add_to_database(rr)
+
+    assert db._connection().execute("SELECT COUNT(*) FROM Cache").fetchone()[0] == 1
+
+    db.add_many([ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.2'),
+                 ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.3'),
+                 ResourceRecord('mail.google.com', 1, 1, 100, '127.0.0.4')])
+    rows = db._connection().execute(
+        "SELECT data FROM Cache WHERE domain = 'www.google.com' ORDER BY data").fetchall()
+
+    assert rows == [('127.0.0.2',), ('127.0.0.3',)]
+    assert db.query_from_database('mail.google.com', 1, 1).rdata == '127.0.0.4'
+    db.close()
+
+
+def test_database_returns_rrset_with_remaining_ttl(tmp_path):
+    from MemoryCache import MemoryCache
+
+    for memory_cache in (None, MemoryCache()):
+        db = Database(str(tmp_path / 'ttl.db'), memory_cache=memory_cache)
+        db.add_many([ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.1'),
+                     ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.2')])
+        # pretend the RRset was cached 100 seconds ago
+        with db._connection() as conn:
+            conn.execute("UPDATE Cache SET ttd = ttd - 100")
+        if memory_cache is not None:
+            memory_cache.invalidate('www.google.com', 1, 1)
+
+        for _ in range(2):
+            rrset = db.query_rrset('www.google.com', 1, 1)
+            assert [rr.rdata for rr in rrset] == ['127.0.0.1', '127.0.0.2']
+            assert all(199 <= rr.ttl <= 200 for rr in rrset)
+        db.close()
+
+
+def test_database_negative_answers(tmp_path):
+    from MemoryCache import MemoryCache
+
+    db = Database(str(tmp_path / 'negative.db'), memory_cache=MemoryCache())
+    db.add_negative('nx.google.com', 1, 1, 3, 60)
+
+    assert db.query_rrset('nx.google.com', 1, 1) == []
+    assert db.query_negative('nx.google.com', 1, 1)[0] == 3
+    assert Database(str(tmp_path / 'negative.db')).query_negative('nx.google.com', 1, 1)[0] == 3
+    assert db.stats['negative_hits'] == 1
+
+    # a positive answer replaces the negative one
+    db.add_many([ResourceRecord('nx.google.com', 1, 1, 60, '127.0.0.1')])
+
+    assert db.query_negative('nx.google.com', 1, 1) is None
+    assert db.query_rrset('nx.google.com', 1, 1)[0].rdata == '127.0.0.1'
+    db.close()
+
+
+def test_database_snapshot_warm_start(tmp_path):
+    from MemoryCache import MemoryCache
+
+    db = Database(str(tmp_path / 'cold.db'))
+    db.add_many([ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.1'),
+                 ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.2'),
+                 ResourceRecord('expired.google.com', 1, 1, 300, '127.0.0.3')])
+    db.add_negative('nx.google.com', 1, 1, 3, 60)
+    with db._connection() as conn:
+        conn.execute("UPDATE Cache SET ttd = 1 WHERE domain = 'expired.google.com'")
+
+    assert db.save_snapshot(str(tmp_path / 'cache.snapshot')) == 3
+    db.close()
+
+    warm = Database(str(tmp_path / 'warm.db'), memory_cache=MemoryCache())
+
+    assert warm.load_snapshot(str(tmp_path / 'cache.snapshot')) == 3
+    assert [rr.rdata for rr in warm.query_rrset('www.google.com', 1, 1)] == ['127.0.0.1', '127.0.0.2']
+    assert warm.query_rrset('expired.google.com', 1, 1) == []
+    assert warm.query_negative('nx.google.com', 1, 1)[0] == 3
+    assert warm.stats['time_to_first_hit'] is not None
+    warm.close()
+
+
+BACKENDS = ('sqlite', 'memory', 'mmap')
+
+
+def _open_store(tmp_path, backend, name='store', memory_cache=None):
+    from CacheStore import create_store
+    return create_store(str(tmp_path / name), backend, memory_cache=memory_cache)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_store_upserts_and_replaces_rrsets(tmp_path, backend):
+    db = _open_store(tmp_path, backend)
+    rr = ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.1')
+    db.add_to_database(rr)
+    db.add_to_database(rr)
+    db.add_to_database(ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.2'))
+
+    assert [r.rdata for r in db.query_rrset('www.google.com', 1, 1)] == ['127.0.0.1', '127.0.0.2']
+
+    db.add_many([ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.3'),
+                 ResourceRecord('mail.google.com', 1, 1, 100, '127.0.0.4')])
+
+    assert [r.rdata for r in db.query_rrset('www.google.com', 1, 1)] == ['127.0.0.3']
+    assert db.query_from_database('mail.google.com', 1, 1).rdata == '127.0.0.4'
+    assert db.query_from_database('www.google.com', 28, 1) is None
+    db.close()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_store_negative_answers(tmp_path, backend):
+    from MemoryCache import MemoryCache
+
+    db = _open_store(tmp_path, backend, memory_cache=MemoryCache())
+    db.add_many([ResourceRecord('nx.google.com', 1, 1, 60, '127.0.0.1')])
+    db.add_negative('nx.google.com', 1, 1, 3, 60)
+
+    assert db.query_rrset('nx.google.com', 1, 1) == []
+    assert db.query_negative('nx.google.com', 1, 1)[0] == 3
+
+    db.add_many([ResourceRecord('nx.google.com', 1, 1, 60, '127.0.0.1')])
+
+    assert db.query_negative('nx.google.com', 1, 1) is None
+    assert db.query_rrset('nx.google.com', 1, 1)[0].rdata == '127.0.0.1'
+    db.close()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_store_sweep_purges_expired_records(tmp_path, backend, monkeypatch):
+    import CacheStore
+    import MmapStore
+
+    db = _open_store(tmp_path, backend)
+    db.add_many([ResourceRecord(f'old{i}.google.com', 1, 1, 1, '127.0.0.2') for i in range(25)])
+    db.add_negative('nx.google.com', 1, 1, 3, 1)
+    db.add_many([ResourceRecord('live.google.com', 1, 1, 100, '127.0.0.1')])
+
+    # move the clock past the expiry of the short-lived records
+    later = time() + 10
+    monkeypatch.setattr(CacheStore, 'time', lambda: later)
+    monkeypatch.setattr(MmapStore, 'time', lambda: later)
+
+    assert db.query_from_database('old0.google.com', 1, 1) is None
+    assert db.sweep(batch_size=10)[0] == 26
+    assert db.query_from_database('live.google.com', 1, 1) is not None
+    db.close()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_store_snapshot_warm_start(tmp_path, backend):
+    from MemoryCache import MemoryCache
+
+    db = _open_store(tmp_path, backend, name='cold')
+    db.add_many([ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.1'),
+                 ResourceRecord('www.google.com', 1, 1, 300, '127.0.0.2')])
+    db.add_negative('nx.google.com', 1, 1, 3, 60)
+
+    assert db.save_snapshot(str(tmp_path / 'cache.snapshot')) == 3
+    db.close()
+
+    warm = _open_store(tmp_path, backend, name='warm', memory_cache=MemoryCache())
+
+    assert warm.load_snapshot(str(tmp_path / 'cache.snapshot')) == 3
+    assert [rr.rdata for rr in warm.query_rrset('www.google.com', 1, 1)] == ['127.0.0.1', '127.0.0.2']
+    assert warm.query_negative('nx.google.com', 1, 1)[0] == 3
+    warm.close()
+
+
+def test_mmap_store_shared_between_processes(tmp_path):
+    import multiprocessing
+    from MmapStore import MmapStore
+
+    path = str(tmp_path / 'shared.mmap')
+    MmapStore(path, slots=1024, stripes=8).close()
+
+    def writer(first):
+        store = MmapStore(path, slots=1024, stripes=8)
+        for i in range(first, first + 200):
+            store.add_many([ResourceRecord(f'host{i}.google.com', 1, 1, 60, f'10.0.{i // 256}.{i % 256}')])
+        # readers never see a half-written RRset while the other process rewrites its own
+        for _ in range(200):
+            rrset = store.query_rrset('host0.google.com', 1, 1)
+            assert rrset == [] or rrset[0].rdata == '10.0.0.0'
+        store.close()
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=writer, args=(first,)) for first in (0, 200)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    store = MmapStore(path, slots=1024, stripes=8)
+    assert all(store.query_from_database(f'host{i}.google.com', 1, 1).rdata == f'10.0.{i // 256}.{i % 256}'
+               for i in range(400))
+    store.close()
+
+
+def test_mmap_store_keeps_files_of_other_layouts(tmp_path):
+    from MmapStore import MmapStore
+
+    path = str(tmp_path / 'shared.mmap')
+    store = MmapStore(path, slots=1024, stripes=8)
+    store.add_many([ResourceRecord('www.google.com', 1, 1, 60, '127.0.0.1')])
+    # another layout raises instead of wiping the table the first store is serving from
+    with pytest.raises(Exception):
+        MmapStore(path, slots=2048, stripes=8)
+    assert store.query_from_database('www.google.com', 1, 1).rdata == '127.0.0.1'
+
+    # a slot left half-written by a dead process is still found, so its key is not stored twice
+    used = [slot for slot in range(1024) if store._parse_header(store._read_slot(slot))[0] == store.USED]
+    slot = used[0]
+    offset = store._offset(slot)
+    store._map[offset:offset + 4] = (store.VERSION.unpack_from(store._map, offset)[0] + 1).to_bytes(4, 'little')
+    store.add_to_database(ResourceRecord('www.google.com', 1, 1, 60, '127.0.0.2'))
+    assert [slot for slot in range(1024) if store._parse_header(store._read_slot(slot))[0] == store.USED] == used
+    assert [rr.rdata for rr in store.query_rrset('www.google.com', 1, 1)] == ['127.0.0.1', '127.0.0.2']
+    store.close()
+
+
+def test_mmap_stores_do_not_keep_a_memory_tier(tmp_path):
+    from MemoryCache import MemoryCache
+
+    first = _open_store(tmp_path, 'mmap', memory_cache=MemoryCache())
+    second = _open_store(tmp_path, 'mmap', memory_cache=MemoryCache())
+    first.add_many([ResourceRecord('www.google.com', 1, 1, 60, '127.0.0.1')])
+    assert first.query_from_database('www.google.com', 1, 1).rdata == '127.0.0.1'
+    # the first store sees the RRset the second one replaced at once
+    second.add_many([ResourceRecord('www.google.com', 1, 1, 60, '127.0.0.2')])
+    assert first.query_from_database('www.google.com', 1, 1).rdata == '127.0.0.2'
+    second.add_negative('www.google.com', 1, 1, 3, 60)
+    assert first.query_from_database('www.google.com', 1, 1) is None
+    first.close()
+    second.close()
+
+
+def test_mmap_stores_of_one_process_share_the_file_locks(tmp_path):
+    import fcntl
+    import multiprocessing
+    import os
+    from MmapStore import MmapStore
+
+    path = str(tmp_path / 'shared.mmap')
+    first = MmapStore(path, slots=1024, stripes=8)
+    second = MmapStore(path, slots=1024, stripes=8)
+
+    def try_lock(stripe):
+        # another process must not get the lock of a stripe held by this one
+        fd = os.open(path, os.O_RDWR)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 1 + stripe)
+        except OSError:
+            os._exit(0)
+        os._exit(1)
+
+    context = multiprocessing.get_context('fork')
+    with first._locked(3):
+        # the threads of the second store wait for the stripe too
+        assert not second._stripe_locks[3].acquire(blocking=False)
+        # closing the second store keeps the lock held through the first one
+        second.close()
+        process = context.Process(target=try_lock, args=(3,))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+
+    first.add_many([ResourceRecord('www.google.com', 1, 1, 60, '127.0.0.1')])
+    assert first.query_from_database('www.google.com', 1, 1).rdata == '127.0.0.1'
+    first.close()
@@ -12,7 +12,7 @@ from AES import AESCipher
 
 class NS(NameServer):
     def __init__(self):
-        self.database = Database('testNS.db')
+        super().__init__(worker_index=1, database=Database('testNS.db'))
 
     def start_listening_tcp(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -119,6 +119,7 @@ class RS(Resolver):
 
         Configurator.OTHERS.append(dict(ip='127.0.0.1', udp=5252, tcp=5353))
         self.this_ns_idx = 0
+        self.prefetcher = None
 
     def _use_tcp(self, message: str) -> str:
         """
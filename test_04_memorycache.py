@@ -0,0 +1,101 @@
+from Database import Database
+from MemoryCache import MemoryCache
+from ResourceRecord import ResourceRecord
+from time import time
+
+
+def test_memory_cache_honors_ttd():
+    cache = MemoryCache()
+    rr = ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.1')
+    cache.put('www.google.com', 1, 1, rr, int(time()) + 100)
+    cache.put('expired.google.com', 1, 1, rr, int(time()) - 1)
+
+    assert cache.get('www.google.com', 1, 1)[0] == rr
+    assert cache.get('expired.google.com', 1, 1) is None
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    ttd = int(time()) + 100
+    for name in ('a.google.com', 'b.google.com'):
+        cache.put(name, 1, 1, ResourceRecord(name, 1, 1, 100, '127.0.0.1'), ttd)
+    cache.get('a.google.com', 1, 1)
+    cache.put('c.google.com', 1, 1, ResourceRecord('c.google.com', 1, 1, 100, '127.0.0.1'), ttd)
+
+    assert cache.get('a.google.com', 1, 1) is not None
+    assert cache.get('b.google.com', 1, 1) is None
+    assert cache.stats['evictions'] == 1
+
+
+def test_memory_cache_byte_budget():
+    cache = MemoryCache(max_bytes=3 * MemoryCache.ENTRY_OVERHEAD)
+    ttd = int(time()) + 100
+    for i in range(10):
+        name = f'host{i}.google.com'
+        cache.put(name, 1, 1, ResourceRecord(name, 1, 1, 100, '127.0.0.1'), ttd)
+
+    assert cache.size <= 3 * MemoryCache.ENTRY_OVERHEAD
+    assert len(cache) < 3
+
+
+def test_database_hit_served_from_memory(tmp_path):
+    cache = MemoryCache()
+    db = Database(str(tmp_path / 'tiered.db'), memory_cache=cache)
+    rr = ResourceRecord('www.google.com', 1, 1, 100, '127.0.0.1')
+    db.add_many([rr])
+    db.close()
+
+    # a hit must not need SQLite, so it still works once the connections are gone
+    db._connection = None
+    assert db.query_from_database('www.google.com', 1, 1) == rr
+    assert cache.stats['hits'] == 1
+
+    # write-through: a new Database on the same file sees the record
+    assert Database(str(tmp_path / 'tiered.db')).query_from_database('www.google.com', 1, 1) == rr
+
+
+def test_memory_cache_lfu_keeps_frequent_names():
+    cache = MemoryCache(max_entries=2, policy='lfu')
+    ttd = int(time()) + 100
+    for name in ('a.google.com', 'b.google.com'):
+        cache.put(name, 1, 1, 1, ttd)
+    cache.get('a.google.com', 1, 1)
+    cache.get('a.google.com', 1, 1)
+    cache.get('b.google.com', 1, 1)
+    cache.put('c.google.com', 1, 1, 1, ttd)
+
+    assert cache.get('a.google.com', 1, 1) is not None
+    assert cache.get('b.google.com', 1, 1) is None
+
+
+def test_memory_cache_arc_resists_scans():
+    cache = MemoryCache(max_entries=10, policy='arc')
+    ttd = int(time()) + 100
+    hot = [f'hot{i}.google.com' for i in range(5)]
+    for name in hot:
+        cache.put(name, 1, 1, 1, ttd)
+        cache.get(name, 1, 1)
+    for i in range(100):
+        cache.put(f'scan{i}.google.com', 1, 1, 1, ttd)
+
+    assert all(cache.get(name, 1, 1) is not None for name in hot)
+    assert len(cache) == 10
+
+
+def test_memory_cache_admission_rejects_one_hit_names():
+    for policy in MemoryCache.POLICIES:
+        cache = MemoryCache(max_entries=10, policy=policy, admission=True)
+        ttd = int(time()) + 100
+        hot = [f'hot{i}.google.com' for i in range(10)]
+        for _ in range(5):
+            for name in hot:
+                if cache.get(name, 1, 1) is None:
+                    cache.put(name, 1, 1, 1, ttd)
+        for i in range(1000):
+            name = f'random{i}.google.com'
+            if cache.get(name, 1, 1) is None:
+                cache.put(name, 1, 1, 1, ttd)
+
+        assert all(cache.get(name, 1, 1) is not None for name in hot), policy
+        assert cache.stats['rejected'] == 1000
+        assert cache.stats['evictions'] == 0
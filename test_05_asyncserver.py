@@ -0,0 +1,93 @@
+import asyncio
+import socket
+from NameServer import NameServer
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from ParseString import parse_string_msg
+from AES import AESCipher
+from Framing import frame, read_frame
+
+
+class NS(NameServer):
+    def __init__(self, path):
+        super().__init__(worker_index=1, database=Database(path))
+        self.upstream_calls = 0
+
+    async def query_out_async(self, message_query: Message):
+        # stand-in for a slow external DNS server
+        self.upstream_calls += 1
+        await asyncio.sleep(0.2)
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 60, '127.0.0.9'))
+        return result
+
+
+def _query(name):
+    message = Message(header=MessageHeader(), question=MessageQuestion(name, 1, 1))
+    return AESCipher().encrypt(message.to_string())
+
+
+def test_async_udp_queries_do_not_block_each_other(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+    ns.database.add_many([ResourceRecord('cached.google.com.', 1, 1, 60, '127.0.0.1')])
+
+    async def run():
+        transport, server = await ns.start_async_servers('127.0.0.1', 0, 0)
+        address = transport.get_extra_info('sockname')
+        loop = asyncio.get_running_loop()
+        clients = []
+        try:
+            for name in ['slow1.google.com', 'slow2.google.com', 'cached.google.com']:
+                client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                client.setblocking(False)
+                client.sendto(_query(name), address)
+                clients.append(client)
+
+            start = loop.time()
+            responses = []
+            for client in reversed(clients):
+                data = await asyncio.wait_for(loop.sock_recv(client, 4096), 2)
+                responses.append((loop.time() - start, parse_string_msg(AESCipher().decrypt(data))))
+            return responses
+        finally:
+            for client in clients:
+                client.close()
+            transport.close()
+            server.close()
+            await server.wait_closed()
+
+    responses = asyncio.run(run())
+
+    # the cached answer is not held back by the two slow ones in flight before it
+    assert responses[0][0] < 0.15
+    assert responses[0][1].answers[0].rdata == '127.0.0.1'
+    assert all(response.answers[0].rdata == '127.0.0.9' for _, response in responses[1:])
+    assert ns.upstream_calls == 2
+    ns.database.close()
+
+
+def test_async_tcp_query(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+    ns.database.add_many([ResourceRecord('www.google.com.', 1, 1, 60, '127.0.0.1')])
+
+    async def run():
+        transport, server = await ns.start_async_servers('127.0.0.1', 0, 0)
+        address = server.sockets[0].getsockname()
+        try:
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(frame(_query('www.google.com')))
+            await writer.drain()
+            data = await asyncio.wait_for(read_frame(reader), 2)
+            writer.close()
+            return parse_string_msg(AESCipher().decrypt(data))
+        finally:
+            transport.close()
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(run()).answers[0].rdata == '127.0.0.1'
+    ns.database.close()
@@ -0,0 +1,54 @@
+import threading
+from time import sleep
+from WorkerPool import WorkerPool
+
+
+def _blocked_pool(**kwargs):
+    release = threading.Event()
+    handled = []
+
+    def handler(item):
+        release.wait(2)
+        handled.append(item)
+
+    pool = WorkerPool(1, 2, handler, **kwargs)
+    pool.submit(0)
+    # wait until the only worker is busy with the first item
+    while pool.stats['started'] == 0:
+        sleep(0.01)
+    return pool, release, handled
+
+
+def test_worker_pool_sheds_new_items_when_full():
+    shed = []
+    pool, release, handled = _blocked_pool(on_shed=shed.append)
+
+    assert pool.submit(1) and pool.submit(2)
+    assert not pool.submit(3)
+    assert shed == [3]
+    assert pool.depth == 2
+
+    release.set()
+    while pool.stats['completed'] < 3:
+        sleep(0.01)
+    stats = pool.stats
+    assert handled == [0, 1, 2]
+    assert stats['shed'] == 1 and stats['max_depth'] == 2
+    assert stats['max_wait'] > 0 and stats['average_wait'] > 0
+    pool.shutdown()
+
+
+def test_worker_pool_drops_oldest_items_when_full():
+    shed = []
+    pool, release, handled = _blocked_pool(drop_oldest=True, on_shed=shed.append)
+
+    for item in (1, 2, 3, 4):
+        assert pool.submit(item)
+    assert shed == [1, 2]
+
+    release.set()
+    while pool.stats['completed'] < 3:
+        sleep(0.01)
+    assert handled == [0, 3, 4]
+    assert pool.stats['shed'] == 2
+    pool.shutdown()
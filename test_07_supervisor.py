@@ -0,0 +1,95 @@
+import os
+import signal
+import socket
+from time import sleep, time
+from NameServer import NameServer
+from Supervisor import Supervisor
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from ParseString import parse_string_msg
+from configurator import Configurator
+from AES import AESCipher
+
+
+class NS(NameServer):
+    PATH = None
+
+    def __init__(self, worker_index=None, counters=None):
+        super().__init__(worker_index, counters, database=Database(NS.PATH))
+
+
+def _free_port(kind):
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _ask(name, port):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(2)
+    message = Message(header=MessageHeader(), question=MessageQuestion(name, 1, 1))
+    client.sendto(AESCipher().encrypt(message.to_string()), ('127.0.0.1', port))
+    try:
+        return parse_string_msg(AESCipher().decrypt(client.recv(4096)))
+    finally:
+        client.close()
+
+
+def test_supervisor_restarts_workers_and_aggregates_counters(tmp_path, monkeypatch):
+    NS.PATH = str(tmp_path / 'ns.db')
+    db = Database(NS.PATH)
+    db.add_many([ResourceRecord('www.google.com.', 1, 1, 60, '127.0.0.1')])
+    db.close()
+
+    monkeypatch.setattr(Configurator, 'IP', '127.0.0.1')
+    monkeypatch.setattr(Configurator, 'UDP_PORT', _free_port(socket.SOCK_DGRAM))
+    monkeypatch.setattr(Configurator, 'TCP_PORT', _free_port(socket.SOCK_STREAM))
+    monkeypatch.setattr(Configurator, 'SERVER_MODE', 'asyncio')
+    monkeypatch.setattr(Configurator, 'REUSE_PORT', False)
+    # the first worker would save snapshots of its cache next to the tracked databases
+    monkeypatch.setattr(Configurator, 'SNAPSHOT_INTERVAL', 0)
+
+    supervisor = Supervisor(2, server_class=NS)
+    supervisor.start()
+    try:
+        sleep(0.5)
+        for _ in range(10):
+            assert _ask('www.google.com', Configurator.UDP_PORT).answers[0].rdata == '127.0.0.1'
+
+        stats = supervisor.stats
+        assert stats['total']['queries'] == 10
+        assert stats['total']['answered'] == 10
+        assert sum(worker['answered'] for worker in stats['workers']) == 10
+
+        pid = supervisor.pids[0]
+        os.kill(pid, signal.SIGKILL)
+        deadline = time() + 2
+        while supervisor.check() == 0 and time() < deadline:
+            sleep(0.05)
+
+        assert supervisor.pids[0] != pid
+        assert supervisor.stats['restarts'] == 1
+        sleep(0.5)
+        assert _ask('www.google.com', Configurator.UDP_PORT).answers[0].rdata == '127.0.0.1'
+        assert supervisor.stats['total']['answered'] == 11
+    finally:
+        supervisor.shutdown()
+
+
+def test_workers_see_the_rrsets_other_workers_replaced(tmp_path, monkeypatch):
+    # the workers open the default store, here in the temporary directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Configurator, 'CACHE_BACKEND', 'sqlite')
+    first, second = NameServer(worker_index=1), NameServer(worker_index=2)
+    first.database.add_many([ResourceRecord('www.google.com.', 1, 1, 60, '127.0.0.1')])
+    assert first.search_record_in_database('www.google.com')[0].rdata == '127.0.0.1'
+
+    second.database.add_many([ResourceRecord('www.google.com.', 1, 1, 60, '127.0.0.2')])
+    assert first.search_record_in_database('www.google.com')[0].rdata == '127.0.0.2'
+    first.database.close()
+    second.database.close()
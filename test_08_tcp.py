@@ -0,0 +1,155 @@
+import socket
+import threading
+from time import sleep, time
+from NameServer import NameServer
+from Resolver import Resolver
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from ParseString import parse_string_msg
+from configurator import Configurator
+from Framing import frame, recv_frame, send_frame
+from AES import AESCipher
+
+
+class NS(NameServer):
+    def __init__(self, path):
+        super().__init__(worker_index=1, database=Database(path))
+        self.database.add_many([ResourceRecord('cached.google.com.', 1, 1, 60, '127.0.0.1')])
+
+    def query_out(self, message_query: Message):
+        # stand-in for a slow external DNS server
+        sleep(0.3)
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 60, '127.0.0.9'))
+        return result
+
+
+def _query(name, message_id):
+    message = Message(header=MessageHeader(id=message_id), question=MessageQuestion(name, 1, 1))
+    return message.to_string()
+
+
+def _serve(ns):
+    server, client = socket.socketpair()
+    threading.Thread(target=ns.serve_tcp_connection, args=(server, 'client'), daemon=True).start()
+    client.settimeout(2)
+    return client
+
+
+def test_tcp_connection_pipelines_queries(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+    client = _serve(ns)
+
+    send_frame(client, AESCipher().encrypt(_query('slow.google.com', 1)))
+    # a frame split over several writes is read whole
+    data = frame(AESCipher().encrypt(_query('cached.google.com', 2)))
+    client.sendall(data[:1])
+    sleep(0.05)
+    client.sendall(data[1:20])
+    sleep(0.05)
+    client.sendall(data[20:])
+
+    responses = [parse_string_msg(AESCipher().decrypt(recv_frame(client))) for _ in range(2)]
+
+    # the cached answer overtakes the slow one on the same connection
+    assert [response.header.id for response in responses] == [2, 1]
+    assert responses[0].answers[0].rdata == '127.0.0.1'
+    assert responses[1].answers[0].rdata == '127.0.0.9'
+    client.close()
+    ns.database.close()
+
+
+def test_tcp_connection_closes_when_idle(tmp_path, monkeypatch):
+    monkeypatch.setattr(Configurator, 'TCP_IDLE_TIMEOUT', 0.2)
+    ns = NS(str(tmp_path / 'ns.db'))
+    client = _serve(ns)
+
+    send_frame(client, AESCipher().encrypt(_query('cached.google.com', 1)))
+    assert recv_frame(client) is not None
+    assert recv_frame(client) is None
+    client.close()
+    ns.database.close()
+
+
+def test_resolver_reuses_tcp_connection(tmp_path, monkeypatch):
+    ns = NS(str(tmp_path / 'ns.db'))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    accepted = []
+
+    def accept():
+        while True:
+            connection, address = listener.accept()
+            accepted.append(address)
+            threading.Thread(target=ns.serve_tcp_connection, args=(connection, address), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    resolver = Resolver.__new__(Resolver)
+    resolver.this_ns_idx = 0
+    resolver._ns_lock = threading.Lock()
+    resolver._tcp_connections = {}
+    resolver._tcp_lock = threading.Lock()
+    monkeypatch.setattr(Configurator, 'OTHERS', [dict(ip='127.0.0.1', udp=0, tcp=listener.getsockname()[1])])
+
+    for message_id in (1, 2, 3):
+        response = parse_string_msg(resolver._use_tcp(_query('cached.google.com', message_id)))
+        assert response.header.id == message_id
+
+    assert len(accepted) == 1
+
+    # a connection closed by the NameServer is reopened
+    resolver._tcp_connections[('127.0.0.1', listener.getsockname()[1])].sock.shutdown(socket.SHUT_RDWR)
+    assert parse_string_msg(resolver._use_tcp(_query('cached.google.com', 4))).header.id == 4
+    assert len(accepted) == 2
+    listener.close()
+    ns.database.close()
+
+
+def test_resolver_pipelines_queries_of_several_threads(tmp_path, monkeypatch):
+    ns = NS(str(tmp_path / 'ns.db'))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    accepted = []
+
+    def accept():
+        while True:
+            connection, address = listener.accept()
+            accepted.append(address)
+            threading.Thread(target=ns.serve_tcp_connection, args=(connection, address), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    resolver = Resolver.__new__(Resolver)
+    resolver.this_ns_idx = 0
+    resolver._ns_lock = threading.Lock()
+    resolver._tcp_connections = {}
+    resolver._tcp_lock = threading.Lock()
+    monkeypatch.setattr(Configurator, 'OTHERS', [dict(ip='127.0.0.1', udp=0, tcp=listener.getsockname()[1])])
+    # open the connection first
+    assert parse_string_msg(resolver._use_tcp(_query('cached.google.com', 1))).header.id == 1
+
+    responses = {}
+
+    def ask(name, message_id):
+        responses[message_id] = (parse_string_msg(resolver._use_tcp(_query(name, message_id))), time())
+
+    start = time()
+    slow = threading.Thread(target=ask, args=('slow.google.com', 2))
+    slow.start()
+    sleep(0.05)
+    ask('cached.google.com', 3)
+    slow.join()
+
+    # the cached answer is not held back by the slow query sent before it on the same connection
+    assert responses[3][0].answers[0].rdata == '127.0.0.1' and responses[3][1] - start < 0.2
+    assert responses[2][0].answers[0].rdata == '127.0.0.9' and responses[2][1] - start >= 0.3
+    assert len(accepted) == 1
+    listener.close()
+    ns.database.close()
@@ -0,0 +1,117 @@
+import asyncio
+import socket
+import threading
+from time import sleep
+import dns.message
+import dns.rcode
+import dns.rrset
+from UpstreamPool import UpstreamPool
+from NameServer import NameServer
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+
+
+class StandInUpstream:
+    def __init__(self, delay: float = 0.0, rcode: int = dns.rcode.NOERROR, silent: bool = False):
+        """A local stand-in for an external DNS server, answering every A query with 127.0.0.9."""
+        self.delay = delay
+        self.rcode = rcode
+        self.silent = silent
+        self.queries = 0
+        self.clients = set()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.queries += 1
+            self.clients.add(address)
+            if self.silent:
+                continue
+            sleep(self.delay)
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            response.set_rcode(self.rcode)
+            if self.rcode == dns.rcode.NOERROR:
+                response.answer.append(dns.rrset.from_text(query.question[0].name, 60, 'IN', 'A', '127.0.0.9'))
+            self.sock.sendto(response.to_wire(), address)
+
+    def get_address(self):
+        return dict(ip='127.0.0.1', port=self.port)
+
+    address = property(get_address)
+
+
+def _query(name='www.google.com'):
+    return dns.message.make_query(name, 'A')
+
+
+def test_pool_prefers_fastest_upstream():
+    slow, fast = StandInUpstream(delay=0.05), StandInUpstream()
+    pool = UpstreamPool([slow.address, fast.address], timeout=1)
+
+    for _ in range(20):
+        assert pool.query(_query()).answer[0][0].to_text() == '127.0.0.9'
+
+    # each upstream is measured, then the fastest gets the queries
+    assert slow.queries < 5
+    assert fast.queries > 15
+    assert pool.stats[0]['srtt'] > pool.stats[1]['srtt']
+    # sockets are reused across queries
+    assert len(fast.clients) == 1
+
+
+def test_pool_fails_over_ejects_and_probes():
+    dead, servfail, live = StandInUpstream(silent=True), StandInUpstream(rcode=dns.rcode.SERVFAIL), StandInUpstream()
+    pool = UpstreamPool([dead.address, servfail.address, live.address], timeout=0.1,
+                        max_failures=1, eject_seconds=0.5)
+
+    for _ in range(4):
+        assert pool.query(_query()).rcode() == dns.rcode.NOERROR
+    stats = pool.stats
+    assert stats[0]['ejected'] and stats[1]['ejected'] and not stats[2]['ejected']
+    queried = dead.queries, servfail.queries
+    pool.query(_query())
+    assert (dead.queries, servfail.queries) == queried
+
+    # once the ejection ends, one query probes an ejected upstream
+    sleep(0.6)
+    pool.query(_query())
+    assert dead.queries + servfail.queries == sum(queried) + 1
+    assert pool.stats[2]['errors'] == 0
+
+
+def test_pool_raises_when_every_upstream_fails():
+    pool = UpstreamPool([StandInUpstream(silent=True).address], timeout=0.1)
+    try:
+        pool.query(_query())
+        assert False
+    except dns.exception.Timeout:
+        pass
+
+
+def test_name_server_forwards_to_pool(tmp_path):
+    upstream, nxdomain = StandInUpstream(), StandInUpstream(rcode=dns.rcode.NXDOMAIN)
+    ns = NameServer(worker_index=1, database=Database(str(tmp_path / 'ns.db')),
+                    upstreams=UpstreamPool([upstream.address], timeout=1))
+
+    result = ns.query_out(Message(header=MessageHeader(), question=MessageQuestion('www.google.com', 1, 1)))
+    assert result.answers[0].rdata == '127.0.0.9'
+    assert ns.search_record_in_database('www.google.com.')[0].rdata == '127.0.0.9'
+
+    result = asyncio.run(ns.query_out_async(Message(header=MessageHeader(), question=MessageQuestion('mail.google.com', 1, 1))))
+    assert result.answers[0].rdata == '127.0.0.9'
+
+    ns.upstreams = UpstreamPool([nxdomain.address], timeout=1)
+    result = ns.query_out(Message(header=MessageHeader(), question=MessageQuestion('nothing.google.com', 1, 1)))
+    assert result.header.rcode == 3
+    assert ns.search_negative_in_database('nothing.google.com.')[0] == 3
+    ns.database.close()
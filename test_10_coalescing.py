@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from time import sleep
+from NameServer import NameServer
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+
+
+class NS(NameServer):
+    def __init__(self, path):
+        super().__init__(worker_index=1, database=Database(path))
+        self.upstream_calls = 0
+        self.error = None
+
+    def _answer(self, message_query: Message):
+        self.upstream_calls += 1
+        if self.error is not None:
+            raise self.error
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 60, '127.0.0.9'))
+        return result
+
+    def query_out(self, message_query: Message):
+        # stand-in for a slow external DNS server
+        sleep(0.2)
+        return self._answer(message_query)
+
+    async def query_out_async(self, message_query: Message):
+        await asyncio.sleep(0.2)
+        return self._answer(message_query)
+
+
+def _query(name, message_id):
+    return Message(header=MessageHeader(id=message_id), question=MessageQuestion(name, 1, 1))
+
+
+def _resolve_concurrently(ns, queries):
+    results = [None] * len(queries)
+
+    def resolve(i):
+        try:
+            results[i] = ns.recursive_query(queries[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=resolve, args=(i,)) for i in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_share_one_upstream_query(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+    queries = [_query('www.google.com', i) for i in range(10)] + [_query('mail.google.com', 10)]
+
+    results = _resolve_concurrently(ns, queries)
+
+    assert ns.upstream_calls == 2
+    # every waiter gets the answer under the ID of its own query
+    assert [result.header.id for result in results] == list(range(11))
+    assert all(result.answers[0].rdata == '127.0.0.9' for result in results)
+    assert ns.get_coalescing_stats() == dict(leaders=2, coalesced=9, in_flight=0)
+    ns.database.close()
+
+
+def test_upstream_errors_reach_every_waiter(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+    ns.error = TimeoutError('upstream timed out')
+
+    results = _resolve_concurrently(ns, [_query('www.google.com', i) for i in range(5)])
+
+    assert ns.upstream_calls == 1
+    assert all(isinstance(result, TimeoutError) for result in results)
+    # the failed call is not kept, the next miss queries again
+    ns.error = None
+    assert ns.recursive_query(_query('www.google.com', 5)).answers[0].rdata == '127.0.0.9'
+    assert ns.upstream_calls == 2
+    ns.database.close()
+
+
+def test_concurrent_async_misses_share_one_upstream_query(tmp_path):
+    ns = NS(str(tmp_path / 'ns.db'))
+
+    async def resolve():
+        tasks = [asyncio.create_task(ns.recursive_query_async(_query('www.google.com', i))) for i in range(10)]
+        await asyncio.sleep(0.05)
+        # the query that started the upstream call goes away, the others still get the answer
+        tasks[0].cancel()
+        return await asyncio.gather(*tasks[1:])
+
+    results = asyncio.run(resolve())
+
+    assert ns.upstream_calls == 1
+    assert [result.header.id for result in results] == list(range(1, 10))
+    assert ns.get_coalescing_stats()['coalesced'] == 9
+    ns.database.close()
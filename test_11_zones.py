@@ -0,0 +1,125 @@
+import os
+from time import sleep
+from NameServer import NameServer
+from DictStore import DictStore
+from ZoneStore import ZoneStore
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ParseString import parse_string_msg
+import ResponseCache as response_cache_module
+from ResponseCache import ResponseCache
+from WireFormat import encode_message, decode_message
+
+ZONE = """$TTL 300
+@       IN SOA  ns1.corp.example. admin.corp.example. 1 3600 600 86400 60
+@       IN NS   ns1.corp.example.
+ns1     IN A    10.0.0.1
+www     IN A    10.0.0.10
+www     IN A    10.0.0.11
+web     IN CNAME www
+*.apps  IN A    10.0.0.20
+lab     IN NS   ns.lab.corp.example.
+ns.lab  IN A    10.0.1.1
+"""
+
+
+def _zones(tmp_path, text=ZONE):
+    path = tmp_path / 'corp.example.zone'
+    path.write_text(text)
+    return ZoneStore([dict(origin='corp.example.', path=str(path))]), path
+
+
+def _rdata(records):
+    return sorted(record.rdata for record in records)
+
+
+def test_exact_cname_and_negative_lookups(tmp_path):
+    zones, _ = _zones(tmp_path)
+
+    found = zones.lookup('WWW.corp.example', 1)
+    assert found['authoritative'] and found['rcode'] == 0
+    assert _rdata(found['answers']) == ['10.0.0.10', '10.0.0.11']
+
+    found = zones.lookup('web.corp.example.', 1)
+    assert [record.rr_type for record in found['answers']] == [5, 1, 1]
+
+    found = zones.lookup('www.corp.example', 16)
+    assert found['rcode'] == 0 and not found['answers'] and found['authorities'][0].rr_type == 6
+
+    found = zones.lookup('nothing.corp.example', 1)
+    assert found['rcode'] == 3 and found['authorities'][0].rr_type == 6
+
+    assert zones.lookup('www.google.com', 1) is None
+
+
+def test_wildcard_and_delegation_lookups(tmp_path):
+    zones, _ = _zones(tmp_path)
+
+    found = zones.lookup('billing.apps.corp.example', 1)
+    assert found['answers'][0].name == 'billing.apps.corp.example.'
+    assert found['answers'][0].rdata == '10.0.0.20'
+
+    found = zones.lookup('host.lab.corp.example', 1)
+    assert not found['authoritative'] and not found['answers']
+    assert _rdata(found['authorities']) == ['ns.lab.corp.example.']
+    assert _rdata(found['additional']) == ['10.0.1.1']
+
+
+def test_zones_reload_when_changed(tmp_path):
+    zones, path = _zones(tmp_path)
+    assert zones.load() is False
+
+    sleep(0.01)
+    path.write_text(ZONE.replace('10.0.0.10', '10.0.0.12'))
+    assert zones.load() is True
+    assert _rdata(zones.lookup('www.corp.example', 1)['answers']) == ['10.0.0.11', '10.0.0.12']
+
+    # a broken file keeps the last good version of the zone
+    path.write_text('not a zone')
+    os.utime(path, ns=(0, 0))
+    zones.load()
+    assert _rdata(zones.lookup('www.corp.example', 1)['answers']) == ['10.0.0.11', '10.0.0.12']
+    # and is not parsed again until it changes
+    assert zones.load() is False
+    path.write_text(ZONE)
+    os.utime(path, ns=(1, 1))
+    assert zones.load() is True
+    assert _rdata(zones.lookup('www.corp.example', 1)['answers']) == ['10.0.0.10', '10.0.0.11']
+
+
+def test_name_server_answers_authoritatively(tmp_path):
+    ns = NameServer(worker_index=1, database=DictStore('ns'))
+    ns.zones, _ = _zones(tmp_path)
+
+    query = Message(header=MessageHeader(id=7), question=MessageQuestion('www.corp.example', 1, 1))
+    result = ns.recursive_query(query)
+    assert result.header.aa and result.header.id == 7
+    assert _rdata(result.answers) == ['10.0.0.10', '10.0.0.11']
+
+    query = Message(header=MessageHeader(id=8), question=MessageQuestion('nothing.corp.example', 1, 1))
+    result = ns.recursive_query(query)
+    assert result.header.aa and result.header.rcode == 3
+
+    # a referral answers a query not desiring recursion, but not a recursive one
+    query = Message(header=MessageHeader(id=9), question=MessageQuestion('host.lab.corp.example', 1, 1))
+    result = ns.non_recursive_query(query.header, query.question)
+    assert not result.header.aa and _rdata(result.authorities) == ['ns.lab.corp.example.']
+    assert ns.search_record_in_zonefile(query) is None
+
+
+def test_zone_answers_keep_their_ttl_in_the_response_cache(tmp_path, monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(response_cache_module, 'time', lambda: now[0])
+    ns = NameServer(worker_index=1, database=DictStore('ns'))
+    ns.zones, _ = _zones(tmp_path)
+    cache = ResponseCache(10)
+
+    query = Message(header=MessageHeader(id=7), question=MessageQuestion('www.corp.example', 1, 1))
+    result = ns.recursive_query(query)
+    assert cache.put(query.to_string(), result) and cache.put_wire(encode_message(query), result)
+    for _ in range(2):
+        now[0] += 100
+        text = parse_string_msg(cache.get(query.to_string()))
+        wire = decode_message(cache.get_wire(encode_message(query)))
+        assert [record.ttl for record in text.answers + wire.answers] == [300] * 4
@@ -0,0 +1,78 @@
+import ResponseCache as response_cache_module
+from ResponseCache import ResponseCache
+from NameServer import NameServer
+from DictStore import DictStore
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from AES import AESCipher
+
+
+def _query(name, message_id):
+    return Message(header=MessageHeader(id=message_id), question=MessageQuestion(name, 1, 1))
+
+
+def _response(query, ttls=(60, 300)):
+    response = Message(request=query)
+    for i, ttl in enumerate(ttls):
+        response.add_a_new_record_to_answer_section(
+            ResourceRecord(query.question.qname + '.', 1, 1, ttl, f'127.0.0.{i + 1}'))
+    return response
+
+
+def test_cached_response_is_rendered_with_id_and_ttl(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(response_cache_module, 'time', lambda: now[0])
+    cache = ResponseCache(10)
+    query = _query('www.google.com', 1)
+    assert cache.put(query.to_string(), _response(query))
+
+    now[0] += 10
+    other = _query('www.google.com', 4242)
+    # the rendered text is the response to the other query, with the TTLs counted down
+    assert cache.get(other.to_string()) == _response(other, ttls=(50, 290)).to_string()
+
+    now[0] += 50
+    assert cache.get(other.to_string()) is None
+    assert cache.stats['expired'] == 1 and cache.stats['entries'] == 0
+
+
+def test_response_cache_evicts_and_skips_uncacheable():
+    cache = ResponseCache(2)
+    queries = [_query(f'www{i}.google.com', i) for i in range(3)]
+    for query in queries:
+        cache.put(query.to_string(), _response(query))
+    assert cache.get(queries[0].to_string()) is None
+    assert cache.get(queries[2].to_string()) is not None
+    assert cache.stats['evictions'] == 1
+
+    nxdomain = Message(request=queries[0])
+    nxdomain.set_header_flags(rcode=3)
+    assert not cache.put(queries[0].to_string(), nxdomain)
+    assert not cache.put(queries[0].to_string(), _response(queries[0], ttls=(0,)))
+
+    # answers cached for another generation of the zones are not served
+    cache.put(queries[0].to_string(), _response(queries[0]), generation=1)
+    assert cache.get(queries[0].to_string(), generation=2) is None
+
+
+class NS(NameServer):
+    def __init__(self):
+        super().__init__(worker_index=1, database=DictStore('ns'))
+        self.response_cache = ResponseCache(10)
+        self.handled = 0
+
+    def handle_query(self, query_message: Message) -> Message:
+        self.handled += 1
+        return _response(query_message)
+
+
+def test_name_server_answers_hits_from_response_cache():
+    ns = NS()
+    for message_id in (1, 2, 3):
+        data = ns.answer(AESCipher().encrypt(_query('www.google.com', message_id).to_string()))
+        assert AESCipher().decrypt(data) == _response(_query('www.google.com', message_id)).to_string()
+
+    assert ns.handled == 1
+    assert ns.get_response_cache_stats()['hits'] == 2
@@ -0,0 +1,130 @@
+import asyncio
+import socket
+import threading
+import dns.message
+import dns.rdatatype
+import dns.rrset
+from IterativeResolver import IterativeResolver
+from ZoneStore import ZoneStore
+from NameServer import NameServer
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+
+ZONES = {
+    '127.0.0.1': [('.', """$TTL 3600
+@               IN SOA  a.root. admin.root. 1 3600 600 86400 60
+@               IN NS   a.root.
+a.root.         IN A    127.0.0.1
+example.        IN NS   ns.example.
+ns.example.     IN A    127.0.0.2
+""")],
+    '127.0.0.2': [('example.', """$TTL 3600
+@               IN SOA  ns admin 1 3600 600 86400 60
+@               IN NS   ns
+ns              IN A    127.0.0.2
+corp            IN NS   ns.corp
+ns.corp         IN A    127.0.0.3
+lab             IN NS   dns.corp.example.
+other           IN A    10.0.0.99
+""")],
+    '127.0.0.3': [('corp.example.', """$TTL 300
+@               IN SOA  ns admin 1 3600 600 86400 60
+@               IN NS   ns
+ns              IN A    127.0.0.3
+www             IN A    10.0.0.10
+mail            IN A    10.0.0.11
+dns             IN A    127.0.0.3
+alias           IN CNAME other.example.
+"""), ('lab.example.', """$TTL 300
+@               IN SOA  dns.corp.example. admin 1 3600 600 86400 60
+@               IN NS   dns.corp.example.
+""")],
+}
+
+
+class StandInAuthority:
+    def __init__(self, ip, port, zones, tmp_path):
+        """A local stand-in for an authoritative server, answering from a ZoneStore."""
+        files = []
+        for origin, text in zones:
+            path = tmp_path / (origin + 'zone')
+            path.write_text(text)
+            files.append(dict(origin=origin, path=str(path)))
+        self.zones = ZoneStore(files)
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            data, address = self.sock.recvfrom(4096)
+            self.queries += 1
+            query = dns.message.from_wire(data)
+            question = query.question[0]
+            found = self.zones.lookup(question.name.to_text(), question.rdtype)
+            response = dns.message.make_response(query)
+            response.set_rcode(found['rcode'])
+            if found['authoritative']:
+                response.flags |= dns.flags.AA
+            for section, records in ((response.answer, found['answers']),
+                                     (response.authority, found['authorities']),
+                                     (response.additional, found['additional'])):
+                for record in records:
+                    section.append(dns.rrset.from_text(record.name, record.ttl, 'IN',
+                                                       dns.rdatatype.to_text(record.rr_type), record.rdata))
+            self.sock.sendto(response.to_wire(), address)
+
+
+def _tree(tmp_path):
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    servers = {ip: StandInAuthority(ip, port, zones, tmp_path) for ip, zones in ZONES.items()}
+    resolver = IterativeResolver([dict(ip='127.0.0.1', port=port)], port=port, timeout=1)
+    return resolver, servers
+
+
+def _answers(response):
+    return sorted(rdata.to_text() for rrset in response.answer for rdata in rrset)
+
+
+def test_iterative_resolution_walks_and_caches_delegations(tmp_path):
+    resolver, servers = _tree(tmp_path)
+
+    response = resolver.query(dns.message.make_query('www.corp.example.', 'A'))
+    assert _answers(response) == ['10.0.0.10']
+    assert [server.queries for server in servers.values()] == [1, 1, 1]
+
+    # the next name under corp.example goes straight to its name server
+    response = resolver.query(dns.message.make_query('mail.corp.example.', 'A'))
+    assert _answers(response) == ['10.0.0.11']
+    assert [server.queries for server in servers.values()] == [1, 1, 2]
+    assert resolver.stats['delegation_hits'] == 1
+
+    response = resolver.query(dns.message.make_query('nothing.corp.example.', 'A'))
+    assert response.rcode() == dns.rcode.NXDOMAIN
+
+
+def test_iterative_resolution_follows_cnames_and_glueless_delegations(tmp_path):
+    resolver, servers = _tree(tmp_path)
+
+    response = resolver.query(dns.message.make_query('alias.corp.example.', 'A'))
+    assert _answers(response) == ['10.0.0.99', 'other.example.']
+
+    # lab.example is served by dns.corp.example, whose address is not given as glue
+    response = asyncio.run(resolver.query_async(dns.message.make_query('host.lab.example.', 'A')))
+    assert response.rcode() == dns.rcode.NXDOMAIN
+    assert resolver.stats['glueless'] == 1
+
+
+def test_name_server_resolves_iteratively(tmp_path):
+    ns = NameServer(worker_index=1, database=Database(str(tmp_path / 'ns.db')), upstreams=_tree(tmp_path)[0])
+
+    result = ns.query_out(Message(header=MessageHeader(), question=MessageQuestion('www.corp.example', 1, 1)))
+    assert result.answers[0].rdata == '10.0.0.10'
+    assert ns.search_record_in_database('www.corp.example.')[0].rdata == '10.0.0.10'
+    ns.database.close()
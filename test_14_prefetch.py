@@ -0,0 +1,123 @@
+import threading
+from time import sleep
+import CacheStore
+from Prefetcher import Prefetcher
+from NameServer import NameServer
+from Database import Database
+from MemoryCache import MemoryCache
+from Message import Message
+from ResourceRecord import ResourceRecord
+
+
+def test_only_hot_entries_near_expiry_are_refreshed():
+    refreshed = []
+    prefetcher = Prefetcher(lambda key: refreshed.append(key), window=0.2, min_hits=3, jitter=0)
+
+    # not hot yet, then hot but not near expiry
+    assert not prefetcher.hit(('a.', 1, 1), 10, 100)
+    assert not prefetcher.hit(('a.', 1, 1), 10, 100)
+    assert not prefetcher.hit(('a.', 1, 1), 50, 100)
+    assert prefetcher.hit(('a.', 1, 1), 20, 100)
+    sleep(0.1)
+    assert refreshed == [('a.', 1, 1)]
+    # the refreshed entry counts its hits again
+    assert not prefetcher.hit(('a.', 1, 1), 10, 100)
+    assert prefetcher.stats['failures'] == 1
+
+
+def test_refreshes_are_jittered_and_capped():
+    release = threading.Event()
+    prefetcher = Prefetcher(lambda key: release.wait(), window=0.2, min_hits=1, jitter=0.5, max_in_flight=2)
+
+    # the window of an entry is between 10 and 20 percent of its TTL
+    assert not prefetcher.hit(('a.', 1, 1), 21, 100)
+    assert prefetcher.hit(('b.', 1, 1), 10, 100)
+    assert prefetcher.hit(('c.', 1, 1), 10, 100)
+    assert not prefetcher.hit(('d.', 1, 1), 10, 100)
+    assert not prefetcher.hit(('b.', 1, 1), 10, 100)
+    assert prefetcher.stats['capped'] == 1 and prefetcher.in_flight == 2
+    release.set()
+
+
+class NS(NameServer):
+    def __init__(self, path):
+        super().__init__(worker_index=1, database=Database(path, memory_cache=MemoryCache()))
+        self.prefetcher = Prefetcher(self.refresh_record, window=0.2, min_hits=2, jitter=0)
+        self.upstream_calls = 0
+
+    def query_out(self, message_query: Message):
+        self.upstream_calls += 1
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 100, '127.0.0.2'))
+        self.save_to_database(result)
+        return result
+
+
+def test_name_server_refreshes_hot_records_before_expiry(tmp_path, monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(CacheStore, 'time', lambda: now[0])
+    ns = NS(str(tmp_path / 'ns.db'))
+    ns.database.add_many([ResourceRecord('www.google.com.', 1, 1, 100, '127.0.0.1')])
+
+    assert ns.search_record_in_database('www.google.com')[0].rdata == '127.0.0.1'
+    now[0] += 85
+    assert ns.search_record_in_database('www.google.com')[0].rdata == '127.0.0.1'
+    sleep(0.1)
+
+    # the RRset was replaced before it expired
+    assert ns.upstream_calls == 1
+    record = ns.search_record_in_database('www.google.com')[0]
+    assert record.rdata == '127.0.0.2' and record.ttl == 100
+    assert ns.get_prefetch_stats()['refreshes'] == 1
+    ns.database.close()
+
+
+class UpstreamNS(NameServer):
+    upstream_calls = 0
+
+    def query_out(self, message_query: Message):
+        self.upstream_calls += 1
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 100, f'127.0.0.{self.upstream_calls}'))
+        self.save_to_database(result)
+        return result
+
+
+def test_hot_names_answered_from_the_response_cache_are_refreshed(monkeypatch):
+    import ResponseCache
+    from AES import AESCipher
+    from MessageHeader import MessageHeader
+    from MessageQuestion import MessageQuestion
+    from ParseString import parse_string_msg
+    from configurator import Configurator
+
+    now = [1000]
+    monkeypatch.setattr(CacheStore, 'time', lambda: now[0])
+    monkeypatch.setattr(ResponseCache, 'time', lambda: now[0])
+    monkeypatch.setattr(Configurator, 'CACHE_BACKEND', 'memory')
+    monkeypatch.setattr(Configurator, 'PREFETCH_WINDOW', 0.2)
+    monkeypatch.setattr(Configurator, 'PREFETCH_MIN_HITS', 2)
+    monkeypatch.setattr(Configurator, 'PREFETCH_JITTER', 0)
+    ns = UpstreamNS(worker_index=1)
+
+    def ask():
+        query = Message(header=MessageHeader(), question=MessageQuestion('www.google.com', 1, 1))
+        return parse_string_msg(AESCipher().decrypt(ns.answer(AESCipher().encrypt(query.to_string()))))
+
+    assert ask().answers[0].rdata == '127.0.0.1'
+    for _ in range(50):
+        now[0] += 1
+        assert ask().answers[0].rdata == '127.0.0.1'
+    assert ns.get_response_cache_stats()['hits'] == 50
+
+    # in the last 20 seconds of the TTL, the hits reach the prefetcher, which refreshes the RRset
+    now[0] += 30
+    assert ask().answers[0].ttl == 20
+    ask()
+    sleep(0.1)
+    assert ns.upstream_calls == 2 and ns.get_prefetch_stats()['refreshes'] == 1
+    answer = ask().answers[0]
+    assert answer.rdata == '127.0.0.2' and answer.ttl == 100
+    ns.database.close()
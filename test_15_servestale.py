@@ -0,0 +1,169 @@
+import asyncio
+from time import sleep, perf_counter, time
+import CacheStore
+from NameServer import NameServer
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from configurator import Configurator
+
+
+def test_expired_records_are_kept_for_the_grace_window(tmp_path, monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(CacheStore, 'time', lambda: now[0])
+    database = Database(str(tmp_path / 'stale.db'))
+    database.keep_stale(60)
+    database.add_many([ResourceRecord('www.google.com.', 1, 1, 10, '127.0.0.1')])
+
+    now[0] += 30
+    database.sweep()
+    assert database.query_rrset('www.google.com.') == []
+    stale = database.query_stale_rrset('www.google.com.')
+    assert [(record.rdata, record.ttl) for record in stale] == [('127.0.0.1', 10)]
+
+    now[0] += 60
+    assert database.sweep()[0] == 1
+    assert database.query_stale_rrset('www.google.com.') == []
+    database.close()
+
+
+def test_mmap_slots_of_stale_records_are_not_reused(tmp_path, monkeypatch):
+    import MmapStore
+    now = [1000]
+    monkeypatch.setattr(CacheStore, 'time', lambda: now[0])
+    monkeypatch.setattr(MmapStore, 'time', lambda: now[0])
+    store = MmapStore.MmapStore(str(tmp_path / 'stale.mmap'), slots=2, stripes=1)
+    store.keep_stale(60)
+    # two names whose keys start probing at the same slot
+    home = next(store._probe(('www.google.com.', 1, 1)))
+    other, third = [f'{i}.google.com.' for i in range(100) if next(store._probe((f'{i}.google.com.', 1, 1))) == home][:2]
+    store.add_many([ResourceRecord('www.google.com.', 1, 1, 10, '127.0.0.1')])
+
+    now[0] += 30
+    store.add_many([ResourceRecord(other, 1, 1, 10, '127.0.0.2')])
+    assert [record.rdata for record in store.query_stale_rrset('www.google.com.')] == ['127.0.0.1']
+    assert store.query_rrset(other)[0].rdata == '127.0.0.2'
+
+    # past the grace window, both slots are free again
+    now[0] += 60
+    store.add_many([ResourceRecord(third, 1, 1, 10, '127.0.0.3')])
+    assert store.query_rrset(third)[0].rdata == '127.0.0.3'
+    assert store.query_stale_rrset('www.google.com.') == []
+    store.close()
+
+
+class NS(NameServer):
+    def __init__(self, path, delay, fail=False):
+        super().__init__(worker_index=1, database=Database(path))
+        self.delay = delay
+        self.fail = fail
+        self.queries_out = 0
+
+    def _answer(self, message_query: Message):
+        if self.fail:
+            return None
+        result = Message(request=message_query)
+        result.add_a_new_record_to_answer_section(
+            ResourceRecord(message_query.question.qname + '.', 1, 1, 300, '127.0.0.2'))
+        self.save_to_database(result)
+        return result
+
+    def query_out(self, message_query: Message):
+        # stand-in for a slow external DNS server
+        self.queries_out += 1
+        sleep(self.delay)
+        return self._answer(message_query)
+
+    async def query_out_async(self, message_query: Message):
+        await asyncio.sleep(self.delay)
+        return self._answer(message_query)
+
+
+def _query(name='www.google.com'):
+    return Message(header=MessageHeader(id=5), question=MessageQuestion(name, 1, 1))
+
+
+def _expired_ns(tmp_path, monkeypatch, delay, fail=False, names=('www.google.com',)):
+    monkeypatch.setattr(Configurator, 'SERVE_STALE', True)
+    monkeypatch.setattr(Configurator, 'STALE_LATENCY_BUDGET', 0.1)
+    ns = NS(str(tmp_path / 'ns.db'), delay, fail)
+    for name in names:
+        ns.database.add_many([ResourceRecord(name + '.', 1, 1, 1, '127.0.0.1')])
+    # the records expired a few seconds ago
+    monkeypatch.setattr(CacheStore, 'time', lambda: time() + 5)
+    return ns
+
+
+def test_slow_upstream_is_masked_by_stale_answer(tmp_path, monkeypatch):
+    ns = _expired_ns(tmp_path, monkeypatch, delay=0.5)
+
+    start = perf_counter()
+    result = ns.recursive_query(_query())
+    assert perf_counter() - start < 0.4
+    assert result.stale and result.header.id == 5
+    assert [(record.rdata, record.ttl) for record in result.answers] == [('127.0.0.1', Configurator.STALE_ANSWER_TTL)]
+
+    # the refresh completes in the background
+    sleep(0.6)
+    assert ns.search_record_in_database('www.google.com')[0].rdata == '127.0.0.2'
+
+    # names without a stale record wait for the external DNS servers
+    result = ns.recursive_query(_query('mail.google.com'))
+    assert not result.stale and result.answers[0].rdata == '127.0.0.2'
+    ns.database.close()
+
+
+def test_failing_upstream_is_masked_by_stale_answer(tmp_path, monkeypatch):
+    ns = _expired_ns(tmp_path, monkeypatch, delay=0, fail=True)
+
+    start = perf_counter()
+    result = ns.recursive_query(_query())
+    assert perf_counter() - start < 0.1
+    assert result.stale and result.answers[0].rdata == '127.0.0.1'
+
+    result = asyncio.run(ns.recursive_query_async(_query()))
+    assert result.stale and result.answers[0].rdata == '127.0.0.1'
+    ns.database.close()
+
+
+def test_slow_upstream_is_masked_by_stale_answer_async(tmp_path, monkeypatch):
+    ns = _expired_ns(tmp_path, monkeypatch, delay=0.3)
+
+    async def resolve():
+        result = await ns.recursive_query_async(_query())
+        await asyncio.sleep(0.4)
+        return result
+
+    result = asyncio.run(resolve())
+    assert result.stale and result.answers[0].rdata == '127.0.0.1'
+    assert ns.search_record_in_database('www.google.com')[0].rdata == '127.0.0.2'
+    ns.database.close()
+
+
+def test_stale_answers_share_one_bounded_refresh(tmp_path, monkeypatch):
+    import threading
+    monkeypatch.setattr(Configurator, 'STALE_REFRESH_THREADS', 1)
+    monkeypatch.setattr(Configurator, 'STALE_REFRESH_QUEUE_SIZE', 1)
+    names = ('www.google.com', 'a.google.com', 'b.google.com', 'c.google.com')
+    ns = _expired_ns(tmp_path, monkeypatch, delay=0.5, names=names)
+    threads = threading.active_count()
+
+    results = []
+    clients = [threading.Thread(target=lambda: results.append(ns.recursive_query(_query()))) for _ in range(8)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    assert len(results) == 8 and all(result.stale for result in results)
+    # the stale answers of one name wait for a single external query
+    assert ns.queries_out == 1
+
+    # the refresh of another name waits for the refresh thread, the ones beyond the queue are dropped
+    for name in names[1:]:
+        assert ns.recursive_query(_query(name)).stale
+    assert threading.active_count() == threads
+    sleep(1.2)
+    assert ns.queries_out == 2
+    ns.database.close()
@@ -0,0 +1,169 @@
+import dns.message
+import dns.rrset
+import pytest
+import ResponseCache as response_cache_module
+from ResponseCache import ResponseCache
+from NameServer import NameServer
+from DictStore import DictStore
+from configurator import Configurator
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from WireFormat import encode_message, decode_message, encode_name, decode_name, WireFormatError
+
+
+def _response():
+    query = dns.message.make_query('www.example.com', 'AAAA')
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text('www.example.com.', 300, 'IN', 'CNAME', 'web.example.com.'))
+    response.answer.append(dns.rrset.from_text('web.example.com.', 300, 'IN', 'AAAA', '2001:db8::1'))
+    response.authority.append(dns.rrset.from_text(
+        'example.com.', 300, 'IN', 'SOA', 'ns1.example.com. hostmaster.example.com. 1 7200 900 1209600 300'))
+    response.additional.append(dns.rrset.from_text('example.com.', 300, 'IN', 'TXT', '"hello world" "a\\"b"'))
+    response.additional.append(dns.rrset.from_text('example.com.', 300, 'IN', 'MX', '10 mail.example.com.'))
+    response.additional.append(dns.rrset.from_text('example.com.', 300, 'IN', 'SRV', '1 2 3 sip.example.com.'))
+    return response
+
+
+def test_wire_format_round_trips_with_dnspython():
+    response = _response()
+    message = decode_message(response.to_wire())
+    assert message.header.id == response.id and message.header.qr == 1
+    assert message.question.qname == 'www.example.com' and message.question.qtype == 28
+    assert [record.rdata for record in message.answers] == ['web.example.com.', '2001:db8::1']
+    assert message.additional[0].rdata == '"hello world" "a\\"b"'
+
+    # the encoding is read back by dnspython as the same message, and compressed as much
+    data = encode_message(message)
+    assert dns.message.from_wire(data) == response
+    assert len(data) == len(response.to_wire())
+
+
+def test_names_are_compressed():
+    query = Message(header=MessageHeader(id=1), question=MessageQuestion('www.example.com', 1, 1))
+    response = Message(request=query)
+    for i in range(10):
+        response.add_a_new_record_to_answer_section(ResourceRecord('www.example.com.', 1, 1, 60, f'10.0.0.{i}'))
+    # every owner name after the question is a 2-byte pointer
+    assert len(encode_message(response)) == 12 + 21 + 10 * (2 + 10 + 4)
+
+
+def test_malformed_messages_are_rejected():
+    data = bytearray(dns.message.make_query('www.example.com', 'A').to_wire())
+    with pytest.raises(WireFormatError):
+        decode_message(bytes(data[:20]))
+    # a name pointing to itself
+    data[12:14] = b'\xc0\x0c'
+    with pytest.raises(WireFormatError):
+        decode_message(bytes(data))
+
+
+def test_wire_responses_are_cached_with_id_and_ttl(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(response_cache_module, 'time', lambda: now[0])
+    cache = ResponseCache(10)
+    query = dns.message.make_query('www.example.com', 'AAAA')
+    assert cache.put_wire(query.to_wire(), decode_message(_response().to_wire()))
+
+    now[0] += 10
+    other = dns.message.make_query('www.example.com', 'AAAA')
+    cached = dns.message.from_wire(cache.get_wire(other.to_wire()))
+    assert cached.id == other.id
+    assert all(rrset.ttl == 290 for rrset in cached.answer + cached.authority + cached.additional)
+    assert cache.get_wire(dns.message.make_query('www.example.com', 'A').to_wire()) is None
+
+
+class NS(NameServer):
+    def __init__(self):
+        super().__init__(worker_index=1, database=DictStore('ns'))
+        self.response_cache = ResponseCache(10)
+        self.handled = 0
+
+    def handle_query(self, query_message: Message) -> Message:
+        self.handled += 1
+        response = Message(request=query_message)
+        response.add_a_new_record_to_answer_section(
+            ResourceRecord(query_message.question.qname + '.', 1, 1, 60, '10.0.0.1'))
+        return response
+
+
+def test_name_server_answers_wire_queries(monkeypatch):
+    monkeypatch.setattr(Configurator, 'MESSAGE_FORMAT', 'wire')
+    ns = NS()
+    for _ in range(2):
+        query = dns.message.make_query('www.example.com', 'A')
+        response = dns.message.from_wire(ns.answer(query.to_wire()))
+        assert query.is_response(response)
+        assert response.flags & dns.flags.RA
+        assert str(response.answer[0][0]) == '10.0.0.1'
+    assert ns.handled == 1
+
+    response = dns.message.from_wire(ns.servfail(query.to_wire()))
+    assert response.rcode() == dns.rcode.SERVFAIL
+
+
+class FailingNS(NameServer):
+    def __init__(self):
+        super().__init__(worker_index=1, database=DictStore('ns'))
+        self.response_cache = None
+
+    def handle_query(self, query_message: Message):
+        # no upstream answered
+        return None
+
+
+def test_wire_queries_are_never_left_unanswered(monkeypatch):
+    monkeypatch.setattr(Configurator, 'MESSAGE_FORMAT', 'wire')
+    query = dns.message.make_query('www.example.com', 'A')
+    response = dns.message.from_wire(FailingNS().answer(query.to_wire(), udp=True))
+    assert query.is_response(response) and response.rcode() == dns.rcode.SERVFAIL
+    assert response.flags & dns.flags.RA
+
+    # names Message cannot hold are answered with FORMERR, with the question of the query
+    for name in ('.', 'com.'):
+        query = dns.message.make_query(name, 'NS')
+        response = dns.message.from_wire(NS().answer(query.to_wire()))
+        assert query.is_response(response) and response.rcode() == dns.rcode.FORMERR
+
+    # so are messages whose question cannot be read, without it
+    data = bytearray(dns.message.make_query('www.example.com', 'A').to_wire())
+    data[12:14] = b'\xc0\x0c'
+    response = dns.message.from_wire(NS().answer(bytes(data)))
+    assert response.id == int.from_bytes(data[:2], 'big') and response.rcode() == dns.rcode.FORMERR
+    assert response.question == []
+    # responses are not answered
+    assert NS().answer(dns.message.make_response(query).to_wire()) is None
+
+
+def test_names_keep_their_case():
+    buffer, compression = bytearray(), {}
+    encode_name(buffer, 'Www.Example.COM.', compression)
+    encode_name(buffer, 'web.example.com.', compression)
+    # the second name points to the first one whatever their case
+    assert bytes(buffer[17:]) == b'\x03web\xc0\x04'
+    assert decode_name(bytes(buffer), 0) == ('Www.Example.COM', 17)
+    assert decode_name(bytes(buffer), 17)[0] == 'web.Example.COM'
+
+
+def test_wire_responses_echo_the_case_of_the_question(monkeypatch):
+    monkeypatch.setattr(Configurator, 'MESSAGE_FORMAT', 'wire')
+    ns = NS()
+    for name in ('wWw.ExAmple.cOm', 'WWW.example.COM'):
+        query = dns.message.make_query(name, 'A')
+        data = ns.answer(query.to_wire())
+        assert query.is_response(dns.message.from_wire(data))
+        assert name.encode('ascii').split(b'.')[1] in data
+    # the second query, in another case, is answered from the response cache
+    assert ns.handled == 1
+
+
+def test_other_opcodes_are_not_implemented(monkeypatch):
+    monkeypatch.setattr(Configurator, 'MESSAGE_FORMAT', 'wire')
+    ns = NS()
+    for opcode in (dns.opcode.STATUS, dns.opcode.NOTIFY):
+        query = dns.message.make_query('www.example.com', 'A')
+        query.set_opcode(opcode)
+        response = dns.message.from_wire(ns.answer(query.to_wire()))
+        assert response.id == query.id and response.rcode() == dns.rcode.NOTIMP
+    assert ns.handled == 0
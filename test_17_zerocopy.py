@@ -0,0 +1,89 @@
+import socket
+import threading
+from time import sleep
+import dns.message
+from BufferPool import BufferPool
+from NameServer import NameServer
+from DictStore import DictStore
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from ParseString import parse_string_msg, parse_string_flag
+from WireFormat import decode_message
+from configurator import Configurator
+from AES import AESCipher
+
+
+def _query(name, message_id):
+    return Message(header=MessageHeader(id=message_id), question=MessageQuestion(name, 1, 1)).to_string()
+
+
+def test_buffer_pool_reuses_buffers():
+    pool = BufferPool(512, 2)
+    first, second = pool.take(), pool.take()
+    third = pool.take()
+    assert len(third) == 512 and pool.stats['allocated'] == 1
+
+    for buffer in (first, second, third):
+        pool.give(buffer)
+    assert pool.take() is third
+    assert pool.stats == dict(taken=4, allocated=1, free=2)
+
+
+def test_messages_are_decoded_from_a_view_over_a_receive_buffer():
+    buffer = bytearray(b'\xff' * 4096)
+
+    text = AESCipher().encrypt(_query('www.google.com', 7))
+    buffer[:len(text)] = text
+    assert AESCipher().decrypt(memoryview(buffer)[:len(text)]) == _query('www.google.com', 7)
+
+    wire = dns.message.make_query('www.Example.com', 'MX', want_dnssec=True).to_wire()
+    buffer[:len(wire)] = wire
+    message = decode_message(memoryview(buffer)[:len(wire)])
+    assert message.question.qname == 'www.example.com' and message.question.qtype == 15
+    # the EDNS OPT record is skipped without reading its name
+    assert message.additional == []
+
+    assert parse_string_flag('0x8583') == dict(qr=1, opcode=0, aa=True, tc=False, rd=True, ra=True, z=0, rcode=3)
+
+
+class NS(NameServer):
+    def __init__(self):
+        super().__init__(worker_index=1, database=DictStore('ns'))
+
+    def handle_query(self, query_message: Message) -> Message:
+        response = Message(request=query_message)
+        response.add_a_new_record_to_answer_section(
+            ResourceRecord(query_message.question.qname + '.', 1, 1, 60, '127.0.0.1'))
+        return response
+
+
+def test_udp_listener_receives_into_pooled_buffers(monkeypatch):
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    monkeypatch.setattr(Configurator, 'IP', '127.0.0.1')
+    monkeypatch.setattr(Configurator, 'UDP_PORT', port)
+    monkeypatch.setattr(Configurator, 'WORKER_THREADS', 2)
+    monkeypatch.setattr(Configurator, 'WORKER_QUEUE_SIZE', 4)
+
+    ns = NS()
+    threading.Thread(target=ns.start_listening_udp, daemon=True).start()
+    sleep(0.2)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(2)
+    for message_id in range(20):
+        client.sendto(AESCipher().encrypt(_query(f'host{message_id}.google.com', message_id)), ('127.0.0.1', port))
+        response = parse_string_msg(AESCipher().decrypt(client.recv(4096)))
+        assert response.header.id == message_id
+        assert response.answers[0].name == f'host{message_id}.google.com.'
+    client.close()
+
+    sleep(0.1)
+    # every datagram went into one of the preallocated buffers, which were all given back
+    buffers = ns.get_udp_pool_stats()['buffers']
+    assert buffers['allocated'] == 0
+    assert buffers['free'] == 4 + 2 + 1 - 1  # the listener holds one for the next datagram
@@ -0,0 +1,139 @@
+import argparse
+import socket
+import threading
+from time import sleep
+import dns.message
+import dns.flags
+from NameServer import NameServer
+from DictStore import DictStore
+from Resolver import Resolver
+from Database import Database
+from Message import Message
+from MessageHeader import MessageHeader
+from MessageQuestion import MessageQuestion
+from ResourceRecord import ResourceRecord
+from ParseString import parse_string_msg
+from configurator import Configurator
+from AES import AESCipher
+from BufferPool import BufferPool
+import UserScript
+
+RECORDS = 60
+
+
+def _free_port(kind):
+    probe = socket.socket(socket.AF_INET, kind)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def _query(name, payload_size=None):
+    message = Message(header=MessageHeader(id=7), question=MessageQuestion(name, 1, 1))
+    message.payload_size = payload_size
+    return message
+
+
+def _big_response(query):
+    response = Message(request=query)
+    for i in range(RECORDS):
+        response.add_a_new_record_to_answer_section(
+            ResourceRecord(query.question.qname + '.', 1, 1, 60, f'10.0.{i // 250}.{i % 250}'))
+    response.add_a_new_record_to_additional_section(ResourceRecord('ns.google.com.', 1, 1, 60, '10.1.0.1'))
+    return response
+
+
+def test_messages_are_cut_at_record_boundaries():
+    response = _big_response(_query('big.google.com'))
+    response.payload_size = 1232
+    assert parse_string_msg(response.to_string()).payload_size == 1232
+
+    # leaving out only Additional records does not set TC
+    kept = response.truncated(RECORDS)
+    assert len(kept.answers) == RECORDS and kept.additional == [] and not kept.header.tc
+    kept = response.truncated(10)
+    assert len(kept.answers) == 10 and kept.header.tc and kept.header.ancount == 10
+
+    data, truncated = response.fit(lambda message: message.to_string().encode(), 512)
+    assert truncated and len(data) <= 512
+    message = parse_string_msg(data.decode())
+    assert message.header.tc and 0 < len(message.answers) < RECORDS
+    assert len(message.to_string() + message.answers[0].to_string()) > 512
+
+
+class NS(NameServer):
+    def __init__(self):
+        super().__init__(worker_index=1, database=DictStore('ns'))
+
+    def handle_query(self, query_message: Message) -> Message:
+        return _big_response(query_message)
+
+
+def test_name_server_truncates_to_the_advertised_size(monkeypatch):
+    ns = NS()
+    query = AESCipher().encrypt(_query('big.google.com').to_string())
+    response = parse_string_msg(AESCipher().decrypt(ns.answer(query, udp=True)))
+    assert response.header.tc and len(ns.answer(query, udp=True)) <= 512
+    # over TCP, or with a large enough payload size, the whole answer is sent
+    assert len(parse_string_msg(AESCipher().decrypt(ns.answer(query))).answers) == RECORDS
+    monkeypatch.setattr(Configurator, 'UDP_PAYLOAD_SIZE', 4096)
+    data = ns.answer(AESCipher().encrypt(_query('big.google.com', 4096).to_string()), udp=True)
+    response = parse_string_msg(AESCipher().decrypt(data))
+    assert not response.header.tc and response.payload_size == 4096
+
+    # in the wire format, the payload size is the one of the EDNS OPT record
+    monkeypatch.setattr(Configurator, 'MESSAGE_FORMAT', 'wire')
+    monkeypatch.setattr(Configurator, 'UDP_PAYLOAD_SIZE', 1232)
+    query = dns.message.make_query('big.google.com', 'A')
+    data = ns.answer(query.to_wire(), udp=True)
+    assert len(data) <= 512 and dns.message.from_wire(data).flags & dns.flags.TC
+    assert len(dns.message.from_wire(ns.answer(query.to_wire())).answer[0]) == RECORDS
+    # the compressed answer fits in the size advertised by the query
+    query = dns.message.make_query('big.google.com', 'A', use_edns=0, payload=4096)
+    response = dns.message.from_wire(ns.answer(query.to_wire(), udp=True))
+    assert not response.flags & dns.flags.TC and len(response.answer[0]) == RECORDS
+    assert response.payload == 1232
+
+
+def test_resolver_retries_truncated_responses_over_tcp(monkeypatch):
+    udp_port, tcp_port = _free_port(socket.SOCK_DGRAM), _free_port(socket.SOCK_STREAM)
+    monkeypatch.setattr(Configurator, 'IP', '127.0.0.1')
+    monkeypatch.setattr(Configurator, 'UDP_PORT', udp_port)
+    monkeypatch.setattr(Configurator, 'TCP_PORT', tcp_port)
+    monkeypatch.setattr(Configurator, 'OTHERS', [dict(ip='127.0.0.1', udp=udp_port, tcp=tcp_port)])
+    ns = NS()
+    threading.Thread(target=ns.start_listening_udp, daemon=True).start()
+    threading.Thread(target=ns.start_listening_tcp, daemon=True).start()
+    sleep(0.2)
+
+    resolver = Resolver.__new__(Resolver)
+    resolver.this_ns_idx = 0
+    resolver.receive_buffers = BufferPool(Configurator.BUFFER_SIZE, 1)
+    resolver._ns_lock = threading.Lock()
+    resolver._tcp_connections = {}
+    resolver._tcp_lock = threading.Lock()
+    response = parse_string_msg(resolver._use_udp(_query('big.google.com', 1232).to_string()))
+    assert not response.header.tc and len(response.answers) == RECORDS
+
+
+def test_user_script_retries_truncated_responses_over_tcp(tmp_path, monkeypatch):
+    udp_port, tcp_port = _free_port(socket.SOCK_DGRAM), _free_port(socket.SOCK_STREAM)
+    monkeypatch.setattr(Configurator, 'IP', '127.0.0.1')
+    monkeypatch.setattr(Configurator, 'UDP_PORT', udp_port)
+    monkeypatch.setattr(Configurator, 'TCP_PORT', tcp_port)
+
+    resolver = Resolver.__new__(Resolver)
+    resolver.database = Database(str(tmp_path / 'resolver.db'))
+    resolver.prefetcher = None
+    resolver.database.add_many(_big_response(_query('big.google.com')).answers)
+    threading.Thread(target=resolver.start_listening_udp, daemon=True).start()
+    threading.Thread(target=resolver.start_listening_tcp, daemon=True).start()
+    sleep(0.2)
+
+    args = argparse.Namespace(qname='big.google.com', qtype='A', qclass='IN', resolver_ip='127.0.0.1',
+                              resolver_port=udp_port, resolver_tcp_port=tcp_port, protocol='udp', secure=1,
+                              payload_size=1232)
+    response = parse_string_msg(UserScript.make_query(args))
+    assert not response.header.tc and len(response.answers) == RECORDS
+    resolver.database.close()